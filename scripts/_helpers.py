@@ -5,25 +5,19 @@
 
 # -*- coding: utf-8 -*-
 
+import functools
 import io
 import logging
 import os
+import re
 import shutil
 import subprocess
 import sys
 import time
-import zipfile
 from pathlib import Path
 
-import country_converter as coco
-import geopandas as gpd
 import numpy as np
 import pandas as pd
-import requests
-import yaml
-from fake_useragent import UserAgent
-from pypsa.components import component_attrs, components
-from shapely.geometry import Point
 
 logger = logging.getLogger(__name__)
 
@@ -41,12 +35,30 @@ BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
 # absolute path to config.default.yaml
 CONFIG_DEFAULT_PATH = os.path.join(BASE_DIR, "config.default.yaml")
 
+# directory of the persistent cache of cutout indicator matrices
+INDICATOR_MATRIX_CACHE_DIR = os.path.join(BASE_DIR, "resources", "indicator_matrices")
+
+# directory of the persistent cache of processed cost tables
+COSTS_CACHE_DIR = os.path.join(BASE_DIR, "resources", "costs_cache")
+# to be increased when a change in the preparation of the cost tables is not
+# reflected in the source of the cached functions or of annuity
+COSTS_CACHE_VERSION = 1
+
+# Monte Carlo uncertainty keys, e.g.
+# generators_t.p_max_pu.loc[:, n.generators.carrier == "onwind"]
+UNCERTAINTY_KEY_PATTERN = re.compile(
+    r"(?P<list_name>[a-z_]+?)(?P<varying>_t)?\.(?P<attr>\w+)"
+    r"(?:\.loc\[\s*:\s*,\s*n\.(?P<sel_list_name>[a-z_]+)\.(?P<sel_attr>\w+)"
+    r"\s*==\s*(?P<quote>[\"'])(?P<sel_value>.*?)(?P=quote)\s*\])?"
+)
+
 
 def check_config_version(config, fp_config=CONFIG_DEFAULT_PATH):
     """
     Check that a version of the local config.yaml matches to the actual config
     version as defined in config.default.yaml.
     """
+    import yaml
 
     # using snakemake capabilities to deal with yanl configs
     with open(fp_config, "r") as f:
@@ -140,6 +152,8 @@ def read_osm_config(*args):
     >>> print(world_iso)
     {"Africa": {"DZ": "algeria", ...}, ...}
     """
+    import yaml
+
     if "__file__" in globals():
         base_folder = os.path.dirname(__file__)
         if not os.path.exists(os.path.join(base_folder, "configs")):
@@ -168,6 +182,10 @@ def configure_logging(snakemake, skip_handlers=False):
     Additional keywords from logging.basicConfig are accepted via the snakemake configuration
     file under snakemake.config.logging.
 
+    If ``logging: profiling`` is set in the configuration or the environment
+    variable ``PYPSA_EARTH_PROFILE`` is set to a non-zero value, the remainder
+    of the script is profiled, see :func:`start_profiling`.
+
     Parameters
     ----------
     snakemake : snakemake object
@@ -179,14 +197,17 @@ def configure_logging(snakemake, skip_handlers=False):
 
     kwargs = snakemake.config.get("logging", dict()).copy()
     kwargs.setdefault("level", "INFO")
+    profiling = kwargs.pop("profiling", False)
+    profiling_top = kwargs.pop("profiling_top", 25)
+
+    fallback_path = Path(__file__).parent.joinpath(
+        "..", "logs", f"{snakemake.rule}.log"
+    )
+    logfile = snakemake.log.get(
+        "python", snakemake.log[0] if snakemake.log else fallback_path
+    )
 
     if skip_handlers is False:
-        fallback_path = Path(__file__).parent.joinpath(
-            "..", "logs", f"{snakemake.rule}.log"
-        )
-        logfile = snakemake.log.get(
-            "python", snakemake.log[0] if snakemake.log else fallback_path
-        )
         kwargs.update(
             {
                 "handlers": [
@@ -199,6 +220,106 @@ def configure_logging(snakemake, skip_handlers=False):
         )
     logging.basicConfig(**kwargs, force=True)
 
+    if os.environ.get("PYPSA_EARTH_PROFILE", "0") not in ["", "0"] or profiling:
+        start_profiling(logfile, top=profiling_top)
+
+
+_PROFILING = False
+
+# peak traced memory before the last reset of the peak by a timed function
+_PEAK_MEMORY = 0
+
+
+def start_profiling(logfile, top=25):
+    """
+    Profile the running script with cProfile and tracemalloc until it exits.
+
+    At exit, the cProfile statistics are written to ``<logfile>.prof`` (open
+    e.g. with ``snakeviz``) and the ``top`` source lines allocating the most
+    memory to ``<logfile>.memory.log``, next to the log file of the rule.
+    Functions decorated with :func:`timed` log their run time and peak memory.
+
+    Parameters
+    ----------
+    logfile : str or Path
+        Log file of the rule.
+    top : int
+        Number of source lines in the allocation report.
+    """
+    import atexit
+    import cProfile
+    import tracemalloc
+
+    global _PROFILING
+
+    if _PROFILING:
+        return
+    _PROFILING = True
+
+    logfile = Path(logfile)
+    tracemalloc.start()
+    profile = cProfile.Profile()
+
+    def write_reports():
+        profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        peak = max(peak, _PEAK_MEMORY)
+        tracemalloc.stop()
+
+        profile.dump_stats(logfile.with_suffix(".prof"))
+        statistics = snapshot.filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)]
+        ).statistics("lineno")
+        with open(logfile.with_suffix(".memory.log"), "w") as f:
+            f.write(f"Peak traced memory: {peak / 1e6:.1f} MB\n")
+            f.write(f"Top {top} allocations by source line at exit:\n")
+            for stat in statistics[:top]:
+                f.write(f"{stat}\n")
+        logger.info(
+            f"Profiling results written to {logfile.with_suffix('.prof')} "
+            f"(peak traced memory {peak / 1e6:.1f} MB)"
+        )
+
+    atexit.register(write_reports)
+    profile.enable()
+
+
+def timed(func):
+    """
+    Decorator logging the run time and the peak traced memory of ``func``.
+
+    Only active while profiling, see :func:`start_profiling`, otherwise the
+    function is called without overhead.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _PROFILING:
+            return func(*args, **kwargs)
+
+        import tracemalloc
+
+        global _PEAK_MEMORY
+
+        start_memory, peak = tracemalloc.get_traced_memory()
+        if hasattr(tracemalloc, "reset_peak"):  # python >= 3.9
+            # keep the process-wide peak for the report at exit
+            _PEAK_MEMORY = max(_PEAK_MEMORY, peak)
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            logger.info(
+                f"{func.__module__}.{func.__qualname__} took {elapsed:.2f} s, "
+                f"peak memory {(peak - start_memory) / 1e6:.1f} MB"
+            )
+
+    return wrapper
+
 
 def load_network(import_name=None, custom_components=None):
     """
@@ -252,6 +373,150 @@ def load_network(import_name=None, custom_components=None):
     )
 
 
+def export_network(n, path, compression="zlib", complevel=4, float32=False):
+    """
+    Write a network to netCDF with compressed and optionally single-precision
+    time series.
+
+    Parameters
+    ----------
+    n : pypsa.Network
+    path : str
+        Path of the netCDF file.
+    compression : str
+        Compression of the numeric variables, either "zlib" or "none".
+    complevel : int
+        Compression level.
+    float32 : bool
+        Store the time series in single precision.
+    """
+    if compression not in ["zlib", "none"]:
+        raise ValueError(
+            f"Unsupported compression '{compression}' of the network files, "
+            "expected 'zlib' or 'none'."
+        )
+
+    ds = n.export_to_netcdf()
+
+    encoding = {}
+    for name, var in ds.data_vars.items():
+        varying = "snapshots" in var.dims and var.ndim > 1
+        if float32 and varying and var.dtype == np.float64:
+            ds[name] = var = var.astype(np.float32)
+        if var.dtype.kind in "biuf":
+            # overrides the encoding set by pypsa
+            encoding[name] = {"zlib": compression == "zlib", "complevel": complevel}
+
+    ds.to_netcdf(path, encoding=encoding)
+
+
+class LazyTimeSeries(dict):
+    """
+    Time-varying attributes of a component which are read from the netCDF
+    file of the network on first access.
+
+    The attribute access mirrors ``pypsa.descriptors.Dict``, e.g.
+    ``n.generators_t.p_max_pu``, without importing pypsa with this module.
+    """
+
+    def __init__(self, pnl, ds, variables, component, network):
+        super().__init__(pnl)
+        # bypass __setattr__ which stores attributes as items
+        object.__setattr__(self, "_ds", ds)
+        object.__setattr__(self, "_variables", dict(variables))
+        object.__setattr__(self, "_component", component)
+        object.__setattr__(self, "_network", network)
+
+    def __getattr__(self, attr):
+        try:
+            return self[attr]
+        except KeyError as e:
+            raise AttributeError(e.args[0])
+
+    def __setattr__(self, attr, value):
+        self[attr] = value
+
+    def __delattr__(self, attr):
+        self._variables.pop(attr, None)
+        dict.pop(self, attr, None)
+
+    def __dir__(self):
+        return dict.keys(self)
+
+    def __getitem__(self, attr):
+        if attr in self._variables:
+            df = self._ds[self._variables.pop(attr)].to_pandas()
+            df.index = self._network.snapshots
+            if (df.dtypes == np.float32).any():
+                df = df.astype({col: np.float64 for col in df.columns})
+            # only non-default columns are stored, which are completed as in
+            # pypsa.Network.import_from_netcdf
+            self._network.import_series_from_dataframe(df, self._component, attr)
+        return dict.__getitem__(self, attr)
+
+    def __setitem__(self, attr, value):
+        self._variables.pop(attr, None)
+        dict.__setitem__(self, attr, value)
+
+    def _load_all(self):
+        for attr in list(self._variables):
+            self[attr]
+
+    def get(self, attr, default=None):
+        return self[attr] if attr in self else default
+
+    def items(self):
+        self._load_all()
+        return dict.items(self)
+
+    def values(self):
+        self._load_all()
+        return dict.values(self)
+
+
+def load_network_lazy(path, **kwargs):
+    """
+    Load a network reading the static component tables eagerly and the time
+    series of each attribute only on first access.
+
+    Parameters
+    ----------
+    path : str
+        Path of the netCDF file.
+    **kwargs
+        Further keyword arguments passed to ``pypsa.Network``.
+
+    Returns
+    -------
+    pypsa.Network
+    """
+    import pypsa
+    import xarray as xr
+
+    n = pypsa.Network(**kwargs)
+    n.import_from_netcdf(path, skip_time=True)
+
+    ds = xr.open_dataset(path)
+
+    lazy = {}
+    for c in n.all_components:
+        prefix = n.components[c]["list_name"] + "_t_"
+        variables = {
+            name[len(prefix) :]: name
+            for name in ds.data_vars
+            if name.startswith(prefix)
+        }
+        if variables:
+            lazy[c] = variables
+
+    for c, variables in lazy.items():
+        list_name = n.components[c]["list_name"]
+        pnl = LazyTimeSeries(n.pnl(c), ds, variables, c, n)
+        setattr(n, list_name + "_t", pnl)
+
+    return n
+
+
 def pdbcast(v, h):
     return pd.DataFrame(
         v.values.reshape((-1, 1)) * h.values, index=v.index, columns=h.index
@@ -261,10 +526,9 @@ def pdbcast(v, h):
 def load_network_for_plots(
     fn, tech_costs, cost_config, elec_config, combine_hydro_ps=True
 ):
-    import pypsa
     from add_electricity import load_costs, update_transmission_costs
 
-    n = pypsa.Network(fn)
+    n = load_network_lazy(fn)
 
     n.loads["carrier"] = n.loads.bus.map(n.buses.carrier) + " load"
     n.stores["carrier"] = n.stores.bus.map(n.buses.carrier)
@@ -400,7 +664,14 @@ def aggregate_costs(n, flatten=False, opts=None, existing_only=False):
 
 
 def progress_retrieve(
-    url, file, data=None, headers=None, disable_progress=False, roundto=1.0
+    url,
+    file,
+    data=None,
+    headers=None,
+    disable_progress=False,
+    roundto=1.0,
+    resume=False,
+    chunk_size=2**20,
 ):
     """
     Function to download data from a url with a progress bar progress in
@@ -414,13 +685,28 @@ def progress_retrieve(
         File where to save the output
     data : dict
         Data for the request (default None), when not none Post method is used
+    headers : dict
+        Headers for the request (default None); when given, or when resume is
+        enabled, the response is streamed to file in chunks of chunk_size bytes
     disable_progress : bool
         When true, no progress bar is shown
     roundto : float
         (default 0) Precision used to report the progress
         e.g. 0.1 stands for 88.1, 10 stands for 90, 80
+    resume : bool
+        When true and file already exists, only the missing bytes are requested
+        by an HTTP Range request and appended to file. The ETag or
+        Last-Modified header and the total length of the download are stored
+        next to file while it is incomplete; the partial file is only completed
+        if the server reports the same resource, otherwise, or if the server
+        does not support range requests, the file is downloaded from scratch.
+    chunk_size : int
+        Size in bytes of the chunks written to file when streaming
     """
-    import urllib
+    import json
+    import urllib.error
+    import urllib.parse
+    import urllib.request
 
     from tqdm import tqdm
 
@@ -433,11 +719,91 @@ def progress_retrieve(
     if data is not None:
         data = urllib.parse.urlencode(data).encode()
 
-    if headers:
-        req = urllib.request.Request(url, headers=headers)
-        with urllib.request.urlopen(req) as response:
-            with open(file, "wb") as f:
-                f.write(response.read())
+    if headers or resume:
+        request_headers = dict(headers or {})
+        state_file = f"{file}.resume"
+        state = {}
+        if resume and os.path.exists(state_file):
+            with open(state_file) as f:
+                state = json.load(f)
+        # a partial file can only be completed if its origin is known
+        offset = 0
+        if resume and os.path.exists(file) and state.get("validator"):
+            offset = os.path.getsize(file)
+        if offset > 0:
+            request_headers["Range"] = f"bytes={offset}-"
+            # the server sends the whole file if the resource has changed
+            request_headers["If-Range"] = state["validator"]
+
+        def restart():
+            # the partial file does not belong to the resource: start over
+            pbar.close()
+            for path in [file, state_file]:
+                if os.path.exists(path):
+                    os.remove(path)
+            return progress_retrieve(
+                url, file, data, headers, disable_progress, roundto, resume, chunk_size
+            )
+
+        req = urllib.request.Request(url, data=data, headers=request_headers)
+        try:
+            response = urllib.request.urlopen(req)
+        except urllib.error.HTTPError as e:
+            if e.code == 416 and offset > 0:
+                # range not satisfiable: the partial file may be complete
+                content_range = e.headers.get("Content-Range", "")
+                m = re.match(r"bytes \*/(\d+)$", content_range)
+                if m is not None and int(m.group(1)) == offset == state.get("length"):
+                    pbar.close()
+                    os.remove(state_file)
+                    return
+                return restart()
+            raise
+
+        with response:
+            total_size = response.length
+            if response.status == 206:
+                m = re.match(
+                    r"bytes (\d+)-\d+/(\d+)$", response.headers.get("Content-Range", "")
+                )
+                if (
+                    m is None
+                    or int(m.group(1)) != offset
+                    or int(m.group(2)) != state.get("length")
+                ):
+                    response.close()
+                    return restart()
+                total_size = int(m.group(2))
+            else:
+                # the whole file is sent, e.g. if the server does not support
+                # range requests or if the resource has changed
+                offset = 0
+                validator = response.headers.get("ETag") or response.headers.get(
+                    "Last-Modified"
+                )
+                if resume and validator and total_size is not None:
+                    with open(state_file, "w") as f:
+                        json.dump({"validator": validator, "length": total_size}, f)
+                elif os.path.exists(state_file):
+                    os.remove(state_file)
+
+            with open(file, "ab" if offset > 0 else "wb") as f:
+                count = offset
+                while chunk := response.read(chunk_size):
+                    f.write(chunk)
+                    count += len(chunk)
+                    if total_size:
+                        dlProgress(count, 1, total_size)
+
+        pbar.close()
+        if total_size is not None and count < total_size:
+            # the partial file and its state are kept to resume the download
+            raise urllib.error.ContentTooShortError(
+                f"retrieval incomplete: got only {count} out of {total_size} bytes",
+                None,
+            )
+        if os.path.exists(state_file):
+            os.remove(state_file)
 
     else:
         urllib.request.urlretrieve(url, file, reporthook=dlProgress, data=data)
@@ -465,6 +831,9 @@ def content_retrieve(url, data=None, headers=None, max_retries=3, backoff_factor
     backoff_factor : float, optional
         Factor to apply between attempts, by default 0.3
     """
+    import requests
+    from fake_useragent import UserAgent
+
     if headers is None:
         ua = UserAgent()
         headers = {
@@ -550,6 +919,7 @@ def mock_snakemake(
     import os
 
     import snakemake as sm
+    import yaml
     from pypsa.descriptors import Dict
     from snakemake.script import Snakemake
 
@@ -631,6 +1001,81 @@ def mock_snakemake(
     return snakemake
 
 
+# combined countries modelled as a single country, by 2-digit codes of the parts
+COMBINED_COUNTRIES = {"SN-GM": ("SN", "GM")}
+
+
+@functools.lru_cache(maxsize=None)
+def get_country_converter():
+    """
+    Country converter shared by the process.
+
+    Building a country_converter.CountryConverter loads the full country table,
+    which is done once per process and reused by all conversions.
+    """
+    import country_converter as coco
+
+    return coco.CountryConverter()
+
+
+@functools.lru_cache(maxsize=None)
+def _coco_convert(code, to, src=None, not_found="not found"):
+    return get_country_converter().convert(code, src=src, to=to, not_found=not_found)
+
+
+@functools.lru_cache(maxsize=None)
+def _convert_country_code(code, to, src=None, not_found="not found"):
+    """
+    Memoized conversion of a country code or name using the shared converter.
+
+    Combined countries in COMBINED_COUNTRIES are recognized in their 2-digit,
+    3-digit or short name form and converted part by part.
+    """
+    for parts in COMBINED_COUNTRIES.values():
+        for fmt in ["ISO2", "ISO3", "name_short"]:
+            if code == "-".join(_coco_convert(p, fmt) for p in parts):
+                return "-".join(_coco_convert(p, to) for p in parts)
+
+    return _coco_convert(code, to, src, not_found)
+
+
+def convert_country_codes(codes, to="ISO3", src=None, not_found="not found"):
+    """
+    Convert an array of country codes or names.
+
+    Every unique value is converted only once by the memoized converter, so
+    that converting the columns of large tables does not require a converter
+    call per row.
+
+    Parameters
+    ----------
+    codes: pd.Series, pd.Index or list-like
+        country codes or names to convert; missing values are kept
+    to: str
+        target classification of country_converter, e.g. "ISO2", "ISO3" or "name_short"
+    src: str (optional, default None)
+        source classification; when None, it is guessed by country_converter
+    not_found: str or None
+        value for codes that are not recognized; when None, the code is kept
+
+    Returns
+    ----------
+    converted codes: pd.Series or pd.Index when codes is a pandas object, else list
+    """
+    if not isinstance(codes, (pd.Series, pd.Index)):
+        return list(
+            convert_country_codes(
+                pd.Series(list(codes), dtype=object), to, src, not_found
+            )
+        )
+
+    mapping = {
+        code: _convert_country_code(code, to, src, not_found)
+        for code in codes.dropna().unique()
+    }
+    return codes.map(mapping)
+
+
 def two_2_three_digits_country(two_code_country):
     """
     Convert 2-digit to 3-digit country code:
@@ -645,11 +1090,7 @@ def two_2_three_digits_country(two_code_country):
     three_code_country: str
         3-digit country name
     """
-    if two_code_country == "SN-GM":
-        return f"{two_2_three_digits_country('SN')}-{two_2_three_digits_country('GM')}"
-
-    three_code_country = coco.convert(two_code_country, to="ISO3")
-    return three_code_country
+    return _convert_country_code(two_code_country, "ISO3")
 
 
 def three_2_two_digits_country(three_code_country):
@@ -666,11 +1107,7 @@ def three_2_two_digits_country(three_code_country):
     two_code_country: str
         2-digit country name
     """
-    if three_code_country == "SEN-GMB":
-        return f"{three_2_two_digits_country('SN')}-{three_2_two_digits_country('GM')}"
-
-    two_code_country = coco.convert(three_code_country, to="ISO2")
-    return two_code_country
+    return _convert_country_code(three_code_country, "ISO2")
 
 
 def two_digits_2_name_country(two_code_country, nocomma=False, remove_start_words=[]):
@@ -693,10 +1130,7 @@ def two_digits_2_name_country(two_code_country, nocomma=False, remove_start_word
     full_name: str
         full country name
     """
-    if two_code_country == "SN-GM":
-        return f"{two_digits_2_name_country('SN')}-{two_digits_2_name_country('GM')}"
-
-    full_name = coco.convert(two_code_country, to="name_short")
+    full_name = _convert_country_code(two_code_country, "name_short")
 
     if nocomma:
         # separate list by delim
@@ -733,14 +1167,7 @@ def country_name_2_two_digits(country_name):
     two_code_country: str
         2-digit country name
     """
-    if (
-        country_name
-        == f"{two_digits_2_name_country('SN')}-{two_digits_2_name_country('GM')}"
-    ):
-        return "SN-GM"
-
-    full_name = coco.convert(country_name, to="ISO2")
-    return full_name
+    return _convert_country_code(country_name, "ISO2")
 
 
 def read_csv_nafix(file, **kwargs):
@@ -798,6 +1225,8 @@ def read_geojson(fn, cols=[], dtype=None, crs="EPSG:4326"):
     crs : str
         CRS of the GeoDataFrame
     """
+    import geopandas as gpd
+
     # if the file is non-zero, read the geodataframe and return it
     if os.path.getsize(fn) > 0:
         return gpd.read_file(fn)
@@ -930,15 +1359,79 @@ def annuity(n, r):
     """
 
     if isinstance(r, pd.Series):
-        return pd.Series(1 / n, index=r.index).where(
-            r == 0, r / (1.0 - 1.0 / (1.0 + r) ** n)
-        )
+        n = np.asarray(n, dtype=float)
+        r_ = r.to_numpy(dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            factor = np.where(r_ == 0, 1 / n, r_ / (1.0 - 1.0 / (1.0 + r_) ** n))
+        return pd.Series(factor, index=r.index)
     elif r > 0:
         return r / (1.0 - 1.0 / (1.0 + r) ** n)
     else:
         return 1 / n
 
 
+def cache_costs(func):
+    """
+    Cache the cost table returned by ``func`` as Parquet file in
+    COSTS_CACHE_DIR.
+
+    The cache key is a hash of the content of the cost file passed as first
+    argument, of the remaining arguments, of the source of ``func`` and of
+    :func:`annuity`, of COSTS_CACHE_VERSION and of the pandas version, such
+    that all rules processing the same cost file with the same configuration
+    reuse the table prepared by the first of them. Without ``pyarrow``, the
+    table is prepared on every call.
+    """
+    import hashlib
+    import inspect
+    import json
+
+    signature = inspect.signature(func)
+    source = "\n".join(
+        [
+            inspect.getsource(func),
+            inspect.getsource(annuity),
+            str(COSTS_CACHE_VERSION),
+            pd.__version__,
+        ]
+    )
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return func(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = dict(bound.arguments)
+        cost_file = arguments.pop(next(iter(signature.parameters)))
+
+        key = hashlib.sha256(source.encode())
+        with open(cost_file, "rb") as f:
+            key.update(f.read())
+        key.update(json.dumps(arguments, default=str).encode())
+
+        fn = os.path.join(
+            COSTS_CACHE_DIR, f"{func.__name__}_{key.hexdigest()[:20]}.parquet"
+        )
+        if os.path.isfile(fn):
+            logger.info(f"Loading cached costs from {fn}")
+            return pd.read_parquet(fn)
+
+        costs = func(*args, **kwargs)
+        os.makedirs(COSTS_CACHE_DIR, exist_ok=True)
+        tmp_fn = fn.replace(".parquet", f".{os.getpid()}.tmp.parquet")
+        costs.to_parquet(tmp_fn)
+        os.replace(tmp_fn, fn)
+        logger.info(f"Stored costs in cache {fn}")
+        return costs
+
+    return wrapper
+
+
+@cache_costs
 def prepare_costs(
     cost_file: str, USD_to_EUR: float, fill_values: dict, Nyears: float | int = 1
 ):
@@ -955,12 +1448,11 @@ def prepare_costs(
     )
     costs = costs.fillna(fill_values)
 
-    def annuity_factor(v):
-        return annuity(v["lifetime"], v["discount rate"]) + v["FOM"] / 100
-
-    costs["fixed"] = [
-        annuity_factor(v) * v["investment"] * Nyears for i, v in costs.iterrows()
-    ]
+    costs["fixed"] = (
+        (annuity(costs["lifetime"], costs["discount rate"]) + costs["FOM"] / 100.0)
+        * costs["investment"]
+        * Nyears
+    )
 
     return costs
 
@@ -1020,6 +1512,31 @@ def create_network_topology(
     return topo
 
 
+def get_supply_curve_steps(supply_curve):
+    """
+    Flatten a supply curve indexed by (region, cost step) into one row per
+    step.
+
+    The returned DataFrame has the columns "region", "cost" and "step", i.e.
+    the position of the step in the supply curve of its region, followed by
+    the columns of the supply curve. It allows to add the components of all
+    the steps of all the regions with a single ``n.madd`` per component type.
+
+    Parameters
+    ----------
+    supply_curve : pd.DataFrame
+        Supply curve with a two-level index (region, cost step)
+
+    Returns
+    -------
+    pd.DataFrame
+    """
+    steps = supply_curve.reset_index()
+    steps.columns = ["region", "cost"] + list(supply_curve.columns)
+    steps["step"] = steps.groupby("region", sort=False).cumcount()
+    return steps
+
+
 def create_dummy_data(n, sector, carriers):
     ind = n.buses_t.p.index
     ind = n.buses.index[n.buses.carrier == "AC"]
@@ -1095,6 +1612,392 @@ def cycling_shift(df, steps=1):
     return df
 
 
+def _group_mean(values, starts, counts):
+    """
+    NaN-skipping mean of consecutive groups of rows.
+
+    The groups are accumulated with the compensated summation of
+    ``pandas.core.groupby`` so that the result is identical to
+    ``DataFrame.resample(...).mean()``.
+    """
+    sumx = np.zeros((len(starts), values.shape[1]), dtype=values.dtype)
+    compensation = np.zeros_like(sumx)
+    nobs = np.zeros(sumx.shape, dtype=values.dtype)
+
+    # loop over the position within the groups instead of the rows
+    for k in range(counts.max(initial=0)):
+        g = np.flatnonzero(counts > k)
+        val = values[starts[g] + k]
+        notna = ~np.isnan(val)
+        y = val - compensation[g]
+        t = sumx[g] + y
+        comp = t - sumx[g] - y
+        comp[np.isnan(comp)] = 0
+        compensation[g] = np.where(notna, comp, compensation[g])
+        sumx[g] = np.where(notna, t, sumx[g])
+        nobs[g] += notna
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(nobs > 0, sumx / nobs, np.nan).astype(values.dtype)
+
+
+def aggregate_snapshots(n, snapshots, counts, snapshot_weightings, aggregations=None):
+    """
+    Aggregate the time series of a network to groups of consecutive snapshots.
+
+    The group boundaries are computed once and all time-varying attributes are
+    reduced with array operations. The network is modified in place, so that
+    the static component data is not copied.
+
+    Parameters
+    ----------
+    n : pypsa.Network
+    snapshots : pd.Index
+        New snapshots, one per group.
+    counts : array-like
+        Number of consecutive snapshots of ``n`` in each group. Empty groups
+        result in NaN values, as for ``DataFrame.resample``.
+    snapshot_weightings : pd.DataFrame
+        Snapshot weightings of the new snapshots.
+    aggregations : dict, optional
+        Aggregation ``"min"`` or ``"max"`` per tuple of component list name and
+        attribute, e.g. ``{("stores", "e_max_pu"): "min"}``. All other time
+        series are averaged.
+
+    Returns
+    -------
+    n : pypsa.Network
+    """
+    if aggregations is None:
+        aggregations = {}
+
+    counts = np.asarray(counts, dtype=int)
+    nonempty = counts > 0
+    starts = np.r_[0, np.cumsum(counts)[:-1]][nonempty]
+    group_counts = counts[nonempty]
+
+    aggregated = {}
+    for c in n.iterate_components():
+        for k, df in c.pnl.items():
+            if df.empty:
+                continue
+            values = df.to_numpy()
+            if values.dtype.kind != "f":
+                values = values.astype(float)
+
+            how = aggregations.get((c.list_name, k), "mean")
+            if how == "mean":
+                agg = _group_mean(values, starts, group_counts)
+            elif how == "min":
+                agg = np.fmin.reduceat(values, starts, axis=0)
+            elif how == "max":
+                agg = np.fmax.reduceat(values, starts, axis=0)
+            else:
+                raise ValueError(f"Unknown aggregation '{how}' for {c.list_name}.{k}")
+
+            data = np.full((len(counts), values.shape[1]), np.nan, dtype=agg.dtype)
+            data[nonempty] = agg
+            aggregated[c.list_name, k] = pd.DataFrame(
+                data, index=snapshots, columns=df.columns
+            )
+            # drop the original series so that set_snapshots does not reindex it
+            c.pnl[k] = pd.DataFrame(index=df.index)
+
+    n.set_snapshots(snapshots)
+    n.snapshot_weightings = snapshot_weightings
+
+    for (list_name, k), df in aggregated.items():
+        getattr(n, list_name + "_t")[k] = df
+
+    return n
+
+
+def resample_network(n, offset, aggregations=None):
+    """
+    Resample all time series of a network to the frequency ``offset``.
+
+    Equivalent to ``DataFrame.resample(offset).mean()`` applied to every
+    time-varying attribute, with the snapshot weightings summed per period.
+    See :func:`aggregate_snapshots` for the ``aggregations`` argument.
+    """
+    resampler = n.snapshot_weightings.resample(offset)
+    snapshot_weightings = resampler.sum()
+    counts = resampler.size()
+    return aggregate_snapshots(
+        n, snapshot_weightings.index, counts, snapshot_weightings, aggregations
+    )
+
+
+def generate_periodic_profiles(dt_index, nodes, weekly_profile, localize=None):
+    """
+    Give a 24*7 long list of weekly hourly profiles, generate this for each
+    country for the period dt_index, taking account of time zones and summer
+    time.
+
+    Nodes sharing a time zone share the same hour-of-week index, which is
+    computed once per time zone and gathered from the weekly profile for all
+    nodes at once.
+    """
+    import pytz
+
+    weekly_profile = pd.Series(weekly_profile, range(24 * 7)).values
+
+    nodes = pd.Index(nodes)
+    timezones = np.array(
+        [pytz.country_timezones[node[:2]][0] for node in nodes], dtype=object
+    )
+
+    hour_of_week = np.empty((len(dt_index), len(nodes)), dtype=int)
+    for timezone in pd.unique(timezones):
+        tz_dt_index = dt_index.tz_convert(pytz.timezone(timezone))
+        hours = 24 * tz_dt_index.dayofweek.values + tz_dt_index.hour.values
+        hour_of_week[:, timezones == timezone] = hours[:, np.newaxis]
+
+    week_df = pd.DataFrame(weekly_profile[hour_of_week], index=dt_index, columns=nodes)
+
+    week_df = week_df.tz_localize(localize)
+
+    return week_df
+
+
+def get_indicator_matrix(
+    cutout, regions, shapes_crs=4326, cache_dir=INDICATOR_MATRIX_CACHE_DIR
+):
+    """
+    Return the indicator matrix of the regions on the cutout grid, reusing a
+    persistent cache when the same grid and regions were processed before.
+
+    The cache key is a hash of the cutout grid (coordinates, resolution and
+    crs) and of the well-known binary of the region geometries, so that the
+    cached matrix is invalidated automatically whenever either changes.
+
+    Parameters
+    ----------
+    cutout : atlite.Cutout
+        Cutout defining the grid cells.
+    regions : gpd.GeoSeries
+        Region geometries, corresponding to the rows of the matrix.
+    shapes_crs : int or str
+        Coordinate reference system of the region geometries.
+    cache_dir : str
+        Directory where the sparse matrices are stored as ``.npz`` files.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Indicator matrix of shape (regions, cells).
+    """
+    import hashlib
+
+    import geopandas as gpd
+    import scipy.sparse as sparse
+
+    regions = gpd.GeoSeries(regions)
+
+    key = hashlib.sha256()
+    for coord in ["x", "y"]:
+        key.update(np.ascontiguousarray(cutout.coords[coord].values, float).tobytes())
+    key.update(f"{cutout.dx}|{cutout.dy}|{cutout.crs}|{shapes_crs}".encode())
+    for wkb in regions.to_wkb():
+        key.update(wkb)
+
+    fn = os.path.join(cache_dir, f"indicatormatrix_{key.hexdigest()[:20]}.npz")
+
+    if os.path.isfile(fn):
+        logger.info(f"Loading cached indicator matrix from {fn}")
+        return sparse.load_npz(fn).tocsr()
+
+    I = sparse.csr_matrix(cutout.indicatormatrix(regions, shapes_crs))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file first to avoid partial files in parallel runs
+    tmp_fn = fn.replace(".npz", f".{os.getpid()}.tmp.npz")
+    sparse.save_npz(tmp_fn, I)
+    os.replace(tmp_fn, fn)
+    logger.info(f"Stored indicator matrix in cache {fn}")
+
+    return I
+
+
+def get_population_weighted_matrix(indicator, pop_layout, normalize=False):
+    """
+    Build the sparse matrix aggregating cutout cells to regions, weighting
+    each overlapping cell with the population of its region.
+
+    Parameters
+    ----------
+    indicator : scipy.sparse matrix
+        Indicator matrix of shape (regions, cells) as returned by
+        ``cutout.indicatormatrix``.
+    pop_layout : xr.DataArray
+        Population layout on the cutout grid with dimensions (y, x).
+    normalize : bool
+        If True, the weights of each region are normalized to sum up to one.
+
+    Returns
+    -------
+    scipy.sparse.csr_matrix
+        Matrix of shape (regions, cells) to be passed as ``matrix`` to the
+        atlite conversion functions.
+    """
+    import scipy.sparse as sparse
+
+    I = sparse.csr_matrix(indicator)
+    stacked_pop = pop_layout.stack(spatial=("y", "x")).values
+
+    M = sparse.diags(I.dot(stacked_pop)).dot(I).tocsr()
+
+    if normalize:
+        nonzero_sum = np.asarray(M.sum(axis=1)).ravel()
+        nonzero_sum[nonzero_sum == 0.0] = 1.0
+        M.data /= np.repeat(nonzero_sum, np.diff(M.indptr))
+
+    return M
+
+
+def convert_areas_in_single_pass(conversion, matrices, index, **kwargs):
+    """
+    Run an atlite conversion once for several areas.
+
+    The weighting matrices of all areas are stacked into one block matrix, so
+    that the weather data of the cutout is read only once, and the aggregated
+    result is split back into one array per area.
+
+    Parameters
+    ----------
+    conversion : callable
+        Bound atlite conversion method, e.g. ``cutout.temperature``.
+    matrices : dict
+        Sparse weighting matrices of shape (regions, cells) per area.
+    index : pd.Index
+        Regions corresponding to the rows of each weighting matrix.
+    **kwargs
+        Further keyword arguments passed to the conversion.
+
+    Returns
+    -------
+    dict
+        Aggregated xr.DataArray per area.
+    """
+    import scipy.sparse as sparse
+
+    areas = list(matrices)
+    matrix = sparse.vstack([matrices[area] for area in areas], format="csr")
+    stacked_index = pd.Index(np.tile(index, len(areas)), name=index.name)
+
+    converted = conversion(matrix=matrix, index=stacked_index, **kwargs)
+    dim = next(dim for dim in converted.dims if dim != "time")
+
+    n = len(index)
+    return {
+        area: converted.isel({dim: slice(i * n, (i + 1) * n)})
+        for i, area in enumerate(areas)
+    }
+
+
+def parse_uncertainty_key(n, key):
+    """
+    Resolve a Monte Carlo uncertainty key to the network attribute it scales.
+
+    Keys name a static or time-varying component attribute, optionally
+    restricted to the components matching a column value, e.g.
+    ``loads_t.p_set`` or
+    ``generators_t.p_max_pu.loc[:, n.generators.carrier == "onwind"]``.
+
+    Parameters
+    ----------
+    n : pypsa.Network
+    key : str
+        Uncertainty key as given in the ``monte_carlo: uncertainties`` config.
+
+    Returns
+    -------
+    tuple
+        Component name, attribute name, whether the attribute is time-varying
+        and the index of the scaled components.
+    """
+    match = UNCERTAINTY_KEY_PATTERN.fullmatch(key.strip())
+    list_names = {attrs["list_name"]: c for c, attrs in n.components.items()}
+    if match is None or match["list_name"] not in list_names:
+        raise ValueError(
+            f"Unsupported Monte Carlo uncertainty '{key}'. Expected "
+            "'<list_name>[_t].<attr>' optionally followed by "
+            "'.loc[:, n.<list_name>.<attr> == \"<value>\"]'."
+        )
+
+    c = list_names[match["list_name"]]
+    attr = match["attr"]
+    varying = match["varying"] is not None
+    if varying:
+        index = getattr(getattr(n, match["list_name"] + "_t"), attr).columns
+    else:
+        index = getattr(n, match["list_name"]).index
+
+    if match["sel_attr"] is not None:
+        column = getattr(getattr(n, match["sel_list_name"]), match["sel_attr"])
+        selected = column.reindex(index) == match["sel_value"]
+        index = index[selected.values]
+
+    return c, attr, varying, index
+
+
+def scale_network_attribute(n, key, factor):
+    """
+    Scale the network attribute addressed by a Monte Carlo uncertainty key in
+    place.
+
+    See :func:`parse_uncertainty_key` for the supported keys.
+
+    Returns
+    -------
+    tuple
+        Output of :func:`parse_uncertainty_key` for ``key``.
+    """
+    c, attr, varying, index = parse_uncertainty_key(n, key)
+    if varying:
+        df = n.pnl(c)[attr]
+        df[index] = df[index] * factor
+    else:
+        n.df(c).loc[index, attr] *= factor
+    return c, attr, varying, index
+
+
+def load_monte_carlo_sample(base_network, delta, **kwargs):
+    """
+    Rebuild the network of a Monte Carlo sample from the base network and the
+    delta file of the sample written by ``monte_carlo.py``.
+
+    Parameters
+    ----------
+    base_network : str
+        Path to the base network.
+    delta : str
+        Path to the yaml file listing the scaling factor of every uncertain
+        network attribute in the sample.
+    **kwargs
+        Further keyword arguments passed to ``pypsa.Network``.
+
+    Returns
+    -------
+    pypsa.Network
+    """
+    import pypsa
+    import yaml
+
+    with open(delta) as f:
+        sample = yaml.safe_load(f)
+
+    n = pypsa.Network(base_network, **kwargs)
+    for key, factor in sample["scaling_factors"].items():
+        scale_network_attribute(n, key, factor)
+        logger.info(
+            f"Scaled n.{key} by factor {factor} in the {sample['sample']} scenario"
+        )
+
+    n.meta.update(monte_carlo=sample)
+    return n
+
+
 def override_component_attrs(directory):
     """Tell PyPSA that links can have multiple outputs by
     overriding the component_attrs. This can be done for
@@ -1111,6 +2014,7 @@ def override_component_attrs(directory):
     -------
     Dictionary of overridden component attributes.
     """
+    from pypsa.components import component_attrs, components
 
     attrs = {k: v.copy() for k, v in component_attrs.items()}
 
@@ -1161,6 +2065,34 @@ def get_country(target, **keys):
         return np.nan
 
 
+def get_GADM_filename(country_code):
+    """
+    Function to get the GADM filename given the country code.
+    """
+    special_codes_GADM = {
+        "XK": "XKO",  # kosovo
+        "CP": "XCL",  # clipperton island
+        "SX": "MAF",  # sint maartin
+        "TF": "ATF",  # french southern territories
+        "AX": "ALA",  # aland
+        "IO": "IOT",  # british indian ocean territory
+        "CC": "CCK",  # cocos island
+        "NF": "NFK",  # norfolk
+        "PN": "PCN",  # pitcairn islands
+        "JE": "JEY",  # jersey
+        "XS": "XSP",  # spratly
+        "GG": "GGY",  # guernsey
+        "UM": "UMI",  # united states minor outlying islands
+        "SJ": "SJM",  # svalbard
+        "CX": "CXR",  # Christmas island
+    }
+
+    if country_code in special_codes_GADM:
+        return f"gadm41_{special_codes_GADM[country_code]}"
+    else:
+        return f"gadm41_{two_2_three_digits_country(country_code)}"
+
+
 def download_GADM(country_code, update=False, out_logging=False):
     """
     Download gpkg file from GADM for a given country code.
@@ -1176,23 +2108,16 @@ def download_GADM(country_code, update=False, out_logging=False):
     -------
     gpkg file per country
     """
+    import requests
 
-    GADM_filename = f"gadm36_{two_2_three_digits_country(country_code)}"
-    GADM_url = f"https://biogeo.ucdavis.edu/data/gadm3.6/gpkg/{GADM_filename}_gpkg.zip"
     _logger = logging.getLogger(__name__)
-    GADM_inputfile_zip = os.path.join(
-        os.getcwd(),
-        "data",
-        "raw",
-        "gadm",
-        GADM_filename,
-        GADM_filename + ".zip",
-    )  # Input filepath zip
+
+    GADM_filename = get_GADM_filename(country_code)
+    GADM_url = f"https://geodata.ucdavis.edu/gadm/gadm4.1/gpkg/{GADM_filename}.gpkg"
 
     GADM_inputfile_gpkg = os.path.join(
-        os.getcwd(),
+        BASE_DIR,
         "data",
-        "raw",
         "gadm",
         GADM_filename,
         GADM_filename + ".gpkg",
@@ -1201,71 +2126,221 @@ def download_GADM(country_code, update=False, out_logging=False):
     if not os.path.exists(GADM_inputfile_gpkg) or update is True:
         if out_logging:
             _logger.warning(
-                f"Stage 4/4: {GADM_filename} of country {two_digits_2_name_country(country_code)} does not exist, downloading to {GADM_inputfile_zip}"
+                f"{GADM_filename} of country {two_digits_2_name_country(country_code)} does not exist, downloading to {GADM_inputfile_gpkg}"
             )
         #  create data/osm directory
-        os.makedirs(os.path.dirname(GADM_inputfile_zip), exist_ok=True)
+        os.makedirs(os.path.dirname(GADM_inputfile_gpkg), exist_ok=True)
 
-        with requests.get(GADM_url, stream=True) as r:
-            with open(GADM_inputfile_zip, "wb") as f:
+        try:
+            r = requests.get(GADM_url, stream=True, timeout=300)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            raise Exception(
+                f"GADM server is down at {GADM_url}. Data needed for building shapes can't be extracted.\n\r"
+            )
+        except Exception as exception:
+            raise Exception(
+                f"An error happened when trying to load GADM data by {GADM_url}.\n\r"
+                + str(exception)
+                + "\n\r"
+            )
+        else:
+            # download to a temporary file first, so that an interrupted
+            # download does not leave a corrupted geopackage behind
+            with open(GADM_inputfile_gpkg + ".part", "wb") as f:
                 shutil.copyfileobj(r.raw, f)
-
-        with zipfile.ZipFile(GADM_inputfile_zip, "r") as zip_ref:
-            zip_ref.extractall(os.path.dirname(GADM_inputfile_zip))
+            os.replace(GADM_inputfile_gpkg + ".part", GADM_inputfile_gpkg)
 
     return GADM_inputfile_gpkg, GADM_filename
 
 
-def get_GADM_layer(country_list, layer_id, update=False, outlogging=False):
+def download_GADM_files(country_list, update=False, out_logging=False, nprocesses=None):
     """
-    Function to retrieve a specific layer id of a geopackage for a selection of
-    countries.
+    Download concurrently the GADM geopackages of a list of countries; only
+    missing files are downloaded unless update is true.
+
+    Parameters
+    ----------
+    country_list : list
+        Two letter country codes of the files to download
+    update : bool
+        Update = true, forces re-download of files
+    nprocesses : int
+        Number of concurrent downloads; by default one per country, up to 8
+
+    Returns
+    -------
+    dict of the gpkg file path by country code
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    country_list = list(country_list)
+    if nprocesses is None:
+        nprocesses = min(8, len(country_list))
+
+    with ThreadPoolExecutor(max_workers=max(1, nprocesses)) as executor:
+        files_gpkg = executor.map(
+            lambda cc: download_GADM(cc, update, out_logging)[0], country_list
+        )
+        return dict(zip(country_list, files_gpkg))
+
+
+def filter_gadm(
+    geodf,
+    layer,
+    cc,
+    contended_flag,
+    output_nonstd_to_csv=False,
+):
+    _logger = logging.getLogger(__name__)
+
+    # identify non standard geodf rows
+    geodf_non_std = geodf[geodf["GID_0"] != two_2_three_digits_country(cc)].copy()
+
+    if not geodf_non_std.empty:
+        _logger.info(
+            f"Contended areas have been found for gadm layer {layer}. They will be treated according to {contended_flag} option"
+        )
+
+        # NOTE: in these options GID_0 is not changed because it is modified below
+        if contended_flag == "drop":
+            geodf.drop(geodf_non_std.index, inplace=True)
+        elif contended_flag != "set_by_country":
+            # "set_by_country" option is the default; if this elif applies, the desired option falls back to the default
+            _logger.warning(
+                f"Value '{contended_flag}' for option contented_flag is not recognized.\n"
+                + "Fallback to 'set_by_country'"
+            )
+
+    # force GID_0 to be the country code for the relevant countries
+    geodf["GID_0"] = cc
+
+    # country shape should have a single geometry
+    if (layer == 0) and (geodf.shape[0] > 1):
+        _logger.warning(
+            f"Country shape is composed by multiple shapes that are being merged in agreement to contented_flag option '{contended_flag}'"
+        )
+        # take the first row only to re-define geometry keeping other columns
+        geodf = geodf.iloc[[0]].set_geometry([geodf.unary_union])
+
+    # debug output to file
+    if output_nonstd_to_csv and not geodf_non_std.empty:
+        geodf_non_std.to_csv(
+            f"resources/non_standard_gadm{layer}_{cc}_raw.csv", index=False
+        )
+
+    return geodf
+
+
+def read_GADM_layer(country_code, file_gpkg, layer_id, contended_flag, update=False):
+    """
+    Read a layer of the GADM geopackage of a country using pyogrio with Arrow.
+
+    The layer filtered by filter_gadm is cached as GeoParquet next to the
+    geopackage, so that following calls read the cache instead; the cache is
+    refreshed when the geopackage is newer than the cache or update is true.
 
     Parameters
     ----------
-    country_list : str
-        List of the countries
     layer_id : int
         Layer to consider in the format GID_{layer_id}.
         When the requested layer_id is greater than the last available layer, then the last layer is selected.
         When a negative value is requested, then, the last layer is requested
+
+    Returns
+    -------
+    geodf : GeoDataFrame of the layer, in the crs of the geopackage
     """
-    # initialization of the list of geodataframes
-    geodf_list = []
+    import geopandas as gpd
+    import pyogrio
 
-    for country_code in country_list:
-        # download file gpkg
-        file_gpkg, name_file = download_GADM(country_code, update, outlogging)
+    # get layers of a geopackage
+    list_layers = pyogrio.list_layers(file_gpkg)
 
-        # get layers of a geopackage
-        list_layers = fiona.listlayers(file_gpkg)
+    # get layer name
+    if (layer_id < 0) or (layer_id >= len(list_layers)):
+        # when layer id is negative or larger than the number of layers, select the last layer
+        layer_id = len(list_layers) - 1
 
-        # get layer name
-        if layer_id < 0 | layer_id >= len(list_layers):
-            # when layer id is negative or larger than the number of layers, select the last layer
-            layer_id = len(list_layers) - 1
-        code_layer = np.mod(layer_id, len(list_layers))
-        layer_name = (
-            f"gadm36_{two_2_three_digits_country(country_code).upper()}_{code_layer}"
-        )
+    cache_file = (
+        os.path.splitext(file_gpkg)[0] + f"_{layer_id}_{contended_flag}.parquet"
+    )
+    if (
+        not update
+        and os.path.exists(cache_file)
+        and os.path.getmtime(cache_file) >= os.path.getmtime(file_gpkg)
+    ):
+        return gpd.read_parquet(cache_file)
+
+    # read gpkg file
+    geodf = gpd.read_file(
+        file_gpkg, layer="ADM_ADM_" + str(layer_id), engine="pyogrio", use_arrow=True
+    )
 
-        # read gpkg file
-        geodf_temp = gpd.read_file(file_gpkg, layer=layer_name)
+    geodf = filter_gadm(
+        geodf=geodf,
+        layer=layer_id,
+        cc=country_code,
+        contended_flag=contended_flag,
+        output_nonstd_to_csv=False,
+    )
 
-        # convert country name representation of the main country (GID_0 column)
-        geodf_temp["GID_0"] = [
-            three_2_two_digits_country(twoD_c) for twoD_c in geodf_temp["GID_0"]
-        ]
+    # create a subindex column that is useful
+    # in the GADM processing of sub-national zones
+    geodf["GADM_ID"] = geodf[f"GID_{layer_id}"]
 
-        # create a subindex column that is useful
-        # in the GADM processing of sub-national zones
-        geodf_temp["GADM_ID"] = geodf_temp[f"GID_{code_layer}"]
+    # write to a temporary file first to avoid partial files in parallel runs
+    tmp_fn = cache_file.replace(".parquet", f".{os.getpid()}.tmp.parquet")
+    geodf.to_parquet(tmp_fn)
+    os.replace(tmp_fn, cache_file)
 
-        # concatenate geodataframes
-        geodf_list = pd.concat([geodf_list, geodf_temp])
+    return geodf
 
-    geodf_GADM = gpd.GeoDataFrame(pd.concat(geodf_list, ignore_index=True))
-    geodf_GADM.set_crs(geodf_list[0].crs, inplace=True)
+
+def get_GADM_layer(
+    country_list,
+    layer_id,
+    geo_crs,
+    contended_flag,
+    update=False,
+    outlogging=False,
+    nprocesses=None,
+):
+    """
+    Function to retrieve a specific layer id of a geopackage for a selection of
+    countries.
+
+    Missing geopackages are downloaded concurrently, then the layers are read
+    by read_GADM_layer and concatenated once.
+
+    Parameters
+    ----------
+    country_list : str
+        List of the countries
+    layer_id : int
+        Layer to consider in the format GID_{layer_id}.
+        When the requested layer_id is greater than the last available layer, then the last layer is selected.
+        When a negative value is requested, then, the last layer is requested
+    geo_crs : str
+        CRS of the returned GeoDataFrame
+    contended_flag : str
+        Option to treat contended areas, see filter_gadm
+    nprocesses : int
+        Number of concurrent downloads
+    """
+    import geopandas as gpd
+
+    files_gpkg = download_GADM_files(country_list, update, outlogging, nprocesses)
+
+    geodf_list = [
+        read_GADM_layer(
+            country_code, files_gpkg[country_code], layer_id, contended_flag, update
+        )
+        for country_code in country_list
+    ]
+
+    geodf_GADM = gpd.GeoDataFrame(
+        pd.concat(geodf_list, ignore_index=True), crs=geodf_list[0].crs
+    ).to_crs(geo_crs)
 
     return geodf_GADM
 
@@ -1289,6 +2364,9 @@ def locate_bus(
     co: string (code for country where coords are MA Morocco)
         code of the countries where the coordinates are
     """
+    import geopandas as gpd
+    from shapely.geometry import Point
+
     col = "name"
     if not gadm_clustering:
         gdf = gpd.read_file(path_to_gadm)
@@ -1301,11 +2379,14 @@ def locate_bus(
                 if gdf[col][0][
                     :3
                 ].isalpha():  # TODO clean later by changing all codes to 2 letters
-                    gdf[col] = gdf[col].apply(
-                        lambda name: three_2_two_digits_country(name[:3]) + name[3:]
+                    gdf[col] = (
+                        convert_country_codes(gdf[col].str[:3], to="ISO2")
+                        + gdf[col].str[3:]
                     )
         else:
-            gdf = get_GADM_layer(co, gadm_level)
+            gdf = get_GADM_layer(
+                [co], gadm_level, geo_crs="EPSG:4326", contended_flag="set_by_country"
+            )
             col = "GID_{}".format(gadm_level)
 
         # gdf.set_index("GADM_ID", inplace=True)
@@ -12,6 +12,7 @@ import numpy as np
 import pandas as pd
 import pypsa
 import xarray as xr
+from _helpers import export_network
 from add_existing_baseyear import add_build_year_to_new_assets
 
 # from pypsa.clustering.spatial import normed_or_uniform
@@ -260,4 +261,4 @@ if __name__ == "__main__":
     disable_grid_expansion_if_limit_hit(n)
 
     n.meta = dict(snakemake.config, **dict(wildcards=dict(snakemake.wildcards)))
-    n.export_to_netcdf(snakemake.output[0])
+    export_network(n, snakemake.output[0], **snakemake.config["network_io"])
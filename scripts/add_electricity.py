@@ -91,9 +91,17 @@ import pandas as pd
 import powerplantmatching as pm
 import pypsa
 import xarray as xr
-from tqdm import tqdm
 from powerplantmatching.export import map_country_bus
-from _helpers import configure_logging, create_logger, read_csv_nafix, update_p_nom_max
+from _helpers import (
+    annuity,
+    cache_costs,
+    configure_logging,
+    create_logger,
+    export_network,
+    get_supply_curve_steps,
+    read_csv_nafix,
+    update_p_nom_max,
+)
 
 idx = pd.IndexSlice
 
@@ -104,21 +112,6 @@ def normed(s):
     return s / s.sum()
 
 
-def calculate_annuity(n, r):
-    """
-    Calculate the annuity factor for an asset with lifetime n years and
-    discount rate of r, e.g. annuity(20, 0.05) * 20 = 1.6.
-    """
-    if isinstance(r, pd.Series):
-        return pd.Series(1 / n, index=r.index).where(
-            r == 0, r / (1.0 - 1.0 / (1.0 + r) ** n)
-        )
-    elif r > 0:
-        return r / (1.0 - 1.0 / (1.0 + r) ** n)
-    else:
-        return 1 / n
-
-
 def _add_missing_carriers_from_costs(n, costs, carriers):
     missing_carriers = pd.Index(carriers).difference(n.carriers.index)
     if missing_carriers.empty:
@@ -133,6 +126,7 @@ def _add_missing_carriers_from_costs(n, costs, carriers):
     n.import_components_from_dataframe(emissions, "Carrier")
 
 
+@cache_costs
 def load_costs(tech_costs, config, elec_config, Nyears=1):
     """
     Set all asset costs and other parameters.
@@ -157,10 +151,7 @@ def load_costs(tech_costs, config, elec_config, Nyears=1):
             )
 
     costs["capital_cost"] = (
-        (
-            calculate_annuity(costs["lifetime"], costs["discount rate"])
-            + costs["FOM"] / 100.0
-        )
+        (annuity(costs["lifetime"], costs["discount rate"]) + costs["FOM"] / 100.0)
         * costs["investment"]
         * Nyears
     )
@@ -807,8 +798,6 @@ def attach_enhanced_geothermal(n):
     egs_potential = pd.read_csv(snakemake.input["egs_potentials"], index_col=[0, 1])
     assert egs_potential.index.names == ['network_region', 'capital_cost[$/kW]']
 
-    idx = pd.IndexSlice
-
     n.add(
         "Bus",
         "EGS",
@@ -824,31 +813,21 @@ def attach_enhanced_geothermal(n):
         p_nom_extendable=True,
     )
 
-    for bus in tqdm(
-        egs_potential.index.get_level_values(0).unique(),
-        desc="Adding enhanced geothermal",
-        ):
-
-        ss = egs_potential.loc[idx[bus, :]]
+    # one link per supply-curve point (i.e. each potential) of each region
+    steps = get_supply_curve_steps(egs_potential)
+    identifier = steps["region"] + "_curve" + steps["step"].astype(str)
 
-        # Loop over supply‐curve point (i.e. each potential) for this region
-        for i, (capital_cost, row) in enumerate(ss.iterrows()):
-            capacity = row["available_capacity[MW]"]
-            # Convert the cost index from $/kW to $/MW and annuitize the capex
-            capital_cost = float(capital_cost) * 1000 # $/kW -> $/MW
-
-            identifier = f"{bus}_curve{i}"
-
-            n.add(
-                "Link",
-                name=f"EGS electricity {identifier}",
-                bus0="EGS",
-                bus1=bus,
-                carrier="enhanced geothermal ORC",
-                p_nom_max=capacity,
-                capital_cost=capital_cost,
-                p_nom_extendable=True,
-            )
+    n.madd(
+        "Link",
+        ("EGS electricity " + identifier).values,
+        bus0="EGS",
+        bus1=steps["region"].values,
+        carrier="enhanced geothermal ORC",
+        p_nom_max=steps["available_capacity[MW]"].values,
+        # Convert the cost index from $/kW to $/MW
+        capital_cost=steps["cost"].astype(float).values * 1000,
+        p_nom_extendable=True,
+    )
 
 
 def add_nice_carrier_names(n, config):
@@ -954,4 +933,4 @@ if __name__ == "__main__":
         n.generators["weight"] = pd.Series()
 
     n.meta = snakemake.config
-    n.export_to_netcdf(snakemake.output[0])
+    export_network(n, snakemake.output[0], **snakemake.config["network_io"])
@@ -11,12 +11,12 @@ import logging
 import os
 from types import SimpleNamespace
 
-import country_converter as coco
 import numpy as np
 import pandas as pd
 import powerplantmatching as pm
 import pypsa
 import xarray as xr
+from _helpers import export_network, get_country_converter
 
 # from _helpers import (
 #     configure_logging,
@@ -27,7 +27,7 @@ import xarray as xr
 from prepare_sector_network import define_spatial, prepare_costs  # , cluster_heat_buses
 
 logger = logging.getLogger(__name__)
-cc = coco.CountryConverter()
+cc = get_country_converter()
 idx = pd.IndexSlice
 spatial = SimpleNamespace()
 
@@ -657,4 +657,4 @@ if __name__ == "__main__":
 
     # sanitize_carriers(n, snakemake.config)
 
-    n.export_to_netcdf(snakemake.output[0])
+    export_network(n, snakemake.output[0], **snakemake.config["network_io"])
@@ -23,7 +23,7 @@ import geopandas as gpd
 import numpy as np
 import pandas as pd
 import pypsa
-from _helpers import locate_bus, override_component_attrs, prepare_costs
+from _helpers import export_network, locate_bus, override_component_attrs, prepare_costs
 
 logger = logging.getLogger(__name__)
 
@@ -244,6 +244,6 @@ if __name__ == "__main__":
     # add export value and components to network
     add_export(n, hydrogen_buses_ports, export_profile)
 
-    n.export_to_netcdf(snakemake.output[0])
+    export_network(n, snakemake.output[0], **snakemake.config["network_io"])
 
     logger.info("Network successfully exported")
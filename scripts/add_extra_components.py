@@ -57,7 +57,7 @@ import os
 import numpy as np
 import pandas as pd
 import pypsa
-from _helpers import configure_logging, create_logger
+from _helpers import configure_logging, create_logger, export_network
 from add_electricity import (
     _add_missing_carriers_from_costs,
     add_nice_carrier_names,
@@ -292,4 +292,4 @@ if __name__ == "__main__":
     add_nice_carrier_names(n, config=snakemake.config)
 
     n.meta = dict(snakemake.config, **dict(wildcards=dict(snakemake.wildcards)))
-    n.export_to_netcdf(snakemake.output[0])
+    export_network(n, snakemake.output[0], **snakemake.config["network_io"])
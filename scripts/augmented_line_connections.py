@@ -34,7 +34,7 @@ import networkx as nx
 import numpy as np
 import pandas as pd
 import pypsa
-from _helpers import configure_logging, create_logger
+from _helpers import configure_logging, create_logger, export_network
 from add_electricity import load_costs
 from networkx.algorithms import complement
 from networkx.algorithms.connectivity.edge_augmentation import k_edge_augmentation
@@ -173,4 +173,4 @@ if __name__ == "__main__":
         # _set_dc_underwater_fraction(n.lines, snakemake.input.regions_offshore)
 
     n.meta = dict(snakemake.config, **dict(wildcards=dict(snakemake.wildcards)))
-    n.export_to_netcdf(snakemake.output.network)
+    export_network(n, snakemake.output.network, **snakemake.config["network_io"])
@@ -65,7 +65,7 @@ import pypsa
 import scipy as sp
 import shapely.prepared
 import shapely.wkt
-from _helpers import configure_logging, create_logger, read_csv_nafix
+from _helpers import configure_logging, create_logger, export_network, read_csv_nafix
 from shapely.ops import unary_union
 
 logger = create_logger(__name__)
@@ -586,4 +586,4 @@ if __name__ == "__main__":
 
     n.buses = pd.DataFrame(n.buses.drop(columns="geometry"))
     n.meta = snakemake.config
-    n.export_to_netcdf(snakemake.output[0])
+    export_network(n, snakemake.output[0], **snakemake.config["network_io"])
@@ -0,0 +1,642 @@
+# -*- coding: utf-8 -*-
+# SPDX-FileCopyrightText:  PyPSA-Earth and PyPSA-Eur Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+# -*- coding: utf-8 -*-
+"""
+Times the core workflow stages on synthetic inputs of configurable size.
+
+Relevant Settings
+-----------------
+
+.. code:: yaml
+
+    benchmark_synthetic:
+        seed:
+        repeat:
+        countries:
+        import_modules:
+        sizes:
+
+    build_osm_network:
+    crs:
+    electricity:
+        base_voltage:
+    lines:
+        ac_types:
+    cluster_options:
+        aggregation_strategies:
+    solving:
+        options:
+        solver:
+            name:
+
+.. seealso::
+    Documentation of the configuration file ``config.yaml`` at
+    :ref:`benchmark_synthetic_cf`
+
+Inputs
+------
+No inputs, all data is generated.
+
+Outputs
+-------
+- ``benchmarks/synthetic/{size}.csv``: run time of every run of every stage
+
+Description
+-----------
+Performance regressions of the workflow usually only show up in full runs,
+which require the data bundles and OpenStreetMap downloads. The rule
+``benchmark_synthetic`` instead generates random but realistic inputs for the
+network size ``{size}`` defined in ``benchmark_synthetic: sizes``:
+
+- OpenStreetMap-like substations and lines and the country shapes they lie in,
+- a PyPSA network with AC lines, DC links, transformers, renewable and
+  conventional generators, storage units and loads with diurnal time series,
+- a small cutout with temperature data on a regular grid and population
+  layouts of the total, rural and urban areas on it.
+
+All data is generated offline, such that the benchmark runs on a laptop. Each
+of the following stages is then timed ``repeat`` times on a fresh copy of its
+input:
+
+- ``build_osm_network``: :func:`build_osm_network.built_network`,
+- ``simplify_network``: mapping to the base voltage and aggregation to substations,
+- ``cluster_network``: :func:`cluster_network.busmap_for_n_clusters` with k-means,
+- ``prepare_network``: time aggregation to 3-hourly resolution and, if ``tsam`` is installed, time segmentation,
+- ``solve_network``: :func:`solve_network.prepare_network` and building the linopy model,
+- ``build_cutout_profiles``: indicator matrix and aggregation of the cutout to
+  the regions for the total, rural and urban areas in a single cutout pass,
+- ``build_cutout_profiles_per_area``: the same with one cutout pass per area.
+
+Additionally, the import of each script in ``import_modules`` is timed as
+stage ``import_{module}`` in a fresh interpreter, since the import time is
+paid by every job of the workflow.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from importlib.util import find_spec
+
+import atlite
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pypsa
+import solve_network
+import xarray as xr
+from _helpers import (
+    configure_logging,
+    convert_areas_in_single_pass,
+    create_logger,
+    get_indicator_matrix,
+    get_population_weighted_matrix,
+)
+from build_osm_network import built_network
+from cluster_network import busmap_for_n_clusters
+from prepare_network import apply_time_segmentation, average_every_nhours
+from pypsa.descriptors import Dict
+from scipy.signal import lfilter
+from scipy.spatial import Delaunay, cKDTree
+from shapely.geometry import LineString, box
+from simplify_network import aggregate_to_substations, simplify_network_to_base_voltage
+
+logger = create_logger(__name__)
+
+# extent of each synthetic country in degrees
+COUNTRY_SIZE = 4.0
+
+
+def get_country_shapes(countries):
+    """
+    Square country shapes placed next to each other along the equator.
+    """
+    return gpd.GeoDataFrame(
+        {"name": countries},
+        geometry=[
+            box(i * COUNTRY_SIZE, 4.0, (i + 1) * COUNTRY_SIZE, 4.0 + COUNTRY_SIZE)
+            for i in range(len(countries))
+        ],
+        crs="EPSG:4326",
+    )
+
+
+def random_points(rng, n_points, country_shapes):
+    """
+    Uniformly distributed points within the country shapes.
+    """
+    i = rng.integers(len(country_shapes), size=n_points)
+    bounds = country_shapes.bounds.to_numpy()[i]
+    x = rng.uniform(bounds[:, 0], bounds[:, 2])
+    y = rng.uniform(bounds[:, 1], bounds[:, 3])
+    return x, y, country_shapes["name"].to_numpy()[i]
+
+
+def delaunay_edges(x, y):
+    """
+    Unique edges of the Delaunay triangulation of the points, as a meshed grid.
+    """
+    simplices = Delaunay(np.c_[x, y]).simplices
+    edges = np.vstack(
+        [simplices[:, [0, 1]], simplices[:, [1, 2]], simplices[:, [0, 2]]]
+    )
+    return np.unique(np.sort(edges, axis=1), axis=0)
+
+
+def generate_profiles(rng, snapshots, n_columns, kind):
+    """
+    Random time series with the typical shape of solar, wind and load
+    profiles.
+    """
+    hours = snapshots.hour.to_numpy()[:, None]
+    shape = (len(snapshots), n_columns)
+
+    if kind == "solar":
+        daylight = np.clip(np.sin(np.pi * (hours - 6) / 12), 0, None)
+        return daylight * rng.uniform(0.5, 1.0, shape)
+    elif kind == "wind":
+        # autocorrelated noise with unit variance
+        a = 0.95
+        noise = lfilter([np.sqrt(1 - a**2)], [1, -a], rng.normal(size=shape), axis=0)
+        return np.clip(0.35 + 0.2 * noise, 0.0, 1.0)
+    elif kind == "load":
+        daily = 1.0 + 0.3 * np.sin(2 * np.pi * (hours - 8) / 24)
+        return daily * rng.uniform(0.95, 1.05, shape)
+    raise ValueError(f"Unknown profile kind '{kind}'")
+
+
+def generate_osm_data(rng, n_substations, country_shapes, geo_crs="EPSG:4326"):
+    """
+    OpenStreetMap-like substations and lines as returned by the rule
+    ``clean_osm_data``.
+    """
+    x, y, country = random_points(rng, n_substations, country_shapes)
+    voltage = rng.choice([220000.0, 380000.0], size=n_substations, p=[0.7, 0.3])
+
+    substations = gpd.GeoDataFrame(
+        {
+            "bus_id": np.arange(n_substations).astype(str),
+            "station_id": np.nan,
+            "voltage": voltage,
+            "dc": False,
+            "symbol": "substation",
+            "under_construction": False,
+            "tag_substation": "transmission",
+            "tag_area": 0.0,
+            "lon": x,
+            "lat": y,
+            "country": country,
+        },
+        geometry=gpd.points_from_xy(x, y),
+        crs=geo_crs,
+    )
+
+    lines = []
+    for v in np.unique(voltage):
+        i = np.flatnonzero(voltage == v)
+        if len(i) < 3:
+            continue
+        for b0, b1 in i[delaunay_edges(x[i], y[i])]:
+            # slightly bent lines ending close to the substations
+            mid = ((x[b0] + x[b1]) / 2, (y[b0] + y[b1]) / 2 + rng.normal(0, 0.01))
+            end0 = (x[b0] + rng.normal(0, 1e-3), y[b0] + rng.normal(0, 1e-3))
+            lines.append((v, country[b0], LineString([end0, mid, (x[b1], y[b1])])))
+
+    voltage, country, geometry = zip(*lines)
+    lines = gpd.GeoDataFrame(
+        {
+            "line_id": np.arange(len(geometry)).astype(str),
+            "voltage": voltage,
+            "circuits": rng.choice([1.0, 2.0], size=len(geometry)),
+            "underground": False,
+            "under_construction": False,
+            "tag_type": "line",
+            "tag_frequency": 50.0,
+            "dc": False,
+            "country": country,
+        },
+        geometry=list(geometry),
+        crs=geo_crs,
+    )
+    lines["length"] = lines.to_crs("EPSG:3857").length
+
+    return substations, lines
+
+
+def generate_network(rng, n_buses, n_snapshots, country_shapes, line_types):
+    """
+    Random but realistic network of the size of a simplified PyPSA-Earth
+    network.
+    """
+    n = pypsa.Network()
+    snapshots = pd.date_range("2013-01-01", periods=n_snapshots, freq="h")
+    n.set_snapshots(snapshots)
+
+    x, y, country = random_points(rng, n_buses, country_shapes)
+    v_nom = rng.choice([220.0, 380.0], size=n_buses, p=[0.7, 0.3])
+    buses = pd.Index(np.arange(n_buses).astype(str))
+    n.madd("Bus", buses, x=x, y=y, v_nom=v_nom, carrier="AC", country=country)
+    n.buses["substation_lv"] = True
+    n.buses["substation_off"] = True
+
+    # AC lines on the meshed grid
+    edges = delaunay_edges(x, y)
+    bus0, bus1 = buses[edges[:, 0]], buses[edges[:, 1]]
+    line_v_nom = np.maximum(v_nom[edges[:, 0]], v_nom[edges[:, 1]])
+    types = pd.Series(line_v_nom).map(line_types).to_numpy()
+    num_parallel = rng.choice([1.0, 2.0], size=len(edges))
+    length = 1.25 * pypsa.geo.haversine_pts(
+        np.c_[x[edges[:, 0]], y[edges[:, 0]]], np.c_[x[edges[:, 1]], y[edges[:, 1]]]
+    )
+    n.madd(
+        "Line",
+        pd.Index(np.arange(len(edges)).astype(str)),
+        bus0=bus0,
+        bus1=bus1,
+        type=types,
+        num_parallel=num_parallel,
+        s_nom=np.sqrt(3)
+        * line_v_nom
+        * n.line_types.i_nom.reindex(types).to_numpy()
+        * num_parallel,
+        length=length,
+        carrier="AC",
+        s_nom_extendable=True,
+        capital_cost=length * 40.0,
+    )
+    n.lines["v_nom"] = line_v_nom
+
+    # transformers from a share of the 220 kV buses to the closest 380 kV bus
+    hv = np.flatnonzero(v_nom == 380.0)
+    lv = np.flatnonzero(v_nom == 220.0)
+    lv = rng.choice(lv, size=min(len(lv), n_buses // 10), replace=False)
+    if len(hv) and len(lv):
+        _, closest = cKDTree(np.c_[x[hv], y[hv]]).query(np.c_[x[lv], y[lv]])
+        n.madd(
+            "Transformer",
+            "T" + buses[lv],
+            bus0=buses[lv],
+            bus1=buses[hv[closest]],
+            s_nom=2000.0,
+            x=0.1,
+            r=0.01,
+        )
+
+    # DC links between random pairs of buses
+    n_links = max(1, n_buses // 50)
+    link_buses = rng.choice(n_buses, size=(n_links, 2), replace=False)
+    n.madd(
+        "Link",
+        pd.Index(np.arange(n_links).astype(str)).map("DC {}".format),
+        bus0=buses[link_buses[:, 0]],
+        bus1=buses[link_buses[:, 1]],
+        p_nom=1000.0,
+        p_min_pu=-1.0,
+        length=1.25
+        * pypsa.geo.haversine_pts(
+            np.c_[x[link_buses[:, 0]], y[link_buses[:, 0]]],
+            np.c_[x[link_buses[:, 1]], y[link_buses[:, 1]]],
+        ),
+        carrier="DC",
+        p_nom_extendable=True,
+        capital_cost=100.0,
+    )
+
+    n.madd("Carrier", ["onwind", "solar", "OCGT", "CCGT", "hydro", "battery"])
+    n.carriers.loc[["OCGT", "CCGT"], "co2_emissions"] = 0.2
+
+    # the weights used to aggregate generators are set as in add_electricity
+    for carrier, kind, capital_cost in [
+        ("onwind", "wind", 100000.0),
+        ("solar", "solar", 60000.0),
+    ]:
+        p_nom_max = rng.uniform(100.0, 5000.0, n_buses)
+        n.madd(
+            "Generator",
+            buses + " " + carrier,
+            bus=buses,
+            carrier=carrier,
+            p_nom_extendable=True,
+            p_nom_max=p_nom_max,
+            weight=p_nom_max,
+            capital_cost=capital_cost,
+            marginal_cost=0.01,
+            p_max_pu=pd.DataFrame(
+                generate_profiles(rng, snapshots, n_buses, kind),
+                index=snapshots,
+                columns=buses + " " + carrier,
+            ),
+        )
+
+    conventional = rng.choice(n_buses, size=max(1, n_buses // 3), replace=False)
+    for carrier, marginal_cost, efficiency in [
+        ("OCGT", 60.0, 0.39),
+        ("CCGT", 45.0, 0.5),
+    ]:
+        n.madd(
+            "Generator",
+            buses[conventional] + " " + carrier,
+            bus=buses[conventional],
+            carrier=carrier,
+            p_nom=rng.uniform(50.0, 800.0, len(conventional)),
+            weight=1.0,
+            efficiency=efficiency,
+            marginal_cost=marginal_cost,
+        )
+
+    hydro = rng.choice(n_buses, size=max(1, n_buses // 20), replace=False)
+    n.madd(
+        "StorageUnit",
+        buses[hydro] + " hydro",
+        bus=buses[hydro],
+        carrier="hydro",
+        p_nom=rng.uniform(100.0, 2000.0, len(hydro)),
+        max_hours=6.0,
+        inflow=pd.DataFrame(
+            200.0 * generate_profiles(rng, snapshots, len(hydro), "wind"),
+            index=snapshots,
+            columns=buses[hydro] + " hydro",
+        ),
+    )
+    n.madd(
+        "StorageUnit",
+        buses + " battery",
+        bus=buses,
+        carrier="battery",
+        p_nom_extendable=True,
+        max_hours=6.0,
+        capital_cost=150000.0,
+        efficiency_store=0.95,
+        efficiency_dispatch=0.95,
+    )
+
+    n.madd(
+        "Load",
+        buses,
+        bus=buses,
+        p_set=pd.DataFrame(
+            rng.uniform(20.0, 500.0, n_buses)
+            * generate_profiles(rng, snapshots, n_buses, "load"),
+            index=snapshots,
+            columns=buses,
+        ),
+    )
+
+    return n
+
+
+def generate_cutout(rng, path, n_cells, n_snapshots, country_shapes):
+    """
+    Artificial cutout with temperature data covering the country shapes.
+    """
+    xmin, ymin, xmax, ymax = country_shapes.total_bounds
+    ratio = (xmax - xmin) / (ymax - ymin)
+    ny = max(2, int(np.sqrt(n_cells / ratio)))
+    nx = max(2, int(n_cells / ny))
+    x = np.linspace(xmin, xmax, nx)
+    y = np.linspace(ymin, ymax, ny)
+    time = pd.date_range("2013-01-01", periods=n_snapshots, freq="h")
+
+    daily = 5.0 * np.sin(2 * np.pi * (time.hour.to_numpy() - 9) / 24)
+    temperature = 298.0 + daily[:, None, None] + rng.normal(0, 2, (len(time), ny, nx))
+    data = xr.Dataset(
+        {"temperature": (("time", "y", "x"), temperature.astype("float32"))},
+        coords={"time": time, "y": y, "x": x, "lat": ("y", y), "lon": ("x", x)},
+        attrs={"module": "era5", "prepared_features": ["temperature"]},
+    )
+    # reopen the cutout from disk so that it is read in chunks like a real one
+    data.to_netcdf(path)
+    return atlite.Cutout(path)
+
+
+def get_regions(country_shapes, n_regions):
+    """
+    Split the country shapes into about ``n_regions`` rectangular regions.
+    """
+    k = max(1, int(np.ceil(np.sqrt(n_regions / len(country_shapes)))))
+    regions = {}
+    for name, (xmin, ymin, xmax, ymax) in zip(
+        country_shapes["name"], country_shapes.bounds.to_numpy()
+    ):
+        dx, dy = (xmax - xmin) / k, (ymax - ymin) / k
+        for i in range(k):
+            for j in range(k):
+                regions[f"{name} {i * k + j}"] = box(
+                    xmin + i * dx,
+                    ymin + j * dy,
+                    xmin + (i + 1) * dx,
+                    ymin + (j + 1) * dy,
+                )
+    return gpd.GeoSeries(regions, crs="EPSG:4326").rename_axis("name")
+
+
+def time_stage(stage, func, setup, repeat):
+    """
+    Run ``func`` on the arguments returned by ``setup`` ``repeat`` times and
+    record the run time of every run, excluding the setup.
+    """
+    timings = []
+    for run in range(repeat):
+        args = setup()
+        start = time.perf_counter()
+        func(*args)
+        seconds = time.perf_counter() - start
+        timings.append({"stage": stage, "run": run, "seconds": seconds})
+        logger.info(f"{stage}: run {run} took {seconds:.2f} s")
+    return timings
+
+
+def time_import(module, repeat):
+    """
+    Time the import of the script ``module`` ``repeat`` times, each in a fresh
+    interpreter.
+
+    Failed imports, e.g. due to a missing optional dependency, are recorded
+    with a NaN run time.
+    """
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; print(time.perf_counter() - start)"
+    )
+    timings = []
+    for run in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode == 0:
+            seconds = float(result.stdout.strip().splitlines()[-1])
+        else:
+            logger.warning(
+                f"Import of {module} failed:\n{result.stderr.strip()[-1000:]}"
+            )
+            seconds = np.nan
+        timings.append({"stage": f"import_{module}", "run": run, "seconds": seconds})
+        logger.info(f"import_{module}: run {run} took {seconds:.2f} s")
+    return timings
+
+
+if __name__ == "__main__":
+    if "snakemake" not in globals():
+        from _helpers import mock_snakemake
+
+        snakemake = mock_snakemake("benchmark_synthetic", size="small")
+    configure_logging(snakemake)
+
+    # custom constraints and solving options are read from the snakemake object
+    solve_network.snakemake = snakemake
+
+    config = snakemake.params.benchmark_synthetic
+    size = config["sizes"][snakemake.wildcards.size]
+    repeat = config["repeat"]
+    geo_crs = snakemake.params.crs["geo_crs"]
+    distance_crs = snakemake.params.crs["distance_crs"]
+    base_voltage = snakemake.params.electricity["base_voltage"]
+    line_types = snakemake.params.lines["ac_types"]
+    aggregation_strategies = snakemake.params.cluster_options.get(
+        "aggregation_strategies", {}
+    )
+    solving = snakemake.params.solving
+
+    rng = np.random.default_rng(config["seed"])
+    country_shapes = get_country_shapes(config["countries"])
+
+    logger.info(f"Generating synthetic inputs of size '{snakemake.wildcards.size}'")
+    substations, lines = generate_osm_data(
+        rng, size["buses"], country_shapes, geo_crs=geo_crs
+    )
+    n = generate_network(
+        rng, size["buses"], size["snapshots"], country_shapes, line_types
+    )
+
+    timings = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        inputs = Dict(
+            substations=os.path.join(tmpdir, "substations.geojson"),
+            lines=os.path.join(tmpdir, "lines.geojson"),
+            country_shapes=os.path.join(tmpdir, "country_shapes.geojson"),
+        )
+        substations.to_file(inputs.substations)
+        lines.to_file(inputs.lines)
+        country_shapes.to_file(inputs.country_shapes)
+        outputs = {
+            k: os.path.join(tmpdir, "base_network", f"all_{k}_build_network.csv")
+            for k in ["lines", "converters", "transformers", "substations"]
+        }
+
+        timings += time_stage(
+            "build_osm_network",
+            built_network,
+            lambda: (
+                inputs,
+                outputs,
+                snakemake.params.build_osm_network,
+                config["countries"],
+                geo_crs,
+                distance_crs,
+            ),
+            repeat,
+        )
+
+        def simplify(n):
+            n, _ = simplify_network_to_base_voltage(
+                n, line_types[base_voltage], base_voltage
+            )
+            return aggregate_to_substations(n, aggregation_strategies)
+
+        timings += time_stage("simplify_network", simplify, lambda: (n.copy(),), repeat)
+
+        n_simplified, _ = simplify(n.copy())
+        timings += time_stage(
+            "cluster_network",
+            busmap_for_n_clusters,
+            lambda: (
+                None,
+                snakemake.params.build_shape_options,
+                config["countries"],
+                ["load"],
+                n_simplified.copy(),
+                size["clusters"],
+                solving["solver"]["name"],
+            ),
+            repeat,
+        )
+
+        def prepare(n):
+            n = average_every_nhours(n, "3h")
+            if find_spec("tsam") is None:
+                return n
+            return apply_time_segmentation(
+                n, len(n.snapshots) // 2, solving["solver"]["name"]
+            )
+
+        timings += time_stage("prepare_network", prepare, lambda: (n.copy(),), repeat)
+
+        def create_model(n):
+            n = solve_network.prepare_network(n, solving["options"])
+            n.optimize.create_model()
+
+        timings += time_stage(
+            "solve_network", create_model, lambda: (n.copy(),), repeat
+        )
+
+        cutout = generate_cutout(
+            rng,
+            os.path.join(tmpdir, "cutout.nc"),
+            size["cutout_cells"],
+            size["snapshots"],
+            country_shapes,
+        )
+        regions = get_regions(country_shapes, size["clusters"])
+        pop_layouts = {
+            area: xr.DataArray(
+                rng.uniform(0.0, 1000.0, cutout.shape),
+                coords={"y": cutout.coords["y"], "x": cutout.coords["x"]},
+                dims=("y", "x"),
+            )
+            for area in ["total", "rural", "urban"]
+        }
+
+        def build_profiles(cache_dir, single_pass=True):
+            I = get_indicator_matrix(cutout, regions, cache_dir=cache_dir)
+            M_tilde = {
+                area: get_population_weighted_matrix(I, pop_layout, normalize=True)
+                for area, pop_layout in pop_layouts.items()
+            }
+            if single_pass:
+                convert_areas_in_single_pass(cutout.temperature, M_tilde, regions.index)
+            else:
+                for M in M_tilde.values():
+                    cutout.temperature(matrix=M, index=regions.index)
+
+        timings += time_stage(
+            "build_cutout_profiles",
+            build_profiles,
+            lambda: (tempfile.mkdtemp(dir=tmpdir),),
+            repeat,
+        )
+        # former conversion with one cutout pass per area, for comparison
+        timings += time_stage(
+            "build_cutout_profiles_per_area",
+            build_profiles,
+            lambda: (tempfile.mkdtemp(dir=tmpdir), False),
+            repeat,
+        )
+
+    for module in config.get("import_modules", []):
+        timings += time_import(module, repeat)
+
+    timings = pd.DataFrame(timings)
+    timings.insert(0, "size", snakemake.wildcards.size)
+    logger.info(
+        "Minimum run time per stage in seconds:\n"
+        + timings.groupby("stage", sort=False).seconds.min().to_string()
+    )
+    os.makedirs(os.path.dirname(snakemake.output[0]), exist_ok=True)
+    timings.to_csv(snakemake.output[0], index=False)
@@ -13,13 +13,17 @@ from pathlib import Path
 from urllib.request import urlopen
 from zipfile import ZipFile
 
-import country_converter as coco
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import py7zr
 import requests
-from _helpers import BASE_DIR, aggregate_fuels, get_conv_factors
+from _helpers import (
+    BASE_DIR,
+    aggregate_fuels,
+    get_conv_factors,
+    get_country_converter,
+)
 
 _logger = logging.getLogger(__name__)
 
@@ -409,7 +413,7 @@ if __name__ == "__main__":
     df = df.loc[df["Commodity - Transaction"] != "Estimate"]
 
     # Create a column with iso2 country code
-    cc = coco.CountryConverter()
+    cc = get_country_converter()
     Country = pd.Series(df["Country or Area"])
 
     df["country"] = cc.pandas_convert(series=Country, to="ISO2", not_found="not found")
@@ -13,9 +13,13 @@ import os
 import re
 from pathlib import Path
 
-import country_converter as coco
 import pandas as pd
-from _helpers import aggregate_fuels, get_conv_factors, read_csv_nafix
+from _helpers import (
+    aggregate_fuels,
+    get_conv_factors,
+    get_country_converter,
+    read_csv_nafix,
+)
 from prepare_sector_network import get
 
 # def calc_industry_base(df):
@@ -144,7 +148,7 @@ if __name__ == "__main__":
     df = df.loc[df["Commodity - Transaction"] != "Estimate"]
 
     # Create a column with iso2 country code
-    cc = coco.CountryConverter()
+    cc = get_country_converter()
     Country = pd.Series(df["Country or Area"])
 
     df["country"] = cc.pandas_convert(series=Country, to="ISO2", not_found="not found")
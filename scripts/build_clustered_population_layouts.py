@@ -11,7 +11,7 @@ import atlite
 import geopandas as gpd
 import pandas as pd
 import xarray as xr
-from _helpers import read_csv_nafix, to_csv_nafix
+from _helpers import get_indicator_matrix, read_csv_nafix, to_csv_nafix
 
 if __name__ == "__main__":
     if "snakemake" not in globals():
@@ -36,7 +36,7 @@ if __name__ == "__main__":
         .squeeze()
     )
 
-    I = cutout.indicatormatrix(clustered_regions)
+    I = get_indicator_matrix(cutout, clustered_regions)
 
     pop = {}
     for item in ["total", "urban", "rural"]:
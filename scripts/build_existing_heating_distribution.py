@@ -41,13 +41,13 @@ References:
 import logging
 import os
 
-import country_converter as coco
 import numpy as np
 import pandas as pd
+from _helpers import get_country_converter
 
 logger = logging.getLogger(__name__)
 
-cc = coco.CountryConverter()
+cc = get_country_converter()
 
 
 def build_existing_heating():
@@ -10,9 +10,16 @@ import os
 
 import atlite
 import geopandas as gpd
-import numpy as np
 import pandas as pd
 import xarray as xr
+from _helpers import (
+    convert_areas_in_single_pass,
+    create_logger,
+    get_indicator_matrix,
+    get_population_weighted_matrix,
+)
+
+logger = create_logger(__name__)
 
 if __name__ == "__main__":
     if "snakemake" not in globals():
@@ -31,14 +38,22 @@ if __name__ == "__main__":
         .squeeze()
     )
 
-    I = cutout.indicatormatrix(clustered_regions)
+    I = get_indicator_matrix(cutout, clustered_regions)
 
-    for area in ["rural", "urban", "total"]:
-        pop_layout = xr.open_dataarray(snakemake.input[f"pop_layout_{area}"])
+    areas = ["rural", "urban", "total"]
 
-        stacked_pop = pop_layout.stack(spatial=("y", "x"))
-        M = I.T.dot(np.diag(I.dot(stacked_pop)))
+    M = {
+        area: get_population_weighted_matrix(
+            I, xr.open_dataarray(snakemake.input[f"pop_layout_{area}"])
+        )
+        for area in areas
+    }
 
-        heat_demand = cutout.heat_demand(matrix=M.T, index=clustered_regions.index)
+    # a single cutout pass for all areas
+    logger.info(f"Converting heat demand for areas {areas} in a single cutout pass")
+    heat_demand = convert_areas_in_single_pass(
+        cutout.heat_demand, M, clustered_regions.index
+    )
 
-        heat_demand.to_netcdf(snakemake.output[f"heat_demand_{area}"])
+    for area in areas:
+        heat_demand[area].to_netcdf(snakemake.output[f"heat_demand_{area}"])
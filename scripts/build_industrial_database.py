@@ -5,12 +5,11 @@
 
 import math
 
-import country_converter as coco
 import numpy as np
 import pandas as pd
 import pycountry
 import requests
-from _helpers import content_retrieve
+from _helpers import content_retrieve, get_country_converter
 from geopy.geocoders import Nominatim
 
 
@@ -109,7 +108,7 @@ def create_steel_db():
     df_steel = df_steel.loc[df_steel["Status"] == "operating"]
 
     # Create a column with iso2 country code
-    cc = coco.CountryConverter()
+    cc = get_country_converter()
     Country = pd.Series(df_steel["Country"])
     df_steel["country"] = cc.pandas_convert(series=Country, to="ISO2")
 
@@ -259,7 +258,7 @@ def create_cement_db():
     df_cement = df_cement.loc[df_cement["status"] == "Operating"]
 
     # Create a column with iso2 country code
-    cc = coco.CountryConverter()
+    cc = get_country_converter()
     iso3 = pd.Series(df_cement["iso3"])
     df_cement["country"] = cc.pandas_convert(series=iso3, to="ISO2")
 
@@ -435,7 +434,7 @@ def create_paper_df():
     # df_paper = df_paper.loc[df_paper["status"] == "Operating"]
 
     # Create a column with iso2 country code
-    cc = coco.CountryConverter()
+    cc = get_country_converter()
     iso3 = pd.Series(df_paper["iso3"])
     df_paper["country"] = cc.pandas_convert(series=iso3, to="ISO2")
 
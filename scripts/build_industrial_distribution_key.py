@@ -14,7 +14,7 @@ from itertools import product
 
 import geopandas as gpd
 import pandas as pd
-from _helpers import locate_bus, three_2_two_digits_country
+from _helpers import convert_country_codes, locate_bus
 from shapely.geometry import Point
 
 logger = logging.getLogger(__name__)
@@ -140,8 +140,9 @@ if __name__ == "__main__":
     if regions["name"][0][
         :3
     ].isalpha():  # TODO clean later by changing all codes to 2 letters
-        regions["name"] = regions["name"].apply(
-            lambda name: three_2_two_digits_country(name[:3]) + name[3:]
+        regions["name"] = (
+            convert_country_codes(regions["name"].str[:3], to="ISO2")
+            + regions["name"].str[3:]
         )
 
     if snakemake.params.industry_database:
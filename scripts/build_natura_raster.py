@@ -43,7 +43,15 @@ To operate the script you need all input files.
 This script collects all shapefiles available in the folder `data/landcover/*` describing regions of protected areas,
 merges them to one shapefile, and create a rasterized version of the region, that covers the region described by the cutout.
 The output is a raster file with the name `natura.tiff` in the folder `resources/natura/`.
+
+When ``build_natura_raster_options: tiled: true`` is set, the shapes are not merged into one multishape.
+Instead, the output extent is split into square tiles of ``tile_size`` pixels and, for every tile, only the
+protected areas intersecting the tile are rasterized. As rasterizing overlapping shapes leads to the same
+mask as rasterizing their union, the result is the same as the one of the default mode, while the memory
+footprint is limited to the shapes and a single tile per process. Tiles can be computed in parallel using
+``nprocesses`` processes and are written block-wise into a compressed GeoTIFF.
 """
+import multiprocessing as mp
 import os
 
 import atlite
@@ -52,7 +60,12 @@ import numpy as np
 import rasterio as rio
 from _helpers import configure_logging, create_logger
 from rasterio.features import geometry_mask
+from rasterio.transform import array_bounds
 from rasterio.warp import transform_bounds
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform
+from shapely.geometry import box
+from tqdm import tqdm
 
 logger = create_logger(__name__)
 
@@ -107,24 +120,16 @@ def get_transform_and_shape(bounds, res, out_logging):
     return transform, shape
 
 
-def unify_protected_shape_areas(inputs, natura_crs, out_logging):
+def read_protected_shapes(inputs, natura_crs, out_logging):
     """
-    Iterates through all snakemake rule inputs and unifies shapefiles (.shp)
-    only.
-
-    The input is given in the Snakefile and shapefiles are given by .shp
-
+    Iterates through all snakemake rule inputs and reads the valid geometries
+    of the shapefiles (.shp) only.
 
     Returns
     -------
-    unified_shape : GeoDataFrame with a unified "multishape"
+    shape : GeoDataFrame with one row per valid protected area
     """
     import pandas as pd
-    from shapely.ops import unary_union
-    from shapely.validation import make_valid
-
-    if out_logging:
-        logger.info("Stage 3/5: Unify protected shape area.")
 
     # Read only .shp snakemake inputs
     shp_files = [string for string in inputs if ".shp" in string]
@@ -161,6 +166,28 @@ def unify_protected_shape_areas(inputs, natura_crs, out_logging):
     shape = gpd.GeoDataFrame(shape, crs=natura_crs)
     shape = shape.rename(columns={0: "geometry"}).set_geometry("geometry")
 
+    return shape.reset_index(drop=True)
+
+
+def unify_protected_shape_areas(inputs, natura_crs, out_logging):
+    """
+    Iterates through all snakemake rule inputs and unifies shapefiles (.shp)
+    only.
+
+    The input is given in the Snakefile and shapefiles are given by .shp
+
+
+    Returns
+    -------
+    unified_shape : GeoDataFrame with a unified "multishape"
+    """
+    from shapely.ops import unary_union
+
+    if out_logging:
+        logger.info("Stage 3/5: Unify protected shape area.")
+
+    shape = read_protected_shapes(inputs, natura_crs, out_logging)
+
     # Unary_union makes out of i.e. 1000 shapes -> 1 unified shape
     if out_logging:
         logger.info("Stage 3/5: Unify protected shape area. Step 2: Unify all shapes")
@@ -174,6 +201,105 @@ def unify_protected_shape_areas(inputs, natura_crs, out_logging):
     return unified_shape
 
 
+def get_tile_windows(out_shape, tile_size):
+    """
+    Split a raster of shape (height, width) into square windows of at most
+    tile_size x tile_size pixels.
+    """
+    height, width = out_shape
+    return [
+        Window(col, row, min(tile_size, width - col), min(tile_size, height - row))
+        for row in range(0, height, tile_size)
+        for col in range(0, width, tile_size)
+    ]
+
+
+def _init_process_tiles(shapes_, transform_):
+    global tile_shapes, tile_transform
+    tile_shapes, tile_transform = shapes_, transform_
+
+
+def rasterize_tile(window):
+    """
+    Rasterize the protected areas intersecting a window of the output raster.
+
+    Only the shapes whose bounding box intersects the window are selected via
+    the spatial index of the shapes, so that no global union is needed.
+
+    Returns
+    -------
+    window : rasterio.windows.Window
+    raster : np.ndarray of uint8 with shape (window.height, window.width)
+    """
+    win_transform = window_transform(window, tile_transform)
+    win_shape = (int(window.height), int(window.width))
+    west, south, east, north = array_bounds(*win_shape, win_transform)
+    idx = tile_shapes.sindex.query(box(west, south, east, north))
+
+    if len(idx) == 0:
+        return window, np.zeros(win_shape, dtype=rio.uint8)
+
+    raster = ~geometry_mask(tile_shapes.geometry.iloc[idx], win_shape, win_transform)
+    return window, raster.astype(rio.uint8)
+
+
+def rasterize_tiled(
+    shapes,
+    out_shape,
+    transform,
+    natura_crs,
+    output,
+    tile_size=4096,
+    nprocesses=1,
+    out_logging=False,
+):
+    """
+    Rasterize the protected areas tile by tile and write every tile into a
+    compressed, block-tiled GeoTIFF as soon as it is computed.
+    """
+    windows = get_tile_windows(out_shape, tile_size)
+
+    if out_logging:
+        logger.info(
+            f"Stage 4/5: Mask geometry in {len(windows)} tiles using {nprocesses} processes"
+        )
+
+    profile = dict(
+        driver="GTiff",
+        dtype=rio.uint8,
+        count=1,
+        transform=transform,
+        crs=natura_crs,
+        compress="lzw",
+        width=out_shape[1],
+        height=out_shape[0],
+        tiled=True,
+        blockxsize=256,
+        blockysize=256,
+        BIGTIFF="IF_SAFER",
+    )
+
+    tqdm_kwargs = dict(ascii=False, desc="Rasterize protected areas", unit=" tile")
+    with rio.open(output, "w", **profile) as dst:
+        with tqdm(total=len(windows), **tqdm_kwargs) as pbar:
+            if nprocesses > 1:
+                kwargs = {
+                    "initializer": _init_process_tiles,
+                    "initargs": (shapes, transform),
+                    "processes": nprocesses,
+                }
+                with mp.get_context("spawn").Pool(**kwargs) as pool:
+                    for window, raster in pool.imap_unordered(rasterize_tile, windows):
+                        dst.write(raster, indexes=1, window=window)
+                        pbar.update(1)
+            else:
+                _init_process_tiles(shapes, transform)
+                for window in windows:
+                    window, raster = rasterize_tile(window)
+                    dst.write(raster, indexes=1, window=window)
+                    pbar.update(1)
+
+
 if __name__ == "__main__":
     if "snakemake" not in globals():
         from _helpers import mock_snakemake
@@ -200,27 +326,45 @@ if __name__ == "__main__":
         bounds, res=100, out_logging=out_logging
     )
     # adjusted boundaries
-    shapes = unify_protected_shape_areas(
-        shapefiles, natura_crs, out_logging=out_logging
-    )
+    options = snakemake.params.options
+
+    if options.get("tiled", False):
+        shapes = read_protected_shapes(shapefiles, natura_crs, out_logging=out_logging)
+        rasterize_tiled(
+            shapes,
+            out_shape,
+            transform,
+            natura_crs,
+            snakemake.output[0],
+            tile_size=options.get("tile_size", 4096),
+            nprocesses=options.get("nprocesses", 1),
+            out_logging=out_logging,
+        )
+        if out_logging:
+            logger.info("Stage 5/5: Export as .tiff completed")
 
-    if out_logging:
-        logger.info("Stage 4/5: Mask geometry")
-    raster = ~geometry_mask(shapes.geometry, out_shape, transform)
-    raster = raster.astype(rio.uint8)
+    else:
+        shapes = unify_protected_shape_areas(
+            shapefiles, natura_crs, out_logging=out_logging
+        )
 
-    if out_logging:
-        logger.info("Stage 5/5: Export as .tiff")
-    with rio.open(
-        snakemake.output[0],
-        "w",
-        driver="GTiff",
-        dtype=rio.uint8,
-        count=1,
-        transform=transform,
-        crs=natura_crs,
-        compress="lzw",
-        width=raster.shape[1],
-        height=raster.shape[0],
-    ) as dst:
-        dst.write(raster, indexes=1)
+        if out_logging:
+            logger.info("Stage 4/5: Mask geometry")
+        raster = ~geometry_mask(shapes.geometry, out_shape, transform)
+        raster = raster.astype(rio.uint8)
+
+        if out_logging:
+            logger.info("Stage 5/5: Export as .tiff")
+        with rio.open(
+            snakemake.output[0],
+            "w",
+            driver="GTiff",
+            dtype=rio.uint8,
+            count=1,
+            transform=transform,
+            crs=natura_crs,
+            compress="lzw",
+            width=raster.shape[1],
+            height=raster.shape[0],
+        ) as dst:
+            dst.write(raster, indexes=1)
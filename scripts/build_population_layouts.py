@@ -12,8 +12,9 @@ import atlite
 import geopandas as gpd
 import numpy as np
 import pandas as pd
+import scipy.sparse as sparse
 import xarray as xr
-from _helpers import read_csv_nafix
+from _helpers import get_indicator_matrix, read_csv_nafix
 
 if __name__ == "__main__":
     if "snakemake" not in globals():
@@ -43,7 +44,7 @@ if __name__ == "__main__":
 
     # Indicator matrix grid_cells -> NUTS3; inprinciple Iinv*I is identity
     # but imprecisions mean not perfect
-    Iinv = cutout.indicatormatrix(nuts3.geometry)
+    Iinv = get_indicator_matrix(cutout, nuts3.geometry)
 
     countries = np.sort(nuts3.country.unique())
 
@@ -79,41 +80,68 @@ if __name__ == "__main__":
 
     # pop per km^2
     density_cells_pop = pop_cells / cell_areas
-    density_cells_gdp = gdp_cells / cell_areas
 
-    # rural or urban population in grid cell
-    pop_rural = pd.Series(0.0, density_cells_pop.index)
-    pop_urban = pd.Series(0.0, density_cells_pop.index)
-
-    for ct in countries:
-        indicator_nuts3_ct = nuts3.country.apply(lambda x: 1.0 if x == ct else 0.0)
-
-        indicator_cells_ct = pd.Series(Iinv.T.dot(indicator_nuts3_ct))
-
-        density_cells_pop_ct = indicator_cells_ct * density_cells_pop
-        density_cells_gdp_ct = indicator_cells_ct * density_cells_gdp
+    # Indicator matrix countries -> grid cells, kept sparse so that only the
+    # country-cell pairs that overlap are processed
+    country_i = pd.Index(countries).get_indexer(nuts3.country)
+    indicator_nuts3_ct = sparse.csr_matrix(
+        (np.ones(len(nuts3)), (country_i, np.arange(len(nuts3)))),
+        shape=(len(countries), len(nuts3)),
+    )
+    indicator_cells_ct = sparse.csr_matrix(indicator_nuts3_ct.dot(Iinv))
+    indicator_cells_ct.eliminate_zeros()
+    indicator_cells_ct = indicator_cells_ct.tocoo()
 
-        pop_cells_ct = indicator_cells_ct * pop_cells
-        gdp_cells_ct = indicator_cells_ct * gdp_cells
-        # correct for imprecision of Iinv*I
-        pop_ct = nuts3.loc[nuts3.country == ct, "pop"].sum()
-        pop_cells_ct *= pop_ct / pop_cells_ct.sum()
+    ct_i = indicator_cells_ct.row
+    cell_i = indicator_cells_ct.col
 
-        gdp_ct = nuts3.loc[nuts3.country == ct, "gdp"].sum()
-        gdp_cells_ct *= gdp_ct / gdp_cells_ct.sum()
+    density_cells_pop_ct = indicator_cells_ct.data * density_cells_pop.values[cell_i]
+    pop_cells_ct = indicator_cells_ct.data * pop_cells.values[cell_i]
 
-        # The first low density grid cells to reach rural fraction are rural
-        asc_density_i = density_cells_pop_ct.sort_values().index
-        asc_density_cumsum = pop_cells_ct[asc_density_i].cumsum() / pop_cells_ct.sum()
-        rural_fraction_ct = 1 - urban_fraction[ct]
-        pop_ct_rural_b = asc_density_cumsum < rural_fraction_ct
-        pop_ct_urban_b = ~pop_ct_rural_b
+    # correct for imprecision of Iinv*I
+    pop_ct = nuts3.groupby("country")["pop"].sum().loc[countries].values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correction = pop_ct / np.bincount(
+            ct_i, weights=pop_cells_ct, minlength=len(countries)
+        )
+    pop_cells_ct *= correction[ct_i]
+
+    # The first low density grid cells to reach rural fraction are rural;
+    # cells are sorted by density within each country in a single pass
+    asc_density_i = np.lexsort((density_cells_pop_ct, ct_i))
+    pop_total_ct = np.bincount(ct_i, weights=pop_cells_ct, minlength=len(countries))
+    asc_density_cumsum = (
+        pd.Series(pop_cells_ct[asc_density_i])
+        .groupby(ct_i[asc_density_i])
+        .cumsum()
+        .values
+        / pop_total_ct[ct_i[asc_density_i]]
+    )
+    rural_fraction_ct = 1 - urban_fraction.loc[countries].values
 
-        pop_ct_rural_b[indicator_cells_ct == 0.0] = False
-        pop_ct_urban_b[indicator_cells_ct == 0.0] = False
+    pop_ct_rural_b = np.empty(len(asc_density_i), dtype=bool)
+    pop_ct_rural_b[asc_density_i] = (
+        asc_density_cumsum < rural_fraction_ct[ct_i[asc_density_i]]
+    )
+    pop_ct_urban_b = ~pop_ct_rural_b
 
-        pop_rural += pop_cells_ct.where(pop_ct_rural_b, 0.0)
-        pop_urban += pop_cells_ct.where(pop_ct_urban_b, 0.0)
+    # rural or urban population in grid cell
+    pop_rural = pd.Series(
+        np.bincount(
+            cell_i,
+            weights=np.where(pop_ct_rural_b, pop_cells_ct, 0.0),
+            minlength=len(density_cells_pop),
+        ),
+        density_cells_pop.index,
+    )
+    pop_urban = pd.Series(
+        np.bincount(
+            cell_i,
+            weights=np.where(pop_ct_urban_b, pop_cells_ct, 0.0),
+            minlength=len(density_cells_pop),
+        ),
+        density_cells_pop.index,
+    )
 
     pop_cells = {"total": pop_cells}
     pop_cells["rural"] = pop_rural
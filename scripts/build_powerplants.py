@@ -110,10 +110,10 @@ import pypsa
 import yaml
 from _helpers import (
     configure_logging,
+    convert_country_codes,
     create_logger,
     read_csv_nafix,
     to_csv_nafix,
-    two_digits_2_name_country,
 )
 from scipy.spatial import cKDTree as KDTree
 from shapely.geometry import Point
@@ -181,7 +181,7 @@ def convert_osm_to_pm(filepath_ppl_osm, filepath_ppl_pm):
             )
         )
         .assign(
-            Country=lambda df: df.Country.map(two_digits_2_name_country),
+            Country=lambda df: convert_country_codes(df.Country, to="name_short"),
             # Name=lambda df: "OSM_"
             # + df.Country.astype(str)
             # + "_"
@@ -308,7 +308,7 @@ if __name__ == "__main__":
 
     n = pypsa.Network(snakemake.input.base_network)
     countries_codes = n.buses.country.unique()
-    countries_names = list(map(two_digits_2_name_country, countries_codes))
+    countries_names = convert_country_codes(countries_codes, to="name_short")
 
     config["target_countries"] = countries_names
 
@@ -196,19 +196,23 @@ import time
 from math import isnan
 
 import atlite
-import country_converter as coco
 import geopandas as gpd
 import numpy as np
 import pandas as pd
 import progressbar as pgb
 import xarray as xr
-from _helpers import BASE_DIR, configure_logging, create_logger
+from _helpers import (
+    BASE_DIR,
+    configure_logging,
+    create_logger,
+    get_country_converter,
+)
 from add_electricity import load_powerplants
 from dask.distributed import Client
 from pypsa.geo import haversine
 from shapely.geometry import LineString, Point, box
 
-cc = coco.CountryConverter()
+cc = get_country_converter()
 
 logger = create_logger(__name__)
 
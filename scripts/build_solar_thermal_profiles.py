@@ -10,9 +10,16 @@ import os
 
 import atlite
 import geopandas as gpd
-import numpy as np
 import pandas as pd
 import xarray as xr
+from _helpers import (
+    convert_areas_in_single_pass,
+    create_logger,
+    get_indicator_matrix,
+    get_population_weighted_matrix,
+)
+
+logger = create_logger(__name__)
 
 if __name__ == "__main__":
     if "snakemake" not in globals():
@@ -37,20 +44,24 @@ if __name__ == "__main__":
         .squeeze()
     )
 
-    I = cutout.indicatormatrix(clustered_regions)
-
-    for area in ["total", "rural", "urban"]:
-        pop_layout = xr.open_dataarray(snakemake.input[f"pop_layout_{area}"])
-
-        stacked_pop = pop_layout.stack(spatial=("y", "x"))
-        M = I.T.dot(np.diag(I.dot(stacked_pop)))
+    I = get_indicator_matrix(cutout, clustered_regions)
 
-        nonzero_sum = M.sum(axis=0, keepdims=True)
-        nonzero_sum[nonzero_sum == 0.0] = 1.0
-        M_tilde = M / nonzero_sum
+    areas = ["total", "rural", "urban"]
 
-        solar_thermal = cutout.solar_thermal(
-            **config, matrix=M_tilde.T, index=clustered_regions.index
+    M_tilde = {
+        area: get_population_weighted_matrix(
+            I,
+            xr.open_dataarray(snakemake.input[f"pop_layout_{area}"]),
+            normalize=True,
         )
+        for area in areas
+    }
+
+    # a single cutout pass for all areas
+    logger.info(f"Converting solar thermal for areas {areas} in a single cutout pass")
+    solar_thermal = convert_areas_in_single_pass(
+        cutout.solar_thermal, M_tilde, clustered_regions.index, **config
+    )
 
-        solar_thermal.to_netcdf(snakemake.output[f"solar_thermal_{area}"])
+    for area in areas:
+        solar_thermal[area].to_netcdf(snakemake.output[f"solar_thermal_{area}"])
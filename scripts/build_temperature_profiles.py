@@ -9,9 +9,16 @@ import os
 
 import atlite
 import geopandas as gpd
-import numpy as np
 import pandas as pd
 import xarray as xr
+from _helpers import (
+    convert_areas_in_single_pass,
+    create_logger,
+    get_indicator_matrix,
+    get_population_weighted_matrix,
+)
+
+logger = create_logger(__name__)
 
 if __name__ == "__main__":
     if "snakemake" not in globals():
@@ -37,24 +44,28 @@ if __name__ == "__main__":
         .squeeze()
     )
 
-    I = cutout.indicatormatrix(clustered_regions)
-
-    for area in ["total", "rural", "urban"]:
-        pop_layout = xr.open_dataarray(snakemake.input[f"pop_layout_{area}"])
-
-        stacked_pop = pop_layout.stack(spatial=("y", "x"))
-        M = I.T.dot(np.diag(I.dot(stacked_pop)))
-
-        nonzero_sum = M.sum(axis=0, keepdims=True)
-        nonzero_sum[nonzero_sum == 0.0] = 1.0
-        M_tilde = M / nonzero_sum
+    I = get_indicator_matrix(cutout, clustered_regions)
 
-        temp_air = cutout.temperature(matrix=M_tilde.T, index=clustered_regions.index)
+    areas = ["total", "rural", "urban"]
 
-        temp_air.to_netcdf(snakemake.output[f"temp_air_{area}"])
-
-        temp_soil = cutout.soil_temperature(
-            matrix=M_tilde.T, index=clustered_regions.index
+    M_tilde = {
+        area: get_population_weighted_matrix(
+            I,
+            xr.open_dataarray(snakemake.input[f"pop_layout_{area}"]),
+            normalize=True,
         )
+        for area in areas
+    }
+
+    # a single cutout pass per conversion for all areas
+    logger.info(f"Converting temperatures for areas {areas} in a single cutout pass")
+    temp_air = convert_areas_in_single_pass(
+        cutout.temperature, M_tilde, clustered_regions.index
+    )
+    temp_soil = convert_areas_in_single_pass(
+        cutout.soil_temperature, M_tilde, clustered_regions.index
+    )
 
-        temp_soil.to_netcdf(snakemake.output[f"temp_soil_{area}"])
+    for area in areas:
+        temp_air[area].to_netcdf(snakemake.output[f"temp_air_{area}"])
+        temp_soil[area].to_netcdf(snakemake.output[f"temp_soil_{area}"])
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+# SPDX-FileCopyrightText:  PyPSA-Earth and PyPSA-Eur Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+# -*- coding: utf-8 -*-
+"""
+Calibrates the Snakemake resources of the rules from their benchmark history.
+
+Relevant Settings
+-----------------
+
+.. code:: yaml
+
+    resource_calibration:
+        enable:
+        history:
+        model:
+        safety_factor:
+        min_samples:
+
+.. seealso::
+    Documentation of the configuration file ``config.yaml`` at
+    :ref:`resource_calibration_cf`
+
+Inputs
+------
+- the benchmark files written by Snakemake for the rules with a ``benchmark:`` directive, e.g. in ``benchmarks/`` or ``results/benchmarks/``
+
+Outputs
+-------
+- ``resources/resource_history.csv``: maximum memory and run time of every benchmarked job with the size of its scenario
+- ``resources/resource_model.yaml``: fitted resource model per rule
+
+Description
+-----------
+The memory and run time of a rule depend on the size of the scenario, i.e.
+the number of countries, clusters, snapshots and cutout cells. After every
+successful workflow run, the benchmark files written by this run are matched
+against the benchmark patterns of the rules and recorded in the history
+together with the size of the current scenario. For each rule with at least ``min_samples``
+records, the logarithm of the maximum resident memory and of the run time is
+fitted linearly against the logarithm of the size features which vary in the
+history. The prediction is raised by the largest underestimation observed in
+the history and by ``safety_factor``.
+
+The Snakefile supplies ``resources: mem_mb`` and ``runtime`` of the calibrated
+rules from this model, falling back to the constant resources of the rule when
+no model is available for the rule or the scenario.
+
+.. note::
+    Benchmark files of earlier runs are not recorded, since the size of their
+    scenario is unknown.
+"""
+
+import functools
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import yaml
+from _helpers import BASE_DIR, create_logger
+
+logger = create_logger(__name__)
+
+FEATURES = ["countries", "clusters", "snapshots", "cutout_cells"]
+
+# benchmark columns of the calibrated resources
+RESOURCE_COLUMNS = {"mem_mb": "max_rss", "runtime": "s"}
+
+
+@functools.lru_cache
+def get_cutout_cells(path):
+    """
+    Number of grid cells of the cutout at ``path``, NaN if it does not exist.
+    """
+    import xarray as xr
+
+    if not os.path.isfile(path):
+        return np.nan
+    with xr.open_dataset(path) as ds:
+        return ds.sizes["x"] * ds.sizes["y"]
+
+
+def get_scenario_features(config, wildcards=None):
+    """
+    Size features of a scenario, refined by the wildcards of a job.
+
+    Parameters
+    ----------
+    config : dict
+        Workflow configuration.
+    wildcards : dict-like, optional
+        Wildcards of the job, of which ``clusters`` and ``opts`` are used.
+
+    Returns
+    -------
+    dict
+        Number of countries, clusters, snapshots and cutout cells, NaN if unknown.
+    """
+    wildcards = wildcards or {}
+
+    snapshots = len(pd.date_range(freq="h", **config["snapshots"]))
+    for o in str(wildcards.get("opts", "")).split("-"):
+        m = re.match(r"^(\d+)h$", o, re.IGNORECASE)
+        if m is not None:
+            snapshots /= int(m.group(1))
+        m = re.match(r"^(\d+)seg$", o, re.IGNORECASE)
+        if m is not None:
+            snapshots = int(m.group(1))
+
+    m = re.match(r"^(\d+)", str(wildcards.get("clusters", "")))
+    clusters = int(m.group(1)) if m is not None else np.nan
+
+    run = config.get("run", {})
+    cdir = (
+        run["name"] + "/" if run.get("name") and not run.get("shared_cutouts") else ""
+    )
+    cutout_cells = sum(
+        get_cutout_cells(os.path.join(BASE_DIR, "cutouts", cdir + f"{cutout}.nc"))
+        for cutout in config["atlite"]["cutouts"]
+    )
+
+    return {
+        "countries": len(config["countries"]),
+        "clusters": clusters,
+        "snapshots": snapshots,
+        "cutout_cells": cutout_cells,
+    }
+
+
+def read_benchmark(path):
+    """
+    Maximum memory in MB and run time in seconds of a Snakemake benchmark file.
+    """
+    df = pd.read_csv(path, sep="\t", na_values=["-", "NA"])
+    return (
+        df[list(RESOURCE_COLUMNS.values())].apply(pd.to_numeric, errors="coerce").max()
+    )
+
+
+def get_benchmark_roots(benchmark_patterns):
+    """
+    Directories containing the benchmark files of the patterns, without the
+    directories nested in another one.
+
+    Rules whose benchmark files do not lie in a directory of the working
+    directory are reported and not recorded.
+    """
+    roots = set()
+    for rule, pattern in benchmark_patterns.items():
+        root = os.path.normpath(os.path.dirname(pattern.split("{")[0]) or ".")
+        if root == "." or os.path.isabs(root) or root.startswith(".."):
+            logger.warning(
+                f"Benchmarks of rule '{rule}' at '{pattern}' do not lie in a "
+                "directory of the working directory and are not recorded."
+            )
+            continue
+        roots.add(root)
+
+    directories = []
+    for root in sorted(roots):
+        if not any(root.startswith(d + os.sep) for d in directories):
+            directories.append(root)
+    return directories
+
+
+def update_resource_history(benchmark_patterns, config, history_path, since=None):
+    """
+    Record the benchmark files, which are not yet in the history, with the
+    size features of the current scenario.
+
+    Parameters
+    ----------
+    benchmark_patterns : dict
+        Benchmark file pattern per rule name, e.g.
+        ``{"cluster_network": "benchmarks/cluster_network/elec_s{simpl}_{clusters}"}``.
+    config : dict
+        Workflow configuration.
+    history_path : str
+        CSV file of the history.
+    since : float, optional
+        Start time of the workflow run as a timestamp. Older benchmark files
+        belong to other scenarios and are skipped.
+
+    Returns
+    -------
+    pd.DataFrame
+        Updated history.
+    """
+    from snakemake.io import regex
+
+    if os.path.isfile(history_path):
+        history = pd.read_csv(history_path)
+    else:
+        history = pd.DataFrame(
+            columns=["file", "mtime", "rule"]
+            + list(RESOURCE_COLUMNS.values())
+            + FEATURES
+        )
+    recorded = set(zip(history["file"], history["mtime"]))
+
+    # more specific patterns first, e.g. with a directory before without
+    patterns = sorted(
+        (
+            (rule, re.compile(regex(pattern)))
+            for rule, pattern in benchmark_patterns.items()
+        ),
+        key=lambda x: -len(x[1].pattern),
+    )
+
+    records = []
+    skipped = 0
+    for directory in get_benchmark_roots(benchmark_patterns):
+        for root, _, files in os.walk(directory):
+            for fn in files:
+                path = os.path.join(root, fn)
+                mtime = round(os.path.getmtime(path), 3)
+                if (path, mtime) in recorded:
+                    continue
+                if since is not None and mtime < since:
+                    skipped += 1
+                    continue
+                for rule, pattern in patterns:
+                    match = pattern.match(path)
+                    if match is None:
+                        continue
+                    try:
+                        usage = read_benchmark(path)
+                    except (pd.errors.ParserError, KeyError, ValueError):
+                        break
+                    features = get_scenario_features(config, match.groupdict())
+                    records.append(
+                        {
+                            "file": path,
+                            "mtime": mtime,
+                            "rule": rule,
+                            **usage,
+                            **features,
+                        }
+                    )
+                    break
+
+    if skipped:
+        logger.info(f"Skipped {skipped} benchmark files of earlier workflow runs")
+    if records:
+        logger.info(f"Recording {len(records)} new benchmarks in {history_path}")
+        history = pd.concat([history, pd.DataFrame(records)], ignore_index=True)
+        os.makedirs(os.path.dirname(history_path) or ".", exist_ok=True)
+        history.to_csv(history_path, index=False)
+
+    return history
+
+
+def fit_resource_model(history, min_samples=3):
+    """
+    Fit the logarithm of the memory and run time of each rule against the
+    logarithm of the size features varying in its history.
+
+    Returns
+    -------
+    dict
+        Per rule and resource the used features, the coefficients, the
+        intercept, the margin of the largest underestimation and the
+        maximum of the history.
+    """
+    model = {}
+    for rule, df in history.groupby("rule"):
+        for resource, column in RESOURCE_COLUMNS.items():
+            y = df[column].astype(float)
+            valid = y > 0
+            if valid.sum() < min_samples:
+                continue
+            y = np.log(y[valid].to_numpy())
+            X = df.loc[valid, FEATURES].astype(float)
+            features = [
+                f for f in FEATURES if X[f].notnull().all() and X[f].nunique() > 1
+            ]
+            # keep the problem overdetermined
+            features = features[: max(0, len(y) - 2)]
+            A = np.c_[np.ones(len(y)), np.log1p(X[features].to_numpy())]
+            coef = np.linalg.lstsq(A, y, rcond=None)[0]
+            margin = max(0.0, float((y - A @ coef).max()))
+            model.setdefault(rule, {})[resource] = {
+                "features": features,
+                "intercept": float(coef[0]),
+                "coefficients": [float(c) for c in coef[1:]],
+                "margin": margin,
+                "maximum": float(np.exp(y.max())),
+                "samples": int(len(y)),
+            }
+    return model
+
+
+def update_resource_model(benchmark_patterns, config, since=None):
+    """
+    Update the history with the benchmark files of the workflow run started
+    at ``since`` and refit the resource model, e.g. in the ``onsuccess``
+    handler of the Snakefile.
+    """
+    calibration = config["resource_calibration"]
+    history = update_resource_history(
+        benchmark_patterns, config, calibration["history"], since
+    )
+    model = fit_resource_model(history, calibration["min_samples"])
+    with open(calibration["model"], "w") as f:
+        yaml.safe_dump(model, f, sort_keys=True)
+    logger.info(
+        f"Resource model of {len(model)} rules written to {calibration['model']}"
+    )
+
+
+@functools.lru_cache
+def _load_resource_model(path, mtime):
+    with open(path) as f:
+        return yaml.safe_load(f) or {}
+
+
+def load_resource_model(config):
+    """
+    Fitted resource model, empty if the calibration is disabled or no model
+    was fitted yet.
+    """
+    calibration = config.get("resource_calibration", {})
+    path = calibration.get("model")
+    if not calibration.get("enable", False) or not path or not os.path.isfile(path):
+        return {}
+    return _load_resource_model(path, os.path.getmtime(path))
+
+
+def predict_resource(model, rule, resource, features, safety_factor=1.0):
+    """
+    Predicted ``resource`` of ``rule`` for the size ``features``, None if no
+    model is available for the rule.
+
+    If a feature used by the model is unknown, the maximum of the history is
+    returned instead.
+    """
+    params = model.get(rule, {}).get(resource)
+    if params is None:
+        return None
+    x = np.array([features[f] for f in params["features"]], dtype=float)
+    if np.isnan(x).any():
+        value = params["maximum"]
+    else:
+        value = np.exp(
+            params["intercept"]
+            + np.dot(params["coefficients"], np.log1p(x))
+            + params["margin"]
+        )
+    value *= safety_factor
+    if resource == "runtime":
+        value /= 60.0  # seconds to minutes
+    return max(1, int(np.ceil(value)))
+
+
+def calibrated_resources(rule, config, mem_mb):
+    """
+    Snakemake resources of ``rule`` from the fitted resource model.
+
+    Parameters
+    ----------
+    rule : str
+        Name of the rule.
+    config : dict
+        Workflow configuration.
+    mem_mb : int or callable
+        Constant memory of the rule, used if no model is available.
+
+    Returns
+    -------
+    dict
+        Callables for ``mem_mb`` and, if a run time model was fitted for the
+        rule, ``runtime`` to be unpacked into the ``resources:`` directive.
+    """
+    model = load_resource_model(config)
+    safety_factor = config.get("resource_calibration", {}).get("safety_factor", 1.0)
+
+    def estimate(resource, default):
+        def resource_of_job(wildcards):
+            value = predict_resource(
+                model,
+                rule,
+                resource,
+                get_scenario_features(config, wildcards),
+                safety_factor,
+            )
+            if value is None:
+                value = default(wildcards) if callable(default) else default
+            return value
+
+        return resource_of_job
+
+    resources = {"mem_mb": estimate("mem_mb", mem_mb) if model else mem_mb}
+    if "runtime" in model.get(rule, {}):
+        resources["runtime"] = estimate("runtime", None)
+    return resources
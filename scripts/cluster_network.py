@@ -133,7 +133,9 @@ from _helpers import (
     REGION_COLS,
     configure_logging,
     create_logger,
+    export_network,
     get_aggregation_strategies,
+    timed,
     update_p_nom_max,
 )
 from add_electricity import load_costs
@@ -406,6 +408,7 @@ def busmap_for_gadm_clusters(inputs, n, gadm_level, geo_crs, country_list):
     return busmap
 
 
+@timed
 def busmap_for_n_clusters(
     inputs,
     build_shape_options,
@@ -771,7 +774,9 @@ if __name__ == "__main__":
     clustering.network.meta = dict(
         snakemake.config, **dict(wildcards=dict(snakemake.wildcards))
     )
-    clustering.network.export_to_netcdf(outputs.network)
+    export_network(
+        clustering.network, outputs.network, **snakemake.config["network_io"]
+    )
     for attr in (
         "busmap",
         "linemap",
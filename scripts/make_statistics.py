@@ -19,36 +19,67 @@ Relevant statistics that are created are:
   length of lines, number of buses and total installed capacity by generation technology
 - Execution time for the rules, when benchmark is available
 
+The statistics are collected concurrently. Vector files are read with pyogrio
+restricted to the needed columns, without geometries when only counts or
+attributes are needed, and networks are read with their static tables only,
+loading time series on access.
+
 Outputs
 -------
 This rule creates a dataframe containing in the columns the relevant statistics for the current run.
 """
+import functools
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-import geopandas as gpd
 import numpy as np
 import pandas as pd
-import pypsa
+import pyogrio
 import xarray as xr
-from _helpers import create_logger, mock_snakemake, to_csv_nafix
+from _helpers import create_logger, load_network_lazy, mock_snakemake, to_csv_nafix
 from build_test_configs import create_test_config
 from shapely.validation import make_valid
 
 logger = create_logger(__name__)
 
+# mock_snakemake parses the whole workflow and may change the working directory
+_mock_snakemake_lock = threading.Lock()
+
 
 def _multi_index_scen(rulename, keys):
     return pd.MultiIndex.from_product([[rulename], keys], names=["rule", "key"])
 
 
-def _mock_snakemake(rule, **kwargs):
+@functools.lru_cache(maxsize=None)
+def _cached_mock_snakemake(rule, **kwargs):
+    return mock_snakemake(rule, **kwargs)
+
 
-    snakemake = mock_snakemake(rule, **kwargs)
+def _mock_snakemake(rule, **kwargs):
+    # the snakemake objects are created one at a time and reused by the
+    # collectors running concurrently
+    with _mock_snakemake_lock:
+        snakemake = _cached_mock_snakemake(rule, **kwargs)
 
     return snakemake
 
 
+def _count_features(path):
+    """
+    Count the features of a vector file without reading them.
+    """
+    n_features = pyogrio.read_info(path)["features"]
+    if n_features < 0:
+        # the driver does not provide a fast feature count
+        df = pyogrio.read_dataframe(
+            path, columns=[], read_geometry=False, fid_as_index=True
+        )
+        n_features = len(df)
+    return int(n_features)
+
+
 def generate_scenario_by_country(
     path_base, country_list, out_dir="configs/scenarios", pre="config."
 ):
@@ -71,13 +102,13 @@ def generate_scenario_by_country(
         out_dir : str (optional)
             Output directory where output configuration files are executed
     """
-    from _helpers import create_country_list, three_2_two_digits_country
+    from _helpers import convert_country_codes, create_country_list
 
     clean_country_list = create_country_list(country_list)
 
     # file available from https://worldpopulationreview.com/country-rankings/landlocked-countries
     df_landlocked = pd.read_csv("landlocked.csv")
-    df_landlocked["countries"] = df_landlocked.cca2.map(three_2_two_digits_country)
+    df_landlocked["countries"] = convert_country_codes(df_landlocked.cca2, to="ISO2")
 
     n_clusters = {
         "MG": 3,  # Africa
@@ -124,8 +155,7 @@ def collect_basic_osm_stats(path, rulename, header):
     Collect basic statistics on OSM data: number of items
     """
     if Path(path).is_file() and Path(path).stat().st_size > 0:
-        df = gpd.read_file(path)
-        n_elem = len(df)
+        n_elem = _count_features(path)
 
         return pd.DataFrame(
             [n_elem], columns=_multi_index_scen(rulename, [header + "-size"])
@@ -143,11 +173,11 @@ def collect_network_osm_stats(path, rulename, header, metric_crs="EPSG:3857"):
     - length of objects with tag_frequency == 0 (DC elements)
     """
     if Path(path).is_file() and Path(path).stat().st_size > 0:
-        df = gpd.read_file(path)
+        fields = pyogrio.read_info(path)["fields"]
+        columns = [col for col in ["circuits", "tag_frequency"] if col in fields]
+        df = pyogrio.read_dataframe(path, columns=columns)
         n_elem = len(df)
-        obj_length = (
-            df["geometry"].apply(make_valid).to_crs(crs=metric_crs).geometry.length
-        )
+        obj_length = df.geometry.apply(make_valid).to_crs(crs=metric_crs).length
         len_obj = np.nansum(obj_length * df.circuits)
 
         len_dc_obj = 0.0
@@ -245,11 +275,8 @@ def collect_bus_regions_stats(bus_region_rule="build_bus_regions"):
     df = pd.DataFrame()
 
     if Path(fp_onshore).is_file() and Path(fp_offshore).is_file():
-        gdf_onshore = gpd.read_file(fp_onshore)
-        gdf_offshore = gpd.read_file(fp_offshore)
-
         df = pd.DataFrame(
-            [[gdf_onshore.shape[0], gdf_offshore.shape[0]]],
+            [[_count_features(fp_onshore), _count_features(fp_offshore)]],
             columns=_multi_index_scen(
                 bus_region_rule,
                 ["n_onshore", "n_offshore"],
@@ -287,7 +314,8 @@ def collect_network_stats(network_rule, scenario_config):
             return df.groupby("carrier").p_nom.sum().astype(float)
 
     if Path(network_path).is_file():
-        n = pypsa.Network(network_path)
+        # only the load time series is read besides the static tables
+        n = load_network_lazy(network_path)
 
         lines_length = float((n.lines.length * n.lines.num_parallel).sum())
 
@@ -344,18 +372,19 @@ def collect_shape_stats(rulename="build_shapes", area_crs="ESRI:54009"):
     if not Path(snakemake.output.africa_shape).is_file():
         return pd.DataFrame()
 
-    df_continent = gpd.read_file(snakemake.output.africa_shape)
+    df_continent = pyogrio.read_dataframe(snakemake.output.africa_shape, columns=[])
     continent_area = (
-        df_continent["geometry"]
-        .apply(make_valid)
-        .to_crs(crs=area_crs)
-        .geometry.area.iloc[0]
+        df_continent.geometry.apply(make_valid).to_crs(crs=area_crs).area.iloc[0]
     )
 
     if not Path(snakemake.output.gadm_shapes).is_file():
         return pd.DataFrame()
 
-    df_gadm = gpd.read_file(snakemake.output.gadm_shapes)
+    df_gadm = pyogrio.read_dataframe(
+        snakemake.output.gadm_shapes,
+        columns=["pop", "gdp", "country"],
+        read_geometry=False,
+    )
     pop_tot = float(df_gadm["pop"].sum())
     gdp_tot = float(df_gadm["gdp"].sum())
     gadm_size = len(df_gadm)
@@ -525,48 +554,58 @@ def calculate_stats(
     renewable_carriers_config,
     metric_crs="EPSG:3857",
     area_crs="ESRI:54009",
+    nprocesses=1,
 ):
     "Function to collect all statistics"
-    df_osm_raw = collect_raw_osm_stats(metric_crs=metric_crs)
-    df_osm_clean = collect_clean_osm_stats(metric_crs=metric_crs)
-    df_shapes = collect_shape_stats(area_crs=area_crs)
-    df_build_bus_regions = collect_bus_regions_stats()
-
-    df_only_computational = {
-        rname: collect_only_computational(rname)
-        for rname in ["build_osm_network", "build_demand_profiles", "build_powerplants"]
-    }
-
-    network_dict = {
-        network_rule: collect_network_stats(network_rule, scenario_config)
-        for network_rule in [
-            "base_network",
-            "add_electricity",
-            "simplify_network",
-            "cluster_network",
-            "solve_network",
-        ]
-    }
-
-    # build_renewable_profiles rule
     ren_rule = "build_renewable_profiles"
-    renewables_dict = {
-        f"{ren_rule}_{tech}": collect_renewable_stats(ren_rule, tech)
-        for tech in renewable_config
-        if tech in renewable_carriers_config
-    }
+    network_rules = [
+        "base_network",
+        "add_electricity",
+        "simplify_network",
+        "cluster_network",
+        "solve_network",
+    ]
 
-    # network-related rules
-    dict_dfs = {
-        "download_osm_data": df_osm_raw,
-        "clean_osm_data": df_osm_clean,
-        "build_shapes": df_shapes,
-        "build_bus_regions": df_build_bus_regions,
-        **df_only_computational,
-        **renewables_dict,
-        **network_dict,
+    # the collectors are independent of each other
+    collectors = {
+        "download_osm_data": (collect_raw_osm_stats, dict(metric_crs=metric_crs)),
+        "clean_osm_data": (collect_clean_osm_stats, dict(metric_crs=metric_crs)),
+        "build_shapes": (collect_shape_stats, dict(area_crs=area_crs)),
+        "build_bus_regions": (collect_bus_regions_stats, {}),
+        **{
+            rname: (collect_only_computational, dict(rulename=rname))
+            for rname in [
+                "build_osm_network",
+                "build_demand_profiles",
+                "build_powerplants",
+            ]
+        },
+        # build_renewable_profiles rule
+        **{
+            f"{ren_rule}_{tech}": (
+                collect_renewable_stats,
+                dict(rulename=ren_rule, technology=tech),
+            )
+            for tech in renewable_config
+            if tech in renewable_carriers_config
+        },
+        # network-related rules
+        **{
+            network_rule: (
+                collect_network_stats,
+                dict(network_rule=network_rule, scenario_config=scenario_config),
+            )
+            for network_rule in network_rules
+        },
     }
 
+    with ThreadPoolExecutor(max_workers=max(1, nprocesses)) as executor:
+        futures = {
+            name: executor.submit(func, **kwargs)
+            for name, (func, kwargs) in collectors.items()
+        }
+        dict_dfs = {name: future.result() for name, future in futures.items()}
+
     dict_dfs["total_comp_stats"] = aggregate_computational_stats(
         "total_comp_stats", dict_dfs
     )
@@ -605,6 +644,7 @@ if __name__ == "__main__":
         renewable_carriers,
         metric_crs=metric_crs,
         area_crs=area_crs,
+        nprocesses=snakemake.threads,
     )
     stats = pd.concat(stats.values(), axis=1).set_index(pd.Index([name_index]))
     to_csv_nafix(stats, fp_stats)
@@ -50,9 +50,18 @@ The line volume/cost cap field can be set to one of the following:
 - ``lcall`` for all line cost caps
 
 Replacing *summaries* with *plots* creates nice colored maps of the results.
+
+The networks are summarized in parallel and the summary of each network is
+cached next to the network file as ``{network}_summary_{country}.pkl``, so that
+only new or changed networks are loaded again.
 """
+import hashlib
+import json
+import multiprocessing as mp
 import os
+from itertools import starmap
 
+import numpy as np
 import pandas as pd
 import pypsa
 from _helpers import configure_logging
@@ -65,6 +74,8 @@ logger = create_logger(__name__)
 
 opt_name = {"Store": "e", "Line": "s", "Transformer": "s"}
 
+SUMMARY_LEVELS = ["simpl", "clusters", "ll", "opts"]
+
 
 def _add_indexed_rows(df, raw_index):
     new_index = df.index.union(pd.MultiIndex.from_product(raw_index))
@@ -159,33 +170,83 @@ def calculate_curtailment(n, label, curtailment):
     return curtailment
 
 
-def calculate_energy(n, label, energy):
+def get_dispatch_table(n):
+    """
+    Build a long-format table of the dispatch of every component at each of
+    its buses with a single pass over the ``p``, ``p0`` and ``p1`` time series.
+
+    The table is built once per network and stored on the network.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per component item and bus end with the columns
+        ``component``, ``end``, ``bus``, ``carrier``, ``sign`` and the
+        ``max``, ``min``, ``sum`` and weighted ``energy`` of the dispatch.
+    """
+    if getattr(n, "dispatch_table", None) is not None:
+        return n.dispatch_table
+
+    tables = []
     for c in n.iterate_components(n.one_port_components | n.branch_components):
-        if c.name in {"Generator", "Load", "ShuntImpedance"}:
-            c_energies = (
-                c.pnl.p.multiply(n.snapshot_weightings.generators, axis=0)
-                .sum()
-                .multiply(c.df.sign)
-                .groupby(c.df.carrier)
-                .sum()
+        if c.name in {"StorageUnit", "Store"}:
+            weightings = n.snapshot_weightings.stores
+        else:
+            weightings = n.snapshot_weightings.generators
+
+        if c.name in n.one_port_components:
+            ends = [("", "p", "bus")]
+        else:
+            ends = [("0", "p0", "bus0"), ("1", "p1", "bus1")]
+
+        for end, attr, bus in ends:
+            p = c.pnl[attr]
+            if p.empty:
+                continue
+
+            values = p.to_numpy(dtype=float)
+            df = c.df.reindex(p.columns)
+            sign = df["sign"].to_numpy() if "sign" in df else 1.0
+            tables.append(
+                pd.DataFrame(
+                    {
+                        "component": c.list_name,
+                        "end": end,
+                        "bus": df[bus].to_numpy(),
+                        "carrier": df["carrier"].to_numpy(),
+                        "sign": sign,
+                        "max": np.nanmax(values, axis=0),
+                        "min": np.nanmin(values, axis=0),
+                        "sum": np.nansum(values, axis=0),
+                        "energy": weightings.reindex(p.index).to_numpy()
+                        @ np.nan_to_num(values),
+                    },
+                    index=p.columns,
+                )
             )
-        elif c.name in {"StorageUnit", "Store"}:
+
+    columns = ["component", "end", "bus", "carrier", "sign"]
+    columns += ["max", "min", "sum", "energy"]
+    n.dispatch_table = pd.concat(tables) if tables else pd.DataFrame(columns=columns)
+    return n.dispatch_table
+
+
+def calculate_energy(n, label, energy):
+    table = get_dispatch_table(n)
+
+    for c in n.iterate_components(n.one_port_components | n.branch_components):
+        df = table[table.component == c.list_name]
+
+        if c.name in n.one_port_components:
+            # components without time series count with zero energy
             c_energies = (
-                c.pnl.p.multiply(n.snapshot_weightings.stores, axis=0)
-                .sum()
-                .multiply(c.df.sign)
-                .groupby(c.df.carrier)
+                (df.energy * df.sign)
+                .groupby(df.carrier)
                 .sum()
+                .reindex(np.unique(c.df.carrier), fill_value=0.0)
             )
         else:
-            c_energies = (
-                (
-                    -c.pnl.p1.multiply(n.snapshot_weightings.generators, axis=0).sum()
-                    - c.pnl.p0.multiply(n.snapshot_weightings.generators, axis=0).sum()
-                )
-                .groupby(c.df.carrier)
-                .sum()
-            )
+            c_energies = (-df.energy).groupby(df.carrier).sum()
 
         # fix to avoid missing data
         if c_energies.empty:
@@ -225,61 +286,57 @@ def calculate_capacity(n, label, capacity):
     return capacity
 
 
-def calculate_supply(n, label, supply):
+def calculate_supply_at_load_buses(n, label, summary, values):
     """
-    Calculate the max dispatch of each component at the buses where the loads
-    are attached.
+    Sum the values of the dispatch table over the components attached to the
+    buses of each load carrier, grouped by load carrier, component and
+    carrier.
     """
+    table = get_dispatch_table(n)
+    load_buses = (
+        n.loads[["bus", "carrier"]]
+        .drop_duplicates()
+        .rename(columns={"carrier": "load_carrier"})
+    )
 
-    load_types = n.loads.carrier.value_counts().index
-
-    for i in load_types:
-        buses = n.loads.bus[n.loads.carrier == i].values
-
-        bus_map = pd.Series(False, index=n.buses.index)
-
-        bus_map.loc[buses] = True
-
-        for c in n.iterate_components(n.one_port_components):
-            items = c.df.index[c.df.bus.map(bus_map)]
-
-            if len(items) == 0 or c.pnl.p.empty:
-                continue
-
-            s = (
-                c.pnl.p[items]
-                .max()
-                .multiply(c.df.loc[items, "sign"])
-                .groupby(c.df.loc[items, "carrier"])
-                .sum()
-            )
-
-            # Index tuple(s) indicating the newly to-be-added row(s)
-            raw_index = tuple([[i], [c.list_name], list(s.index)])
-            supply = _add_indexed_rows(supply, raw_index)
+    s = (
+        table.assign(value=values)
+        .merge(load_buses, on="bus")
+        .groupby(["load_carrier", "component", "carrier", "end"])
+        .value.sum()
+    )
+    # as in the former loop over the branch ends, the value at end 1 replaces
+    # the one at end 0 for carriers of branches connecting buses of a carrier
+    s = s[~s.index.droplevel("end").duplicated(keep="last")].droplevel("end")
+    s = s.rename_axis([None, None, None])
+    if s.empty:
+        return summary
+
+    new_index = summary.index.union(s.index)
+    if not isinstance(new_index, pd.MultiIndex):
+        new_index = pd.MultiIndex.from_tuples(new_index)
+    summary = summary.reindex(new_index)
 
-            supply.loc[idx[raw_index], label] = s.values
+    summary.loc[s.index, label] = s.values
 
-        for c in n.iterate_components(n.branch_components):
-            for end in ["0", "1"]:
-                items = c.df.index[c.df["bus" + end].map(bus_map)]
+    return summary
 
-                if len(items) == 0 or c.pnl["p" + end].empty:
-                    continue
 
-                # lots of sign compensation for direction and to do maximums
-                s = (-1) ** (1 - int(end)) * (
-                    (-1) ** int(end) * c.pnl["p" + end][items]
-                ).max().groupby(c.df.loc[items, "carrier"]).sum()
+def calculate_supply(n, label, supply):
+    """
+    Calculate the max dispatch of each component at the buses where the loads
+    are attached.
+    """
+    table = get_dispatch_table(n)
 
-                supply = supply.reindex(
-                    supply.index.union(
-                        pd.MultiIndex.from_product([[i], [c.list_name], s.index])
-                    )
-                )
-                supply.loc[idx[i, c.list_name, list(s.index)], label] = s.values
+    # lots of sign compensation for direction and to do maximums
+    values = np.select(
+        [table.end == "", table.end == "0"],
+        [table["max"] * table.sign, -table["max"]],
+        -table["min"],
+    )
 
-    return supply
+    return calculate_supply_at_load_buses(n, label, supply, values)
 
 
 def calculate_supply_energy(n, label, supply_energy):
@@ -287,55 +344,11 @@ def calculate_supply_energy(n, label, supply_energy):
     Calculate the total dispatch of each component at the buses where the loads
     are attached.
     """
+    table = get_dispatch_table(n)
 
-    load_types = n.loads.carrier.value_counts().index
-
-    for i in load_types:
-        buses_tot = n.loads.bus[n.loads.carrier == i].values
-
-        bus_map = pd.Series(False, index=n.buses.index)
-
-        bus_map.loc[buses_tot] = True
-
-        for c in n.iterate_components(n.one_port_components):
-            items_c = c.df.index[c.df.bus.map(bus_map)]
-
-            if len(items_c) == 0 or c.pnl.p.empty:
-                continue
-
-            s = (
-                c.pnl.p[items_c]
-                .sum()
-                .multiply(c.df.loc[items_c, "sign"])
-                .groupby(c.df.loc[items_c, "carrier"])
-                .sum()
-            )
-
-            # Index tuple(s) indicating the newly to-be-added row(s)
-            raw_index = tuple([[i], [c.list_name], list(s.index)])
-            supply_energy = _add_indexed_rows(supply_energy, raw_index)
-
-            supply_energy.loc[idx[raw_index], label] = s.values
-
-        for c in n.iterate_components(n.branch_components):
-            for end in ["0", "1"]:
-                items_cend = c.df.index[c.df["bus" + end].map(bus_map)]
+    values = np.where(table.end == "", table["sum"] * table.sign, -table["sum"])
 
-                if len(items_cend) == 0 or c.pnl["p" + end].empty:
-                    continue
-
-                s = (-1) * c.pnl["p" + end][items_cend].sum().groupby(
-                    c.df.loc[items_cend, "carrier"]
-                ).sum()
-
-                supply_energy = supply_energy.reindex(
-                    supply_energy.index.union(
-                        pd.MultiIndex.from_product([[i], [c.list_name], s.index])
-                    )
-                )
-                supply_energy.loc[idx[i, c.list_name, list(s.index)], label] = s.values
-
-    return supply_energy
+    return calculate_supply_at_load_buses(n, label, supply_energy, values)
 
 
 def calculate_metrics(n, label, metrics):
@@ -484,44 +497,157 @@ outputs = [
 ]
 
 
-def make_summaries(networks_dict, inputs, cost_config, elec_config, country="all"):
-    columns = pd.MultiIndex.from_tuples(
-        networks_dict.keys(), names=["simpl", "clusters", "ll", "opts"]
-    )
+def get_file_hash(path, chunk_size=2**20):
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
 
-    dfs = {}
 
+def get_summary_cache_path(filename, country):
+    "Path of the summary fragments cached next to the network file"
+    return os.path.splitext(filename)[0] + f"_summary_{country}.pkl"
+
+
+def calculate_summary_fragments(n, label):
+    """
+    Calculate all summary outputs of a single network as one-column
+    DataFrames.
+    """
+    columns = pd.MultiIndex.from_tuples([label], names=SUMMARY_LEVELS)
+
+    fragments = {}
     for output in outputs:
-        dfs[output] = pd.DataFrame(columns=columns, dtype=float)
+        df = pd.DataFrame(columns=columns, dtype=float)
+        fragments[output] = globals()["calculate_" + output](n, label, df)
 
-    for label, filename in networks_dict.items():
-        print(label, filename)
-        if not os.path.exists(filename):
-            print("does not exist!!")
-            continue
+    return fragments
+
+
+def summarize_network(
+    label, filename, tech_costs, cost_config, elec_config, country, settings_hash
+):
+    """
+    Calculate the summary fragments of one network.
 
+    The fragments are cached next to the network file. They are reused when
+    the settings are unchanged and the network file has the same modification
+    time or, if it was touched, the same content hash.
+    """
+    mtime = os.path.getmtime(filename)
+    cache_path = get_summary_cache_path(filename, country)
+    columns = pd.MultiIndex.from_tuples([label], names=SUMMARY_LEVELS)
+
+    cache = None
+    if os.path.exists(cache_path):
         try:
-            n = pypsa.Network(filename)
-        except OSError:
-            logger.warning("Skipping {filename}".format(filename=filename))
-            continue
+            cache = pd.read_pickle(cache_path)
+        except Exception:
+            logger.warning(f"Ignoring unreadable summary cache {cache_path}")
+
+    file_hash = None
+    if cache is not None and cache["settings"] == settings_hash:
+        if cache["mtime"] != mtime:
+            file_hash = get_file_hash(filename)
+        if cache["mtime"] == mtime or cache["hash"] == file_hash:
+            logger.info(f"Reusing cached summary of {filename}")
+            if cache["mtime"] != mtime:
+                cache["mtime"] = mtime
+                _write_summary_cache(cache, cache_path)
+            return {
+                output: df.set_axis(columns, axis=1)
+                for output, df in cache["fragments"].items()
+            }
+
+    logger.info(f"Summarizing {filename}")
+    try:
+        n = pypsa.Network(filename)
+    except OSError:
+        logger.warning("Skipping {filename}".format(filename=filename))
+        return None
+
+    if country != "all":
+        n = n[n.buses.country == country]
+
+    Nyears = n.snapshot_weightings.objective.sum() / 8760.0
+    costs = load_costs(
+        tech_costs,
+        cost_config,
+        elec_config,
+        Nyears,
+    )
+    update_transmission_costs(n, costs, simple_hvdc_costs=False)
+
+    assign_carriers(n)
+
+    fragments = calculate_summary_fragments(n, label)
+
+    cache = dict(
+        mtime=mtime,
+        hash=file_hash or get_file_hash(filename),
+        settings=settings_hash,
+        fragments=fragments,
+    )
+    _write_summary_cache(cache, cache_path)
+
+    return fragments
 
-        if country != "all":
-            n = n[n.buses.country == country]
 
-        Nyears = n.snapshot_weightings.objective.sum() / 8760.0
-        costs = load_costs(
-            inputs.tech_costs,
-            cost_config,
-            elec_config,
-            Nyears,
+def _write_summary_cache(cache, cache_path):
+    # write to a temporary file first to never leave a truncated cache behind
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    pd.to_pickle(cache, tmp_path)
+    os.replace(tmp_path, cache_path)
+
+
+def make_summaries(
+    networks_dict, inputs, cost_config, elec_config, country="all", nprocesses=1
+):
+    columns = pd.MultiIndex.from_tuples(networks_dict.keys(), names=SUMMARY_LEVELS)
+
+    # the fragments also depend on the cost assumptions
+    settings = json.dumps(
+        [cost_config, elec_config, country, get_file_hash(inputs.tech_costs)],
+        sort_keys=True,
+        default=str,
+    )
+    settings_hash = hashlib.sha256(settings.encode()).hexdigest()
+
+    tasks = []
+    for label, filename in networks_dict.items():
+        if not os.path.exists(filename):
+            logger.warning(f"Skipping {label}, {filename} does not exist")
+            continue
+        tasks.append(
+            (
+                label,
+                filename,
+                inputs.tech_costs,
+                cost_config,
+                elec_config,
+                country,
+                settings_hash,
+            )
         )
-        update_transmission_costs(n, costs, simple_hvdc_costs=False)
 
-        assign_carriers(n)
+    if nprocesses > 1 and len(tasks) > 1:
+        with mp.get_context("spawn").Pool(min(nprocesses, len(tasks))) as pool:
+            results = pool.starmap(summarize_network, tasks)
+    else:
+        results = list(starmap(summarize_network, tasks))
+    results = [fragments for fragments in results if fragments is not None]
 
-        for output in outputs:
-            dfs[output] = globals()["calculate_" + output](n, label, dfs[output])
+    dfs = {}
+    for output in outputs:
+        fragments = [fragments[output] for fragments in results]
+        if not fragments:
+            dfs[output] = pd.DataFrame(columns=columns, dtype=float)
+            continue
+        # the summaries grown row by row have a sorted index
+        aligned = all(df.index.equals(fragments[0].index) for df in fragments)
+        df = pd.concat(fragments, axis=1, sort=not aligned)
+        dfs[output] = df.reindex(columns=columns)
 
     return dfs
 
@@ -583,6 +709,7 @@ if __name__ == "__main__":
         snakemake.params.costs,
         snakemake.params.electricity,
         country=snakemake.wildcards.country,
+        nprocesses=snakemake.threads,
     )
 
     to_csv(dfs, snakemake.output[0])
@@ -38,10 +38,10 @@ Inputs
 
 Outputs
 -------
-- ``networks/elec_s_10_ec_lcopt_Co2L-24H_{unc}.nc``
+- ``networks/elec_s_10_ec_lcopt_Co2L-24H_{unc}.yaml``
 
-e.g.    networks/elec_s_10_ec_lcopt_Co2L-24H_m0.nc
-        networks/elec_s_10_ec_lcopt_Co2L-24H_m1.nc
+e.g.    networks/elec_s_10_ec_lcopt_Co2L-24H_m0.yaml
+        networks/elec_s_10_ec_lcopt_Co2L-24H_m1.yaml
         ...
 
 Description
@@ -63,7 +63,9 @@ be optimized) and *features* (pypsa network object e.g loads_t.p_set or generato
 results in an experimental design of the dimension (samples X features).
 
 The experimental design `lh` (dimension: sample X features) is used to modify the PyPSA
-networks. Thereby, this script creates samples x amount of networks. The iterators comes from the
+networks. Instead of a full copy of the network, this script writes for each sample a small
+delta file with the scaling factor of every feature, from which the sample network is rebuilt
+on demand by ``_helpers.load_monte_carlo_sample``. The iterators comes from the
 wildcard {unc}, which is described in the config.yaml and created in the Snakefile as a range from
 0 to (total number of) SAMPLES.
 """
@@ -71,10 +73,10 @@ import os
 
 import chaospy
 import numpy as np
-import pandas as pd
 import pypsa
 import seaborn as sns
-from _helpers import configure_logging, create_logger
+import yaml
+from _helpers import configure_logging, create_logger, parse_uncertainty_key
 from pyDOE2 import lhs
 from scipy.stats import beta, gamma, lognorm, norm, qmc, triang
 from sklearn.preprocessing import MinMaxScaler
@@ -346,21 +348,17 @@ def validate_parameters(
     return None
 
 
-if __name__ == "__main__":
-    if "snakemake" not in globals():
-        from _helpers import mock_snakemake
-
-        snakemake = mock_snakemake(
-            "monte_carlo",
-            simpl="",
-            clusters="4",
-            ll="copt",
-            opts="Co2L-4H",
-            unc="m0",
-        )
-    configure_logging(snakemake)
-    monte_carlo_config = snakemake.params.monte_carlo
-
+def get_experimental_design(monte_carlo_config):
+    """
+    Build the experimental design of the Monte Carlo sweep.
+
+    Returns
+    -------
+    lh : np.ndarray
+        Scaling factors of dimension (samples X features).
+    features : list
+        PyPSA network objects scaled by the columns of ``lh``.
+    """
     # SCENARIO INPUTS
     ###
     MONTE_CARLO_PYPSA_FEATURES = [
@@ -413,26 +411,47 @@ if __name__ == "__main__":
     #         title=f"{MONTE_CARLO_PYPSA_FEATURES[idx]}"
     #     ).figure.savefig(f"{MONTE_CARLO_PYPSA_FEATURES[idx]}.png", bbox_inches="tight")
 
+    return lh, MONTE_CARLO_PYPSA_FEATURES
+
+
+if __name__ == "__main__":
+    if "snakemake" not in globals():
+        from _helpers import mock_snakemake
+
+        snakemake = mock_snakemake(
+            "monte_carlo",
+            simpl="",
+            clusters="4",
+            ll="copt",
+            opts="Co2L-4H",
+            unc="m0",
+        )
+    configure_logging(snakemake)
+    monte_carlo_config = snakemake.params.monte_carlo
+
+    lh, MONTE_CARLO_PYPSA_FEATURES = get_experimental_design(monte_carlo_config)
+
     # MONTE-CARLO MODIFICATIONS
     ###
+    # only the scaling factors of the sample are stored, the sample network is
+    # rebuilt from the base network by _helpers.load_monte_carlo_sample
     n = pypsa.Network(snakemake.input[0])
     unc_wildcards = snakemake.wildcards[-1]
     i = int(unc_wildcards[1:])
-    j = 0
-    for k in MONTE_CARLO_PYPSA_FEATURES:
-        # this loop sets in one scenario each "i" feature assumption
+    scaling_factors = {}
+    for j, k in enumerate(MONTE_CARLO_PYPSA_FEATURES):
         # k is the config input key "loads_t.p_set"
-        # v is the lower and upper bound [0.8,1.3], that was used for lh_scaled
         # i, j interaction number to pick values of experimental setup
-        # Example: n.loads_t.p_set = network.loads_t.p_set = .loads_t.p_set * lh_scaled[0,0]
-        exec(f"n.{k} = n.{k} * {lh[i,j]}")
-        logger.info(f"Scaled n.{k} by factor {lh[i,j]} in the {i} scenario")
-        j = j + 1
+        # validate that the key resolves to an attribute of the base network
+        parse_uncertainty_key(n, k)
+        scaling_factors[k] = float(lh[i, j])
 
     # EXPORT AND METADATA
     #
-    latin_hypercube_dict = (
-        pd.DataFrame(lh).rename_axis("Nruns").add_suffix("_feature")
-    ).to_dict()
-    n.meta.update(latin_hypercube_dict)
-    n.export_to_netcdf(snakemake.output[0])
+    sample = {
+        "sample": i,
+        "base_network": snakemake.input[0],
+        "scaling_factors": scaling_factors,
+    }
+    with open(snakemake.output[0], "w") as f:
+        yaml.safe_dump(sample, f, sort_keys=False)
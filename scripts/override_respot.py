@@ -12,7 +12,7 @@ import pandas as pd
 import pypsa
 import pytz
 import xarray as xr
-from _helpers import mock_snakemake, override_component_attrs
+from _helpers import export_network, mock_snakemake, override_component_attrs
 
 
 def override_values(tech, year, dr):
@@ -113,4 +113,4 @@ if __name__ == "__main__":
                     * 1e6
                 )
 
-    n.export_to_netcdf(snakemake.output[0])
+    export_network(n, snakemake.output[0], **snakemake.config["network_io"])
@@ -11,7 +11,6 @@ from pathlib import Path
 from urllib.request import urlopen
 from zipfile import ZipFile
 
-import country_converter as coco
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
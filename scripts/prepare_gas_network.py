@@ -14,7 +14,6 @@ import os
 import zipfile
 from pathlib import Path
 
-import fiona
 import geopandas as gpd
 import matplotlib.colors as colors
 import matplotlib.pyplot as plt
@@ -22,9 +21,9 @@ import pandas as pd
 from _helpers import (
     BASE_DIR,
     content_retrieve,
+    convert_country_codes,
+    get_GADM_layer,
     progress_retrieve,
-    three_2_two_digits_country,
-    two_2_three_digits_country,
 )
 from build_shapes import gadm
 from matplotlib.lines import Line2D
@@ -303,181 +302,6 @@ def prepare_IGGIELGN_data(
     return df
 
 
-def get_GADM_filename(country_code):
-    """
-    Function to get the GADM filename given the country code.
-    """
-    special_codes_GADM = {
-        "XK": "XKO",  # kosovo
-        "CP": "XCL",  # clipperton island
-        "SX": "MAF",  # sint maartin
-        "TF": "ATF",  # french southern territories
-        "AX": "ALA",  # aland
-        "IO": "IOT",  # british indian ocean territory
-        "CC": "CCK",  # cocos island
-        "NF": "NFK",  # norfolk
-        "PN": "PCN",  # pitcairn islands
-        "JE": "JEY",  # jersey
-        "XS": "XSP",  # spratly
-        "GG": "GGY",  # guernsey
-        "UM": "UMI",  # united states minor outlying islands
-        "SJ": "SJM",  # svalbard
-        "CX": "CXR",  # Christmas island
-    }
-
-    if country_code in special_codes_GADM:
-        return f"gadm41_{special_codes_GADM[country_code]}"
-    else:
-        return f"gadm41_{two_2_three_digits_country(country_code)}"
-
-
-def download_GADM(country_code, update=False, out_logging=False):
-    """
-    Download gpkg file from GADM for a given country code.
-
-    Parameters
-    ----------
-    country_code : str
-        Two letter country codes of the downloaded files
-    update : bool
-        Update = true, forces re-download of files
-
-    Returns
-    -------
-    gpkg file per country
-    """
-
-    GADM_filename = get_GADM_filename(country_code)
-
-    GADM_inputfile_gpkg = os.path.join(
-        BASE_DIR,
-        "data",
-        "gadm",
-        GADM_filename,
-        GADM_filename + ".gpkg",
-    )  # Input filepath gpkg
-
-    return GADM_inputfile_gpkg, GADM_filename
-
-
-def filter_gadm(
-    geodf,
-    layer,
-    cc,
-    contended_flag,
-    output_nonstd_to_csv=False,
-):
-    # identify non standard geodf rows
-    geodf_non_std = geodf[geodf["GID_0"] != two_2_three_digits_country(cc)].copy()
-
-    if not geodf_non_std.empty:
-        logger.info(
-            f"Contended areas have been found for gadm layer {layer}. They will be treated according to {contended_flag} option"
-        )
-
-        # NOTE: in these options GID_0 is not changed because it is modified below
-        if contended_flag == "drop":
-            geodf.drop(geodf_non_std.index, inplace=True)
-        elif contended_flag != "set_by_country":
-            # "set_by_country" option is the default; if this elif applies, the desired option falls back to the default
-            logger.warning(
-                f"Value '{contended_flag}' for option contented_flag is not recognized.\n"
-                + "Fallback to 'set_by_country'"
-            )
-
-    # force GID_0 to be the country code for the relevant countries
-    geodf["GID_0"] = cc
-
-    # country shape should have a single geometry
-    if (layer == 0) and (geodf.shape[0] > 1):
-        logger.warning(
-            f"Country shape is composed by multiple shapes that are being merged in agreement to contented_flag option '{contended_flag}'"
-        )
-        # take the first row only to re-define geometry keeping other columns
-        geodf = geodf.iloc[[0]].set_geometry([geodf.unary_union])
-
-    # debug output to file
-    if output_nonstd_to_csv and not geodf_non_std.empty:
-        geodf_non_std.to_csv(
-            f"resources/non_standard_gadm{layer}_{cc}_raw.csv", index=False
-        )
-
-    return geodf
-
-
-def get_GADM_layer(
-    country_list,
-    layer_id,
-    geo_crs,
-    contended_flag,
-    update=False,
-    outlogging=False,
-):
-    """
-    Function to retrieve a specific layer id of a geopackage for a selection of
-    countries.
-
-    Parameters
-    ----------
-    country_list : str
-        List of the countries
-    layer_id : int
-        Layer to consider in the format GID_{layer_id}.
-        When the requested layer_id is greater than the last available layer, then the last layer is selected.
-        When a negative value is requested, then, the last layer is requested
-    """
-    # initialization of the geoDataFrame
-    geodf_list = []
-
-    for country_code in country_list:
-        # Set the current layer id (cur_layer_id) to global layer_id
-        cur_layer_id = layer_id
-
-        # download file gpkg
-        file_gpkg, name_file = download_GADM(country_code, update, outlogging)
-
-        # get layers of a geopackage
-        list_layers = fiona.listlayers(file_gpkg)
-
-        # get layer name
-        if (cur_layer_id < 0) or (cur_layer_id >= len(list_layers)):
-            # when layer id is negative or larger than the number of layers, select the last layer
-            cur_layer_id = len(list_layers) - 1
-
-        # read gpkg file
-        geodf_temp = gpd.read_file(
-            file_gpkg, layer="ADM_ADM_" + str(cur_layer_id)
-        ).to_crs(geo_crs)
-
-        geodf_temp = filter_gadm(
-            geodf=geodf_temp,
-            layer=cur_layer_id,
-            cc=country_code,
-            contended_flag=contended_flag,
-            output_nonstd_to_csv=False,
-        )
-
-        if layer_id == 0:
-            geodf_temp["GADM_ID"] = geodf_temp[f"GID_{cur_layer_id}"].apply(
-                lambda x: two_2_three_digits_country(x[:2])
-            ) + pd.Series(range(1, geodf_temp.shape[0] + 1)).astype(str)
-        else:
-            # create a subindex column that is useful
-            # in the GADM processing of sub-national zones
-            # Fix issues with missing "." in selected cases
-            geodf_temp["GADM_ID"] = geodf_temp[f"GID_{cur_layer_id}"].apply(
-                lambda x: x if x[3] == "." else x[:3] + "." + x[3:]
-            )
-
-        # append geodataframes
-        geodf_list.append(geodf_temp)
-
-    geodf_GADM = gpd.GeoDataFrame(pd.concat(geodf_list, ignore_index=True))
-    geodf_GADM.set_crs(geo_crs)
-
-    return geodf_GADM
-
-
 def gadm(
     countries,
     geo_crs,
@@ -492,11 +316,29 @@ def gadm(
         logger.info("Stage 4/4: Creation GADM GeoDataFrame")
 
     # download data if needed and get the desired layer_id
-    df_gadm = get_GADM_layer(countries, layer_id, geo_crs, contended_flag, update)
+    df_gadm = get_GADM_layer(
+        countries,
+        layer_id,
+        geo_crs,
+        contended_flag,
+        update,
+        out_logging,
+        nprocesses=nprocesses,
+    )
 
     # select and rename columns
     df_gadm.rename(columns={"GID_0": "country"}, inplace=True)
 
+    if layer_id == 0:
+        df_gadm["GADM_ID"] = convert_country_codes(df_gadm["country"], to="ISO3") + (
+            df_gadm.groupby("country").cumcount() + 1
+        ).astype(str)
+    else:
+        # Fix issues with missing "." in selected cases
+        df_gadm["GADM_ID"] = df_gadm["GADM_ID"].apply(
+            lambda x: x if x[3] == "." else x[:3] + "." + x[3:]
+        )
+
     # drop useless columns
     df_gadm.drop(
         df_gadm.columns.difference(["country", "GADM_ID", "geometry"]),
@@ -916,13 +758,11 @@ if not snakemake.params.custom_gas_network:
         )
 
         # Conversion of GADM id to from 3 to 2-digit
-        pipelines["bus0"] = pipelines["bus0"].apply(
-            lambda id: three_2_two_digits_country(id[:3]) + id[3:]
-        )
-
-        pipelines["bus1"] = pipelines["bus1"].apply(
-            lambda id: three_2_two_digits_country(id[:3]) + id[3:]
-        )
+        for bus in ["bus0", "bus1"]:
+            pipelines[bus] = (
+                convert_country_codes(pipelines[bus].str[:3], to="ISO2")
+                + pipelines[bus].str[3:]
+            )
 
         pipelines.to_csv(snakemake.output.clustered_gas_network, index=False)
 
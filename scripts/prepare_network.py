@@ -60,13 +60,21 @@ import os
 import re
 from zipfile import ZipFile
 
-import country_converter as cc
 import numpy as np
 import pandas as pd
 import pypsa
 import requests
-from _helpers import BASE_DIR, configure_logging, create_logger
+from _helpers import (
+    BASE_DIR,
+    aggregate_snapshots,
+    configure_logging,
+    create_logger,
+    export_network,
+    get_country_converter,
+    resample_network,
+)
 from add_electricity import load_costs, update_transmission_costs
+from scipy.sparse.linalg import svds
 
 idx = pd.IndexSlice
 
@@ -129,7 +137,7 @@ def emission_extractor(filename, emission_year, country_names):
     ]
     df = df.loc[:, "Y_1970":"Y_2018"].astype(float).ffill(axis=1)
     df = df.loc[:, "Y_1970":"Y_2018"].astype(float).bfill(axis=1)
-    cc_iso3 = cc.convert(names=country_names, to="ISO3")
+    cc_iso3 = get_country_converter().convert(names=country_names, to="ISO3")
     if len(country_names) == 1:
         cc_iso3 = [cc_iso3]
     emission_by_country = df.loc[
@@ -232,22 +240,64 @@ def average_every_nhours(n, offset):
     # For example 24H is deprecated. Instead, 24h is allowed.
 
     logger.info(f"Resampling the network to {offset}")
-    m = n.copy(with_time=False)
+    return resample_network(n, offset.casefold())
 
-    snapshot_weightings = n.snapshot_weightings.resample(offset.casefold()).sum()
-    m.set_snapshots(snapshot_weightings.index)
-    m.snapshot_weightings = snapshot_weightings
 
-    for c in n.iterate_components():
-        pnl = getattr(m, c.list_name + "_t")
-        for k, df in c.pnl.items():
-            if not df.empty:
-                pnl[k] = df.resample(offset.casefold()).mean()
+def get_segmentation_features(n, n_components=0):
+    """
+    Build the reduced feature matrix for the time series segmentation.
+
+    All time-varying attributes of all components are min-max normalised.
+    Constant series and series which are identical after the normalisation are
+    dropped. If ``n_components`` is positive, the remaining series are further
+    reduced to their leading components of a truncated singular value
+    decomposition.
+
+    Returns
+    -------
+    features : pd.DataFrame
+    weights : dict
+        Relative weight of each feature, None if all features are equal.
+    """
+    series = [
+        df.to_numpy(dtype=float)
+        for c in n.iterate_components()
+        for df in c.pnl.values()
+        if not df.empty
+    ]
+    X = np.hstack(series) if series else np.empty((len(n.snapshots), 0))
+    X = X[:, ~np.isnan(X).any(axis=0)]
+
+    span = np.ptp(X, axis=0)
+    X = (X[:, span > 0] - X[:, span > 0].min(axis=0)) / span[span > 0]
+    X = np.unique(X, axis=1)
+    logger.info(
+        f"Segmenting on {X.shape[1]} distinct time series "
+        f"out of {sum(s.shape[1] for s in series)}."
+    )
 
-    return m
+    weights = None
+    if 0 < n_components < min(X.shape):
+        X = X - X.mean(axis=0)
+        U, S, _ = svds(X, k=n_components)
+        # svds returns the singular values in ascending order
+        U, S = U[:, ::-1], S[::-1]
+        logger.info(
+            f"Reduced to {n_components} components explaining "
+            f"{(S**2).sum() / (X**2).sum():.1%} of the variance."
+        )
+        # tsam min-max normalises every feature, so the components are
+        # weighted by their singular values through the weights only
+        X = U
+        weights = S / S[0]
+
+    features = pd.DataFrame(X, index=n.snapshots).add_prefix("feature ")
+    if weights is not None:
+        weights = dict(zip(features.columns, weights))
+    return features, weights
 
 
-def apply_time_segmentation(n, segments, solver_name):
+def apply_time_segmentation(n, segments, solver_name, n_components=0):
     logger.info(f"Aggregating time series to {segments} segments.")
     try:
         import tsam.timeseriesaggregation as tsam
@@ -256,43 +306,33 @@ def apply_time_segmentation(n, segments, solver_name):
             "Optional dependency 'tsam' not found." "Install via 'pip install tsam'"
         )
 
-    p_max_pu_norm = n.generators_t.p_max_pu.max()
-    p_max_pu = n.generators_t.p_max_pu / p_max_pu_norm
-
-    load_norm = n.loads_t.p_set.max()
-    load = n.loads_t.p_set / load_norm
-
-    inflow_norm = n.storage_units_t.inflow.max()
-    inflow = n.storage_units_t.inflow / inflow_norm
-
-    raw = pd.concat([p_max_pu, load, inflow], axis=1, sort=False)
+    raw, weights = get_segmentation_features(n, n_components)
 
     agg = tsam.TimeSeriesAggregation(
         raw,
+        resolution=1,
         hoursPerPeriod=len(raw),
         noTypicalPeriods=1,
         noSegments=int(segments),
         segmentation=True,
         solver=solver_name,
+        **({"weightDict": weights} if weights else {}),
     )
 
     segmented = agg.createTypicalPeriods()
 
-    weightings = segmented.index.get_level_values("Segment Duration")
-    offsets = np.insert(np.cumsum(weightings[:-1]), 0, 0)
-    snapshots = [n.snapshots[0] + pd.Timedelta(f"{offset}h") for offset in offsets]
-
-    n.set_snapshots(pd.DatetimeIndex(snapshots, name="name"))
-    n.snapshot_weightings = pd.Series(
-        weightings, index=snapshots, name="weightings", dtype="float64"
+    # the segments only define the boundaries, all time series of all
+    # components are then averaged over the segments
+    durations = segmented.index.get_level_values("Segment Duration").to_numpy(int)
+    starts = np.insert(np.cumsum(durations[:-1]), 0, 0)
+    snapshots = n.snapshots[starts]
+    snapshot_weightings = pd.DataFrame(
+        np.add.reduceat(n.snapshot_weightings.to_numpy(), starts, axis=0),
+        index=snapshots,
+        columns=n.snapshot_weightings.columns,
     )
 
-    segmented.index = snapshots
-    n.generators_t.p_max_pu = segmented[n.generators_t.p_max_pu.columns] * p_max_pu_norm
-    n.loads_t.p_set = segmented[n.loads_t.p_set.columns] * load_norm
-    n.storage_units_t.inflow = segmented[n.storage_units_t.inflow.columns] * inflow_norm
-
-    return n
+    return aggregate_snapshots(n, snapshots, durations, snapshot_weightings)
 
 
 def enforce_autarky(n, only_crossborder=False):
@@ -354,7 +394,8 @@ if __name__ == "__main__":
         m = re.match(r"^\d+seg$", o, re.IGNORECASE)
         if m is not None:
             solver_name = snakemake.config["solving"]["solver"]["name"]
-            n = apply_time_segmentation(n, m.group(0)[:-3], solver_name)
+            n_components = snakemake.params.time_segmentation["n_components"]
+            n = apply_time_segmentation(n, m.group(0)[:-3], solver_name, n_components)
             break
 
     for o in opts:
@@ -439,4 +480,4 @@ if __name__ == "__main__":
         enforce_autarky(n, only_crossborder=True)
 
     n.meta = dict(snakemake.config, **dict(wildcards=dict(snakemake.wildcards)))
-    n.export_to_netcdf(snakemake.output[0])
+    export_network(n, snakemake.output[0], **snakemake.config["network_io"])
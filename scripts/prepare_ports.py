@@ -7,10 +7,9 @@ import os
 import shutil
 from pathlib import Path
 
-import country_converter as coco
 import numpy as np
 import pandas as pd
-from _helpers import BASE_DIR
+from _helpers import BASE_DIR, convert_country_codes
 
 # from _helpers import configure_logging
 
@@ -95,8 +94,8 @@ if __name__ == "__main__":
                 "Main Port Name": "name",
             }
         )
-        df["country"] = df.country_full_name.apply(
-            lambda x: coco.convert(names=x, to="ISO2", not_found=None)
+        df["country"] = convert_country_codes(
+            df.country_full_name, to="ISO2", not_found=None
         )
 
         # Drop small islands that have no ISO2:
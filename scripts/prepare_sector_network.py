@@ -15,17 +15,20 @@ import pypsa
 import pytz
 import ruamel.yaml
 import xarray as xr
-from tqdm import tqdm
 from typing import Iterable
 from _helpers import (
     BASE_DIR,
+    annuity,
     create_dummy_data,
     create_network_topology,
     cycling_shift,
+    export_network,
+    get_supply_curve_steps,
     locate_bus,
     mock_snakemake,
     override_component_attrs,
     prepare_costs,
+    resample_network,
     safe_divide,
     three_2_two_digits_country,
     two_2_three_digits_country,
@@ -2261,24 +2264,9 @@ def add_heat(n, costs):
 
 def average_every_nhours(n, offset):
     # logger.info(f'Resampling the network to {offset}')
-    m = n.copy(with_time=False)
-
-    snapshot_weightings = n.snapshot_weightings.resample(offset.casefold()).sum()
-    m.set_snapshots(snapshot_weightings.index)
-    m.snapshot_weightings = snapshot_weightings
-
-    for c in n.iterate_components():
-        pnl = getattr(m, c.list_name + "_t")
-        for k, df in c.pnl.items():
-            if not df.empty:
-                if c.list_name == "stores" and k == "e_max_pu":
-                    pnl[k] = df.resample(offset.casefold()).min()
-                elif c.list_name == "stores" and k == "e_min_pu":
-                    pnl[k] = df.resample(offset.casefold()).max()
-                else:
-                    pnl[k] = df.resample(offset.casefold()).mean()
-
-    return m
+    # stores keep the tightest energy limits within each period
+    aggregations = {("stores", "e_max_pu"): "min", ("stores", "e_min_pu"): "max"}
+    return resample_network(n, offset.casefold(), aggregations)
 
 
 def add_dac(n, costs):
@@ -2905,42 +2893,48 @@ def add_egs_industry_supply(n, supply_curve):
     lifetime = snakemake.params.enhanced_geothermal["lifetime"]
 
     # annuitize capex
-    supply_curve['capex[$/MW]'] = (
-        supply_curve['capex[$/MW]'] * dr / (1 - (1 + dr) ** (-lifetime))
-    )
+    supply_curve["capex[$/MW]"] = supply_curve["capex[$/MW]"] * annuity(lifetime, dr)
 
-    for (region, cost_index), row in supply_curve.loc[
-        supply_curve['avail_capacity[MW]'] != 0.
-        ].iterrows():
+    full_name = {
+        "low temperature industry": "low temperature heat 50-80C for industry",
+        "medium temperature industry": "medium temperature heat 80-150C for industry",
+        "high temperature industry": "high temperature heat 150-250C for industry",
+    }
 
-        full_name = {
-            'low temperature industry': 'low temperature heat 50-80C for industry',
-            'medium temperature industry': 'medium temperature heat 80-150C for industry',
-            'high temperature industry': 'high temperature heat 150-250C for industry',
-        }
-
-        for carrier in [
-            'low temperature industry',
-            'medium temperature industry',
-            'high temperature industry',
-        ]:
+    steps = get_supply_curve_steps(
+        supply_curve.loc[supply_curve["avail_capacity[MW]"] != 0.0]
+    )
 
-            bus1 = region + ' ' + full_name[carrier]
-            if bus1 not in n.buses.index:
-                continue
+    # one link per supply-curve step, region and carrier with an existing bus1
+    links = pd.concat(
+        [
+            steps.assign(carrier=carrier, bus1=steps["region"] + " " + name)
+            for carrier, name in full_name.items()
+        ],
+        ignore_index=True,
+    )
+    links = links.loc[links["bus1"].isin(n.buses.index)]
 
-            n.add(
-                "Link",
-                region + ' EGS ' + carrier + ' ' + str(cost_index),
-                bus0=region + ' general industry heat',
-                bus1=bus1,
-                carrier=carrier,
-                capital_cost=row['capex[$/MW]'],
-                marginal_cost=row['opex[$/MWh]'],
-                p_nom_max=row['avail_capacity[MW]'],
-                efficiency=snakemake.params['enhanced_geothermal']['heat_distribution_network_efficiency'],
-                p_nom_extendable=True,
-            )
+    n.madd(
+        "Link",
+        (
+            links["region"]
+            + " EGS "
+            + links["carrier"]
+            + " "
+            + links["cost"].astype(str)
+        ).values,
+        bus0=(links["region"] + " general industry heat").values,
+        bus1=links["bus1"].values,
+        carrier=links["carrier"].values,
+        capital_cost=links["capex[$/MW]"].values,
+        marginal_cost=links["opex[$/MWh]"].values,
+        p_nom_max=links["avail_capacity[MW]"].values,
+        efficiency=snakemake.params["enhanced_geothermal"][
+            "heat_distribution_network_efficiency"
+        ],
+        p_nom_extendable=True,
+    )
 
 
 def add_industry_heating(n, costs):
@@ -3269,8 +3263,6 @@ def attach_enhanced_geothermal(n, potential):
     if not to_be_removed.empty:
         n.remove("Link", to_be_removed)
 
-    idx = pd.IndexSlice
-
     if "EGS" not in n.buses.index:
 
         n.add(
@@ -3288,75 +3280,72 @@ def attach_enhanced_geothermal(n, potential):
             p_nom_extendable=True,
         )
 
-    for bus in tqdm(
-        egs_potential.index.get_level_values(0).unique(),
-        desc="Adding enhanced geothermal",
-        ):
-
-        ss = egs_potential.loc[idx[bus, :]]
+    steps = get_supply_curve_steps(egs_potential)
+    regions = steps["region"].unique()
 
-        # For each region (bus) create a bus for general industry heat if not already present
-        industry_bus = f"{bus} general industry heat"
-        if industry_bus not in n.buses.index:
-            n.add("Bus", industry_bus, carrier="general industry heat")
+    # For each region (bus) create a bus for general industry heat if not already present
+    industry_buses = pd.Index(regions + " general industry heat")
+    missing_buses = industry_buses.difference(n.buses.index)
+    n.madd("Bus", missing_buses, carrier="general industry heat")
 
-        # Loop over each supply‐curve point (i.e. each potential) for this region
-        for i, (capital_cost, row) in enumerate(ss.iterrows()):
-            capacity = row["available_capacity[MW]"]
-            # Convert the cost index from $/kW to $/MW and annuitize the capex
-            capital_cost = float(capital_cost) * 1000 # $/kW -> $/MW
+    # Build an identifier that encodes the region name, heat share, power share, and supply‐curve index
+    identifier = (
+        steps["region"]
+        + f"_H{heat_share:.2f}_P{power_share:.2f}_curve"
+        + steps["step"].astype(str)
+    )
 
-            # Build an identifier that encodes the region name, heat share, power share, and supply‐curve index
-            identifier = f"{bus}_H{heat_share:.2f}_P{power_share:.2f}_curve{i}"
+    # Create the first links: connect the AC bus with the regional bus.
+    # They also use the bus2 keyword to link to the corresponding low-temperature bus.
+    n.madd(
+        "Link",
+        ("EGS ORC " + identifier).values,
+        bus0="EGS",
+        bus1=steps["region"].values,
+        bus2=(steps["region"] + " low temperature heat 50-150C for industry").values,
+        carrier="enhanced geothermal ORC",
+        p_nom_max=steps["available_capacity[MW]"].values,
+        # Convert the cost index from $/kW to $/MW
+        capital_cost=steps["cost"].astype(float).values * 1000,
+        p_nom_extendable=True,
+    )
 
-            # Create the first link: connects the AC bus with the regional bus.
-            # It also uses the bus2 keyword to link to the corresponding low-temperature bus.
-            n.add(
-                "Link",
-                name=f"EGS ORC {identifier}",
-                bus0="EGS",
-                bus1=bus,
-                bus2=f"{bus} low temperature heat 50-150C for industry",
-                carrier="enhanced geothermal ORC",
-                p_nom_max=capacity,
-                capital_cost=capital_cost,
-                p_nom_extendable=True,
-            )
+    # Create the second links: connect the EGS Generator (on bus "EGS") with the general industry heat bus.
+    # Both links share the identifier so that they can be paired.
+    n.madd(
+        "Link",
+        ("EGS industry heat " + identifier).values,
+        bus0="EGS",
+        bus1=(steps["region"] + " general industry heat").values,
+        carrier="enhanced geothermal industry heat",
+        p_nom_max=steps["available_capacity[MW]"].values,
+        p_nom_extendable=True,
+    )
 
-            # Create the second link: connects the EGS Generator (on bus "EGS") with the general industry heat bus.
-            # Both links share the identifier so that they can be paired.
-            n.add(
-                "Link",
-                name=f"EGS industry heat {identifier}",
-                bus0="EGS",
-                bus1=industry_bus,
-                carrier="enhanced geothermal industry heat",
-                p_nom_max=capacity,
-                p_nom_extendable=True,
-            )
+    if len(industry_buses) == 0:
+        return
 
-        # Connect general industry heat to medium temperature industry heat demand ("heat distribution")
-        if industry_bus in n.buses.index and "medium temperature heat 150-250C for industry" in n.buses.index:
-            n.add(
-                "Link",
-                name="EGS industry heat distribution",
-                bus0=industry_bus,
-                bus1="medium temperature heat 150-250C for industry",
-                carrier="heat distribution",
-                p_nom_extendable=True,
-            )
-        
-        # Connect general industry heat to low temperature industry heat demand ("heat exchanger")
-        if industry_bus in n.buses.index and "low temperature heat 50-150C for industry" in n.buses.index:
-            n.add(
-                "Link",
-                name="EGS industry heat exchanger",
-                bus0=industry_bus,
-                bus1="low temperature heat 50-150C for industry",
-                carrier="heat exchanger",
-                p_nom_extendable=True,
-            )
+    # Connect general industry heat to medium temperature industry heat demand ("heat distribution")
+    if "medium temperature heat 150-250C for industry" in n.buses.index:
+        n.add(
+            "Link",
+            name="EGS industry heat distribution",
+            bus0=industry_buses[0],
+            bus1="medium temperature heat 150-250C for industry",
+            carrier="heat distribution",
+            p_nom_extendable=True,
+        )
 
+    # Connect general industry heat to low temperature industry heat demand ("heat exchanger")
+    if "low temperature heat 50-150C for industry" in n.buses.index:
+        n.add(
+            "Link",
+            name="EGS industry heat exchanger",
+            bus0=industry_buses[0],
+            bus1="low temperature heat 50-150C for industry",
+            carrier="heat exchanger",
+            p_nom_extendable=True,
+        )
 
 
 if __name__ == "__main__":
@@ -3629,6 +3618,6 @@ if __name__ == "__main__":
 
     '''
 
-    n.export_to_netcdf(snakemake.output[0])
+    export_network(n, snakemake.output[0], **snakemake.config["network_io"])
 
     # TODO changes in case of myopic oversight
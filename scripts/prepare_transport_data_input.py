@@ -7,10 +7,9 @@ import os
 import shutil
 from pathlib import Path
 
-import country_converter as coco
 import numpy as np
 import pandas as pd
-from _helpers import BASE_DIR
+from _helpers import BASE_DIR, get_country_converter
 
 # logger = logging.getLogger(__name__)
 
@@ -44,7 +43,7 @@ def download_number_of_vehicles():
     )
 
     # Add ISO2 country code for each country
-    cc = coco.CountryConverter()
+    cc = get_country_converter()
     Country = pd.Series(Nbr_vehicles_csv["Country"])
     Nbr_vehicles_csv["country"] = cc.pandas_convert(
         series=Country, to="ISO2", not_found="not found"
@@ -92,7 +91,7 @@ def download_CO2_emissions():
 
     # Add ISO2 country code for each country
     CO2_emissions = CO2_emissions.rename(columns={"Country Name": "Country"})
-    cc = coco.CountryConverter()
+    cc = get_country_converter()
     CO2_emissions.loc[:, "country"] = cc.pandas_convert(
         series=CO2_emissions["Country"], to="ISO2", not_found="not found"
     )
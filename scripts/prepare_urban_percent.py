@@ -4,10 +4,10 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 import os
 
-import country_converter as coco
 import pandas as pd
 import py7zr
 import requests
+from _helpers import get_country_converter
 
 # from _helpers import configure_logging
 
@@ -90,7 +90,7 @@ if __name__ == "__main__":
     df = df.loc[(df["Year"] >= 2020)]
 
     # Add ISO2 country code for each country
-    cc = coco.CountryConverter()
+    cc = get_country_converter()
     Economy_Label = pd.Series(df["Economy Label"])
     df["country"] = cc.pandas_convert(
         series=Economy_Label, to="ISO2", not_found="not found"
@@ -39,6 +39,7 @@ Each data bundle entry has the following structure:
         url: {url}
         [post arguments]
     [unzip: true/false]  # (optional, default false) used in direct download technique to automatically unzip files
+    [checksum: {algorithm}:{hexdigest}]  # (optional) checksum of the downloaded archive, e.g. "md5:..." for zenodo and direct downloads
     output: [...]  # list of outputs of the databundle
     [disable_by_opt:]  # option to disable outputs from the bundle; it contains a dictionary of options, each one with
                        # each one with its output. When "all" is specified, the entire bundle is not executed
@@ -59,6 +60,17 @@ according to the following rules:
   as listed in the ``urls`` option of each bundle configuration; when a source fails,
   the following source is used and so on
 
+The selected bundles are downloaded concurrently by up to ``nprocesses`` threads, as
+specified in the ``retrieve_databundle_options`` configuration. Each bundle is streamed
+in chunks to its own temporary file, so that partial downloads can be resumed by HTTP
+range requests when ``resume`` is enabled, provided that the server reports the same
+ETag or Last-Modified date and size as when the download started. Downloaded files
+failing the checksum or the extraction are removed. After a successful download, a small manifest
+with the size of the bundle outputs is stored in ``data/.bundle_manifests``: bundles whose
+outputs are unchanged with respect to their manifest are not downloaded again.
+When a zip archive is extracted, the files already existing with the same size and CRC
+are not overwritten.
+
 .. image:: https://zenodo.org/badge/DOI/10.5281/zenodo.3517921.svg
     :target: https://doi.org/10.5281/zenodo.3517921
 
@@ -68,6 +80,10 @@ according to the following rules:
 
     tutorial:  # configuration stating whether the tutorial is needed
 
+    retrieve_databundle_options:
+        nprocesses:
+        resume:
+
 
 .. seealso::
     Documentation of the configuration file ``config.yaml`` at
@@ -81,8 +97,12 @@ according to the following rules:
 
 """
 import datetime as dt
+import glob
+import hashlib
 import os
 import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from zipfile import ZipFile
 
 import geopandas as gpd
@@ -115,14 +135,157 @@ def load_databundle_config(config):
         config[bundle_name]["countries"] = create_country_list(
             config[bundle_name]["countries"], iso_coding=False
         )
+        config[bundle_name]["bundle_name"] = bundle_name
 
     return config
 
 
-def download_and_unzip_zenodo(config, rootpath, hot_run=True, disable_progress=False):
+def get_bundle_tempfile(config, rootpath, suffix=".zip"):
+    "Path of the temporary file used to download a bundle, unique by bundle"
+    bundle_name = config.get("bundle_name", config["category"])
+    return os.path.join(rootpath, f"tempfile_{bundle_name}{suffix}")
+
+
+def verify_checksum(file_path, checksum, chunk_size=2**20):
+    """
+    Verify the checksum of a file given as "{algorithm}:{hexdigest}", e.g.
+    "md5:d41d8cd98f00b204e9800998ecf8427e".
+
+    Raises a ValueError when the checksum does not match; nothing is done
+    when checksum is None.
+    """
+    if not checksum:
+        return
+
+    algorithm, expected = checksum.split(":", 1)
+    file_hash = hashlib.new(algorithm)
+    with open(file_path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            file_hash.update(chunk)
+
+    if file_hash.hexdigest() != expected.lower():
+        raise ValueError(
+            f"Checksum mismatch for '{file_path}': {file_hash.hexdigest()} != {expected}"
+        )
+
+
+def _file_crc32(file_path, chunk_size=2**20):
+    crc = 0
+    with open(file_path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+
+def extract_zip(file_path, destination):
+    """
+    Extract a zip archive member by member into destination.
+
+    Every member is streamed from the archive to disk; members already
+    existing in destination with the same size and CRC are skipped, which
+    avoids rewriting the content of bundles that have already been extracted.
+    """
+    with ZipFile(file_path, "r") as zip_obj:
+        for member in zip_obj.infolist():
+            target = os.path.join(destination, member.filename)
+            if (
+                not member.is_dir()
+                and os.path.isfile(target)
+                and os.path.getsize(target) == member.file_size
+                and _file_crc32(target) == member.CRC
+            ):
+                continue
+            zip_obj.extract(member, path=destination)
+
+
+def unpack_download(file_path, destination, checksum=None, unzip=True):
+    """
+    Verify the checksum of a downloaded file and extract it into destination
+    if unzip is true.
+
+    The downloaded zip file is removed after the extraction. If the checksum
+    or the extraction fails, the file is removed as well, such that it is
+    downloaded again from scratch instead of being resumed.
+    """
+    try:
+        verify_checksum(file_path, checksum)
+        if unzip:
+            extract_zip(file_path, destination)
+    except Exception:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    if unzip:
+        os.remove(file_path)
+
+
+def get_manifest_path(config):
+    "Path of the manifest storing the outputs of a downloaded bundle"
+    return os.path.join(
+        BASE_DIR, "data", ".bundle_manifests", f"{config['bundle_name']}.yaml"
+    )
+
+
+def get_bundle_output_sizes(config):
+    """
+    Size of the files of the outputs of a bundle, by path relative to the
+    repository root; wildcards and directories in the outputs are expanded.
+    """
+    sizes = {}
+    for output in config.get("output", []):
+        pattern = os.path.join(BASE_DIR, output)
+        if output.endswith("/"):
+            pattern = os.path.join(pattern, "**")
+        for fl in glob.glob(pattern, recursive=True):
+            if os.path.isfile(fl):
+                sizes[os.path.relpath(fl, BASE_DIR)] = os.path.getsize(fl)
+    return sizes
+
+
+def write_bundle_manifest(config):
+    "Store the size of the outputs of a successfully downloaded bundle"
+    manifest_path = get_manifest_path(config)
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    manifest = {
+        "checksum": config.get("checksum"),
+        "outputs": get_bundle_output_sizes(config),
+    }
+    with open(manifest_path, "w") as f:
+        yaml.safe_dump(manifest, f)
+
+
+def is_bundle_retrieved(config):
+    """
+    Check whether a bundle has already been downloaded and extracted.
+
+    True when the manifest of the bundle exists, its checksum matches the one
+    of the bundle configuration and all outputs listed in the manifest exist
+    with the stored size.
+    """
+    manifest_path = get_manifest_path(config)
+    if not os.path.exists(manifest_path):
+        return False
+
+    with open(manifest_path) as f:
+        manifest = yaml.safe_load(f) or {}
+
+    if manifest.get("checksum") != config.get("checksum"):
+        return False
+
+    outputs = manifest.get("outputs") or {}
+    return bool(outputs) and all(
+        os.path.isfile(os.path.join(BASE_DIR, fl))
+        and os.path.getsize(os.path.join(BASE_DIR, fl)) == size
+        for fl, size in outputs.items()
+    )
+
+
+def download_and_unzip_zenodo(
+    config, rootpath, hot_run=True, disable_progress=False, resume=False
+):
     """
     download_and_unzip_zenodo(config, rootpath, dest_path, hot_run=True,
-    disable_progress=False)
+    disable_progress=False, resume=False)
 
     Function to download and unzip the data from zenodo
 
@@ -137,37 +300,42 @@ def download_and_unzip_zenodo(config, rootpath, hot_run=True, disable_progress=F
         When false, the workflow is run without downloading and unzipping
     disable_progress : Bool (default False)
         When true the progress bar to download data is disabled
+    resume : Bool (default False)
+        When true a partially downloaded file is completed instead of being
+        downloaded again
 
     Outputs
     -------
     True when download is successful, False otherwise
     """
     resource = config["category"]
-    file_path = os.path.join(rootpath, "tempfile.zip")
+    file_path = get_bundle_tempfile(config, rootpath)
     destination = os.path.join(BASE_DIR, config["destination"])
     url = config["urls"]["zenodo"]
 
     if hot_run:
         try:
             logger.info(f"Downloading resource '{resource}' from cloud '{url}'")
-            progress_retrieve(url, file_path, disable_progress=disable_progress)
+            progress_retrieve(
+                url, file_path, disable_progress=disable_progress, resume=resume
+            )
             logger.info(f"Extracting resources")
-            with ZipFile(file_path, "r") as zipObj:
-                # Extract all the contents of zip file in current directory
-                zipObj.extractall(path=destination)
-            os.remove(file_path)
+            # Extract all the contents of zip file in current directory
+            unpack_download(file_path, destination, config.get("checksum"))
             logger.info(f"Downloaded resource '{resource}' from cloud '{url}'.")
-        except:
+        except Exception:
             logger.warning(f"Failed download resource '{resource}' from cloud '{url}'.")
             return False
 
     return True
 
 
-def download_and_unzip_gdrive(config, rootpath, hot_run=True, disable_progress=False):
+def download_and_unzip_gdrive(
+    config, rootpath, hot_run=True, disable_progress=False, resume=False
+):
     """
     download_and_unzip_gdrive(config, rootpath, dest_path, hot_run=True,
-    disable_progress=False)
+    disable_progress=False, resume=False)
 
     Function to download and unzip the data from google drive
 
@@ -182,13 +350,15 @@ def download_and_unzip_gdrive(config, rootpath, hot_run=True, disable_progress=F
         When false, the workflow is run without downloading and unzipping
     disable_progress : Bool (default False)
         When true the progress bar to download data is disabled
+    resume : Bool (default False)
+        Not supported by google drive: the file is always downloaded again
 
     Outputs
     -------
     True when download is successful, False otherwise
     """
     resource = config["category"]
-    file_path = os.path.join(rootpath, "tempfile.zip")
+    file_path = get_bundle_tempfile(config, rootpath)
     destination = os.path.join(BASE_DIR, config["destination"])
     url = config["urls"]["gdrive"]
 
@@ -225,24 +395,27 @@ def download_and_unzip_gdrive(config, rootpath, hot_run=True, disable_progress=F
             showsize=not disable_progress,
             unzip=False,
         )
-        with ZipFile(file_path, "r") as zipObj:
-            # Extract all the contents of zip file in current directory
-            zipObj.extractall(path=destination)
+        # Extract all the contents of zip file in current directory
+        try:
+            unpack_download(file_path, destination, config.get("checksum"))
+        except Exception:
+            logger.warning(f"Failed download resource '{resource}' from cloud '{url}'.")
+            return False
 
         logger.info(f"Download resource '{resource}' from cloud '{url}'.")
 
         return True
     else:
-        logger.error(f"Host {host} not implemented")
+        logger.error(f"Host of {url} not implemented")
         return False
 
 
 def download_and_unzip_protectedplanet(
-    config, rootpath, attempts=3, hot_run=True, disable_progress=False
+    config, rootpath, attempts=3, hot_run=True, disable_progress=False, resume=False
 ):
     """
     download_and_unzip_protectedplanet(config, rootpath, dest_path,
-    hot_run=True, disable_progress=False)
+    hot_run=True, disable_progress=False, resume=False)
 
     Function to download and unzip the data by category from protectedplanet
 
@@ -260,13 +433,16 @@ def download_and_unzip_protectedplanet(
         When false, the workflow is run without downloading and unzipping
     disable_progress : Bool (default False)
         When true the progress bar to download data is disabled
+    resume : Bool (default False)
+        Not supported, as the url changes by month: the file is always
+        downloaded again
 
     Outputs
     -------
     True when download is successful, False otherwise
     """
     resource = config["category"]
-    file_path = os.path.join(rootpath, "tempfile_wpda.zip")
+    file_path = get_bundle_tempfile(config, rootpath, suffix="_wpda.zip")
     destination = os.path.join(BASE_DIR, config["destination"])
     url = config["urls"]["protectedplanet"]
 
@@ -303,43 +479,43 @@ def download_and_unzip_protectedplanet(
                     url_iter, file_path, disable_progress=disable_progress
                 )
 
-                zip_obj = ZipFile(file_path, "r")
-
-                # list of zip files, which contains the shape files
-                zip_files = [
-                    fname for fname in zip_obj.namelist() if fname.endswith(".zip")
-                ]
+                with ZipFile(file_path, "r") as zip_obj:
+                    # list of zip files, which contains the shape files
+                    zip_files = [
+                        fname for fname in zip_obj.namelist() if fname.endswith(".zip")
+                    ]
 
-                # if empty, the download failed
-                if not zip_files:
-                    raise Exception(
-                        "Corrupted zip file downloaded from protectedplanet"
-                    )
+                    # if empty, the download failed
+                    if not zip_files:
+                        raise Exception(
+                            "Corrupted zip file downloaded from protectedplanet"
+                        )
 
-                # extract the nested zip files
-                for fzip in zip_files:
-                    # final path of the file
-                    try:
-                        inner_zipname = os.path.join(destination, fzip)
+                    # extract the nested zip files
+                    for fzip in zip_files:
+                        # final path of the file
+                        try:
+                            inner_zipname = os.path.join(destination, fzip)
 
-                        zip_obj.extract(fzip, path=destination)
+                            zip_obj.extract(fzip, path=destination)
 
-                        dest_nested = os.path.join(destination, fzip.split(".")[0])
+                            dest_nested = os.path.join(destination, fzip.split(".")[0])
 
-                        with ZipFile(inner_zipname, "r") as nested_zip:
-                            nested_zip.extractall(path=dest_nested)
+                            with ZipFile(inner_zipname, "r") as nested_zip:
+                                nested_zip.extractall(path=dest_nested)
 
-                        # remove inner zip file
-                        os.remove(inner_zipname)
+                            # remove inner zip file
+                            os.remove(inner_zipname)
 
-                        logger.info(f"{resource} - Successfully unzipped file '{fzip}'")
-                    except:
-                        logger.warning(
-                            f"Exception while unzipping file '{fzip}' for {resource_iter}: skipped file"
-                        )
+                            logger.info(
+                                f"{resource} - Successfully unzipped file '{fzip}'"
+                            )
+                        except Exception:
+                            logger.warning(
+                                f"Exception while unzipping file '{fzip}' for {resource_iter}: skipped file"
+                            )
 
-                # close and remove outer zip file
-                zip_obj.close()
+                # remove outer zip file
                 os.remove(file_path)
 
                 logger.info(
@@ -348,10 +524,12 @@ def download_and_unzip_protectedplanet(
 
                 downloaded = True
                 break
-            except:
+            except Exception:
                 logger.warning(
                     f"Failed download resource '{resource_iter}' from cloud '{url_iter}'."
                 )
+                if os.path.exists(file_path):
+                    os.remove(file_path)
                 current_first_day = get_first_day_of_previous_month(current_first_day)
 
     if not downloaded:
@@ -371,10 +549,13 @@ def download_and_unpack(
     hot_run=True,
     unzip=True,
     disable_progress=False,
+    resume=False,
+    checksum=None,
 ):
     """
     download_and_unpack( url, file_path, resource, destination, headers=None,
-    hot_run=True, unzip=True, disable_progress=False)
+    hot_run=True, unzip=True, disable_progress=False, resume=False,
+    checksum=None)
 
     A helper function to encapsulate retrieval and unzip
 
@@ -385,39 +566,45 @@ def download_and_unpack(
         When false, the workflow is run without downloading and unzipping
     disable_progress : Bool (default False)
         When true the progress bar to download data is disabled
+    resume : Bool (default False)
+        When true a partially downloaded file is completed instead of being
+        downloaded again
+    checksum : str (default None)
+        Checksum of the downloaded file as "{algorithm}:{hexdigest}"
 
     Outputs
     -------
     True when download is successful, False otherwise
     """
     if hot_run:
-        if os.path.exists(file_path):
+        if os.path.exists(file_path) and not resume:
             os.remove(file_path)
 
         try:
             logger.info(f"Downloading resource '{resource}' from cloud '{url}'.")
             progress_retrieve(
-                url, file_path, headers=headers, disable_progress=disable_progress
+                url,
+                file_path,
+                headers=headers,
+                disable_progress=disable_progress,
+                resume=resume,
             )
-
             # if the file is a zipfile and unzip is enabled
             # then unzip it and remove the original file
-            if unzip:
-                with ZipFile(file_path, "r") as zipfile:
-                    zipfile.extractall(destination)
-
-                os.remove(file_path)
+            unpack_download(file_path, destination, checksum, unzip)
             logger.info(f"Downloaded resource '{resource}' from cloud '{url}'.")
             return True
-        except:
+        except Exception:
             logger.warning(f"Failed download resource '{resource}' from cloud '{url}'.")
             return False
 
 
-def download_and_unzip_direct(config, rootpath, hot_run=True, disable_progress=False):
+def download_and_unzip_direct(
+    config, rootpath, hot_run=True, disable_progress=False, resume=False
+):
     """
     download_and_unzip_direct(config, rootpath, dest_path, hot_run=True,
-    disable_progress=False)
+    disable_progress=False, resume=False)
 
     Function to download the data by category from a direct url with no processing.
     If in the configuration file the unzip is specified True, then the downloaded data is unzipped.
@@ -433,6 +620,9 @@ def download_and_unzip_direct(config, rootpath, hot_run=True, disable_progress=F
         When false, the workflow is run without downloading and unzipping
     disable_progress : Bool (default False)
         When true the progress bar to download data is disabled
+    resume : Bool (default False)
+        When true a partially downloaded file is completed instead of being
+        downloaded again
 
     Outputs
     -------
@@ -446,22 +636,25 @@ def download_and_unzip_direct(config, rootpath, hot_run=True, disable_progress=F
 
     unzip = config.get("unzip", False)
 
-    download_and_unpack(
+    return download_and_unpack(
         url=url,
         file_path=file_path,
         resource=resource,
+        destination=destination,
         hot_run=hot_run,
         unzip=unzip,
         disable_progress=disable_progress,
+        resume=resume,
+        checksum=config.get("checksum"),
     )
 
 
 def download_and_unzip_hydrobasins(
-    config, rootpath, hot_run=True, disable_progress=False
+    config, rootpath, hot_run=True, disable_progress=False, resume=False
 ):
     """
     download_and_unzip_basins(config, rootpath, dest_path, hot_run=True,
-    disable_progress=False)
+    disable_progress=False, resume=False)
 
     Function to download and unzip the data for hydrobasins from HydroBASINS database
     available via https://www.hydrosheds.org/products/hydrobasins
@@ -487,6 +680,9 @@ def download_and_unzip_hydrobasins(
         When false, the workflow is run without downloading and unzipping
     disable_progress : Bool (default False)
         When true the progress bar to download data is disabled
+    resume : Bool (default False)
+        When true partially downloaded files are completed instead of being
+        downloaded again
 
     Outputs
     -------
@@ -515,15 +711,18 @@ def download_and_unzip_hydrobasins(
             hot_run=hot_run,
             unzip=True,
             disable_progress=disable_progress,
+            resume=resume,
         )
 
     return all_downloaded
 
 
-def download_and_unzip_post(config, rootpath, hot_run=True, disable_progress=False):
+def download_and_unzip_post(
+    config, rootpath, hot_run=True, disable_progress=False, resume=False
+):
     """
     download_and_unzip_post(config, rootpath, dest_path, hot_run=True,
-    disable_progress=False)
+    disable_progress=False, resume=False)
 
     Function to download the data by category from a post request.
 
@@ -538,6 +737,8 @@ def download_and_unzip_post(config, rootpath, hot_run=True, disable_progress=Fal
         When false, the workflow is run without downloading and unzipping
     disable_progress : Bool (default False)
         When true the progress bar to download data is disabled
+    resume : Bool (default False)
+        Not supported by post requests: the file is always downloaded again
 
     Outputs
     -------
@@ -547,7 +748,7 @@ def download_and_unzip_post(config, rootpath, hot_run=True, disable_progress=Fal
     destination = os.path.join(BASE_DIR, config["destination"])
 
     # load data for post method
-    postdata = config["urls"]["post"]
+    postdata = dict(config["urls"]["post"])
     # remove url feature
     url = postdata.pop("url")
 
@@ -570,8 +771,7 @@ def download_and_unzip_post(config, rootpath, hot_run=True, disable_progress=Fal
         # if the file is a zipfile and unzip is enabled
         # then unzip it and remove the original file
         if config.get("unzip", False):
-            with ZipFile(file_path, "r") as zipfile:
-                zipfile.extractall(destination)
+            extract_zip(file_path, destination)
 
             os.remove(file_path)
         logger.info(f"Downloaded resource '{resource}' from cloud '{url}'.")
@@ -792,6 +992,100 @@ def datafiles_retrivedatabundle(config):
     return listoutputs
 
 
+def download_bundle(
+    config_bundle, rootpath, disable_progress=False, resume=False, skip_existing=False
+):
+    """
+    Download a bundle looping over its hosts until the data are successfully
+    downloaded.
+
+    Inputs
+    ------
+    config_bundle : Dict
+        Configuration of the bundle to download
+    rootpath : str
+        Absolute path of the repository
+    disable_progress : Bool (default False)
+        When true the progress bar to download data is disabled
+    resume : Bool (default False)
+        When true partially downloaded files are completed instead of being
+        downloaded again
+    skip_existing : Bool (default False)
+        When true, the bundle is not downloaded if its outputs match the
+        manifest written by a previous download
+
+    Outputs
+    -------
+    True when download is successful, False otherwise
+    """
+    b_name = config_bundle["bundle_name"]
+
+    if skip_existing and is_bundle_retrieved(config_bundle):
+        logger.info(f"Bundle {b_name} already retrieved: download skipped")
+        return True
+
+    # loop all hosts until data is successfully downloaded
+    for host in config_bundle["urls"]:
+        logger.info(f"Downloading bundle {b_name} - Host {host}")
+
+        try:
+            download_and_unzip = globals()[f"download_and_unzip_{host}"]
+            if download_and_unzip(
+                config_bundle,
+                rootpath,
+                disable_progress=disable_progress,
+                resume=resume,
+            ):
+                write_bundle_manifest(config_bundle)
+                return True
+        except Exception:
+            logger.warning(f"Error in downloading bundle {b_name} - host {host}")
+
+    return False
+
+
+def download_bundles(
+    bundles_to_download,
+    config_bundles,
+    rootpath,
+    nprocesses=1,
+    disable_progress=False,
+    resume=False,
+):
+    """
+    Download the selected bundles concurrently using a pool of nprocesses
+    threads; every bundle is downloaded into its own temporary file.
+
+    Outputs
+    -------
+    downloaded_bundles : list
+        List of the bundles successfully downloaded
+    """
+    downloaded_bundles = []
+
+    with ThreadPoolExecutor(max_workers=max(1, nprocesses)) as executor:
+        futures = {
+            executor.submit(
+                download_bundle,
+                config_bundles[b_name],
+                rootpath,
+                disable_progress=disable_progress,
+                resume=resume,
+                skip_existing=resume,
+            ): b_name
+            for b_name in bundles_to_download
+        }
+        for future in as_completed(futures):
+            b_name = futures[future]
+            if future.result():
+                downloaded_bundles.append(b_name)
+            else:
+                logger.error(f"Bundle {b_name} cannot be downloaded")
+
+    # keep the order of the selected bundles
+    return [b_name for b_name in bundles_to_download if b_name in downloaded_bundles]
+
+
 def merge_hydrobasins_shape(config_hydrobasin, hydrobasins_level):
     basins_path = os.path.join(BASE_DIR, config_hydrobasin["destination"])
     output_fl = os.path.join(BASE_DIR, config_hydrobasin["output"][0])
@@ -845,34 +1139,16 @@ if __name__ == "__main__":
 
     logger.info("Bundles to be downloaded:\n\t" + "\n\t".join(bundles_to_download))
 
-    # initialize downloaded and missing bundles
-    downloaded_bundles = []
-
     # download the selected bundles
-    for b_name in bundles_to_download:
-        host_list = config_bundles[b_name]["urls"]
-
-        downloaded_bundle = False
-
-        # loop all hosts until data is successfully downloaded
-        for host in host_list:
-            logger.info(f"Downloading bundle {b_name} - Host {host}")
-
-            try:
-                download_and_unzip = globals()[f"download_and_unzip_{host}"]
-                if download_and_unzip(
-                    config_bundles[b_name], rootpath, disable_progress=disable_progress
-                ):
-                    downloaded_bundle = True
-            except Exception:
-                logger.warning(f"Error in downloading bundle {b_name} - host {host}")
-
-            if downloaded_bundle:
-                downloaded_bundles.append(b_name)
-                break
-
-        if not downloaded_bundle:
-            logger.error(f"Bundle {b_name} cannot be downloaded")
+    options = snakemake.params.options
+    downloaded_bundles = download_bundles(
+        bundles_to_download,
+        config_bundles,
+        rootpath,
+        nprocesses=options.get("nprocesses", 1),
+        disable_progress=disable_progress,
+        resume=options.get("resume", False),
+    )
 
     hydrobasin_bundles = [
         b_name for b_name in bundles_to_download if "hydrobasins" in b_name
@@ -96,6 +96,7 @@ import scipy as sp
 from _helpers import (
     configure_logging,
     create_logger,
+    export_network,
     get_aggregation_strategies,
     update_p_nom_max,
 )
@@ -1131,7 +1132,7 @@ if __name__ == "__main__":
         busmaps.append(fetched_nodes_map)
 
     n.meta = dict(snakemake.config, **dict(wildcards=dict(snakemake.wildcards)))
-    n.export_to_netcdf(snakemake.output.network)
+    export_network(n, snakemake.output.network, **snakemake.config["network_io"])
 
     busmap_s = reduce(lambda x, y: x.map(y), busmaps[1:], busmaps[0])
     busmap_s.to_csv(snakemake.output.busmap)
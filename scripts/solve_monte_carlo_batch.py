@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+# SPDX-FileCopyrightText:  PyPSA-Earth and PyPSA-Eur Authors
+#
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+# -*- coding: utf-8 -*-
+"""
+Solves all Monte Carlo samples of a network on a persistent optimisation model.
+
+Relevant Settings
+-----------------
+
+.. code:: yaml
+
+    monte_carlo:
+        options:
+            samples:
+            sampling_strategy:
+            seed:
+            nprocesses:
+        uncertainties:
+
+    solving:
+        tmpdir:
+        options:
+        solver:
+            name:
+            options:
+
+.. seealso::
+    Documentation of the configuration file ``config.yaml`` at
+    :ref:`monte_cf`, :ref:`solving_cf`
+
+Inputs
+------
+- ``networks/elec_s{simpl}_{clusters}_ec_l{ll}_{opts}.nc``: confer :ref:`prepare`
+
+Outputs
+-------
+- ``results/monte_carlo/elec_s{simpl}_{clusters}_ec_l{ll}_{opts}.csv``: one row per sample with the solving status, the scaling factor of every uncertainty and the result metrics of the sample
+
+Description
+-----------
+The rules ``monte_carlo`` and ``solve_network`` write, read and build the
+optimisation problem of one network per sample, although the samples only
+differ in a few scaled parameters. Here, every worker process builds the linopy
+model of the base network once. For each sample only the model arrays that
+depend on the uncertain parameters are rescaled from their base values before
+the model is re-solved:
+
+- ``marginal_cost`` and ``capital_cost``: the objective coefficients of the dispatch and capacity variables,
+- ``p_max_pu``, ``p_min_pu``, ``s_max_pu``, ``e_max_pu`` and ``e_min_pu``: the right-hand sides of the operational limits of non-extendable components and the coefficients of the capacity variables of extendable components,
+- ``loads_t.p_set`` and ``loads.p_set``: the right-hand side of the nodal balance constraints.
+
+The samples are spread across ``nprocesses`` local worker processes and the
+selected result metrics of all samples are collected into a single table.
+
+.. note::
+    Transmission expansion is solved without the iterative update of the line
+    impedances and the constraints added by ``extra_functionality`` keep the
+    values of the base network.
+"""
+
+import multiprocessing as mp
+import os
+
+import numpy as np
+import pandas as pd
+import pypsa
+import solve_network
+import xarray as xr
+from _helpers import (
+    configure_logging,
+    create_logger,
+    parse_uncertainty_key,
+    scale_network_attribute,
+)
+from monte_carlo import get_experimental_design
+from pypsa.descriptors import get_switchable_as_dense as get_as_dense
+from tqdm import tqdm
+
+logger = create_logger(__name__)
+
+NOMINAL_ATTRS = {
+    "Generator": "p_nom",
+    "Link": "p_nom",
+    "Line": "s_nom",
+    "Transformer": "s_nom",
+    "StorageUnit": "p_nom",
+    "Store": "e_nom",
+}
+
+DISPATCH_ATTRS = {
+    "Generator": "p",
+    "Link": "p",
+    "StorageUnit": "p_dispatch",
+    "Store": "p",
+}
+
+# operational variable and bounds limited by the per unit attributes
+OPERATIONAL_LIMITS = {
+    ("Generator", "p_max_pu"): ("p", ["upper"]),
+    ("Generator", "p_min_pu"): ("p", ["lower"]),
+    ("Link", "p_max_pu"): ("p", ["upper"]),
+    ("Link", "p_min_pu"): ("p", ["lower"]),
+    ("Line", "s_max_pu"): ("s", ["upper", "lower"]),
+    ("Transformer", "s_max_pu"): ("s", ["upper", "lower"]),
+    ("StorageUnit", "p_max_pu"): ("p_dispatch", ["upper"]),
+    ("StorageUnit", "p_min_pu"): ("p_store", ["upper"]),
+    ("Store", "e_max_pu"): ("e", ["upper"]),
+    ("Store", "e_min_pu"): ("e", ["lower"]),
+}
+
+
+def get_variable_labels(m, name, index):
+    """
+    Return the labels of the variable ``name`` for the components in
+    ``index``.
+    """
+    if name not in m.variables:
+        return np.array([], dtype=int)
+    labels = m.variables[name].labels
+    dim = next(dim for dim in labels.dims if dim != "snapshot")
+    return labels.sel({dim: labels.indexes[dim].intersection(index)}).values.ravel()
+
+
+def get_model_data(m, name=None):
+    """
+    Return the dataset of the constraint ``name`` or of the objective if
+    ``name`` is None.
+
+    The datasets have to be looked up before every use, since solving the
+    model replaces the datasets of the constraints.
+    """
+    if name is None:
+        return getattr(m.objective, "expression", m.objective).data
+    return m.constraints[name].data
+
+
+def get_scaled_arrays(n, key):
+    """
+    Determine the model arrays which scale with the uncertain network attribute
+    ``key``.
+
+    Returns
+    -------
+    list
+        Tuples of the constraint name (None for the objective), the array name
+        and a boolean mask of the array entries proportional to the attribute.
+    """
+    c, attr, varying, index = parse_uncertainty_key(n, key)
+    m = n.model
+    arrays = []
+
+    if attr in ["marginal_cost", "capital_cost"] and c in DISPATCH_ATTRS:
+        var = DISPATCH_ATTRS[c] if attr == "marginal_cost" else NOMINAL_ATTRS[c]
+        labels = get_variable_labels(m, f"{c}-{var}", index)
+        data = get_model_data(m)
+        arrays.append((None, "coeffs", data.vars.isin(labels)))
+
+    elif (c, attr) in OPERATIONAL_LIMITS:
+        var, bounds = OPERATIONAL_LIMITS[c, attr]
+        labels = get_variable_labels(m, f"{c}-{NOMINAL_ATTRS[c]}", index)
+        for bound in bounds:
+            name = f"{c}-fix-{var}-{bound}"
+            if name in m.constraints:
+                data = get_model_data(m, name)
+                arrays.append((name, "rhs", data[f"{c}-fix"].isin(index)))
+            name = f"{c}-ext-{var}-{bound}"
+            if name in m.constraints:
+                data = get_model_data(m, name)
+                arrays.append((name, "coeffs", data.vars.isin(labels)))
+
+    elif not (c == "Load" and attr == "p_set"):
+        raise ValueError(
+            f"Unsupported Monte Carlo uncertainty '{key}' for the batch solver."
+        )
+
+    return arrays
+
+
+def get_nodal_balance_rhs(n, sns):
+    """
+    Right-hand side of the nodal balance constraints given by the loads.
+    """
+    loads = get_as_dense(n, "Load", "p_set", sns) * -n.loads.sign
+    rhs = (
+        loads.T.groupby(n.loads.bus)
+        .sum()
+        .T.reindex(columns=n.buses.index, fill_value=0)
+        .rename_axis(index="snapshot", columns="Bus")
+    )
+    return xr.DataArray(rhs)
+
+
+def get_sample_metrics(n):
+    """
+    Collect the result metrics recorded for each sample.
+    """
+    metrics = {"objective": n.objective}
+    for c, attr in [
+        ("Generator", "p_nom_opt"),
+        ("StorageUnit", "p_nom_opt"),
+        ("Store", "e_nom_opt"),
+    ]:
+        df = n.df(c)
+        capacities = df[attr].groupby(df.carrier).sum()
+        metrics.update(capacities.add_prefix(f"{attr} ").to_dict())
+    metrics["line_volume"] = (n.lines.s_nom_opt * n.lines.length).sum()
+    return metrics
+
+
+def prepare_model(network_path, config, solving, opts, tmpdir=None):
+    """
+    Load the base network and build its optimisation model once.
+    """
+    n = pypsa.Network(network_path)
+    n = solve_network.prepare_network(n, solving["options"])
+
+    # add to network for extra_functionality
+    n.config = config
+    n.opts = opts
+
+    n.optimize.create_model(solver_dir=tmpdir)
+    solve_network.extra_functionality_linopy(n, n.snapshots)
+    return n
+
+
+def _init_process_monte(snakemake_, lh_, features_):
+    global n, lh, features, scaled_arrays, base_arrays, base_data, solver_kwargs
+
+    # custom constraints read the configuration from the solve_network module
+    solve_network.snakemake = snakemake_
+    solve_network.n_ref = None
+
+    lh, features = lh_, features_
+    solving = snakemake_.params.solving
+    n = prepare_model(
+        snakemake_.input[0],
+        snakemake_.config,
+        solving,
+        snakemake_.wildcards.opts.split("-"),
+        tmpdir=solving.get("tmpdir"),
+    )
+
+    scaled_arrays = [get_scaled_arrays(n, key) for key in features]
+
+    base_arrays = {}
+    for con, name, mask in sum(scaled_arrays, []):
+        base_arrays.setdefault((con, name), get_model_data(n.model, con)[name].copy())
+
+    base_data = {}
+    for key in features:
+        c, attr, varying, index = parse_uncertainty_key(n, key)
+        df = n.pnl(c)[attr] if varying else n.df(c)[attr]
+        base_data.setdefault((c, attr, varying), df.copy())
+
+    set_of_options = solving["solver"]["options"]
+    solver_kwargs = dict(
+        solver_name=solving["solver"]["name"],
+        solver_options=(
+            solving["solver_options"][set_of_options] if set_of_options else {}
+        ),
+    )
+
+
+def solve_sample(i):
+    """
+    Rescale the model of the base network to the i-th sample and solve it.
+    """
+    # reset the network data and the model arrays to the base network
+    for (c, attr, varying), df in base_data.items():
+        if varying:
+            n.pnl(c)[attr] = df.copy()
+        else:
+            n.df(c)[attr] = df.copy()
+    for (con, name), base in base_arrays.items():
+        get_model_data(n.model, con)[name] = base
+
+    scale_loads = False
+    for key, factor, arrays in zip(features, lh[i], scaled_arrays):
+        c, attr, varying, index = scale_network_attribute(n, key, factor)
+        scale_loads |= c == "Load" and attr == "p_set"
+        for con, name, mask in arrays:
+            data = get_model_data(n.model, con)
+            data[name] = data[name].where(~mask, data[name] * factor)
+
+    if scale_loads:
+        data = n.model.constraints["Bus-nodal_balance"].data
+        rhs = get_nodal_balance_rhs(n, n.snapshots)
+        data["rhs"] = rhs.reindex_like(data.rhs).transpose(*data.rhs.dims)
+
+    status, condition = n.optimize.solve_model(**solver_kwargs)
+
+    result = {"sample": i, "status": status, "condition": condition}
+    result.update(dict(zip(features, lh[i])))
+    if status == "ok":
+        result.update(get_sample_metrics(n))
+    else:
+        logger.warning(
+            f"Sample {i} solved with status '{status}' and condition '{condition}'"
+        )
+    return result
+
+
+if __name__ == "__main__":
+    if "snakemake" not in globals():
+        from _helpers import mock_snakemake
+
+        snakemake = mock_snakemake(
+            "solve_monte_batch",
+            simpl="",
+            clusters="4",
+            ll="copt",
+            opts="Co2L-4H",
+        )
+    configure_logging(snakemake)
+
+    lh, features = get_experimental_design(snakemake.params.monte_carlo)
+    nprocesses = min(len(lh), snakemake.threads)
+
+    logger.info(f"Solving {len(lh)} Monte Carlo samples with {nprocesses} processes")
+
+    tqdm_kwargs = dict(ascii=False, desc="Solve Monte Carlo samples", unit=" sample")
+    kwargs = {
+        "initializer": _init_process_monte,
+        "initargs": (snakemake, lh, features),
+        "processes": nprocesses,
+    }
+    with mp.get_context("spawn").Pool(**kwargs) as pool:
+        results = list(
+            tqdm(
+                pool.imap_unordered(solve_sample, range(len(lh))),
+                total=len(lh),
+                **tqdm_kwargs,
+            )
+        )
+
+    samples = pd.DataFrame(results).set_index("sample").sort_index()
+    os.makedirs(os.path.dirname(snakemake.output[0]), exist_ok=True)
+    samples.to_csv(snakemake.output[0])
@@ -25,6 +25,7 @@ Relevant Settings
             max_iterations:
             skip_iterations:
             track_iterations:
+            linopy:
         solver:
             name:
 
@@ -80,12 +81,24 @@ Details (and errors made through this heuristic) are discussed in the paper
 import logging
 import os
 import re
+import shutil
+import tempfile
+import time
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 import pypsa
-from _helpers import configure_logging, create_logger, override_component_attrs
+import xarray as xr
+from _helpers import (
+    configure_logging,
+    create_logger,
+    export_network,
+    load_monte_carlo_sample,
+    override_component_attrs,
+    timed,
+)
+from linopy import LinearExpression
 from pypsa.descriptors import get_switchable_as_dense as get_as_dense
 from pypsa.linopf import (
     define_constraints,
@@ -97,11 +110,13 @@ from pypsa.linopf import (
     network_lopf,
 )
 from pypsa.linopt import define_constraints, get_var, join_exprs, linexpr
+from pypsa.optimization.constraints import define_kirchhoff_voltage_constraints
 
 logger = create_logger(__name__)
 pypsa.pf.logger.setLevel(logging.WARNING)
 
 
+@timed
 def prepare_network(n, solve_opts):
     if "clip_p_max_pu" in solve_opts:
         for df in (
@@ -928,6 +943,737 @@ def extra_functionality(n, snapshots):
     add_co2_sequestration_limit(n, snapshots)
 
 
+def _sum_by(expr, groups, dim, name):
+    """
+    Sum a linopy expression over ``dim`` by the groups given as pandas Series
+    indexed by the coordinates of ``dim``.
+
+    Coordinates without a group (NaN) are dropped, like in a pandas groupby.
+    """
+    if not isinstance(expr, LinearExpression):
+        expr = expr.to_linexpr()
+    if groups.isnull().any():
+        groups = groups.dropna()
+        expr = expr.sel({dim: groups.index.values})
+    # the index name of groups may differ from dim, e.g. "Generator-ext"
+    groups = xr.DataArray(groups.values, coords={dim: groups.index.values}, dims=dim)
+    return expr.groupby(groups.rename(name)).sum()
+
+
+def add_CCL_constraints_linopy(n, config):
+    agg_p_nom_limits = config["electricity"].get("agg_p_nom_limits")
+
+    try:
+        agg_p_nom_minmax = pd.read_csv(agg_p_nom_limits, index_col=list(range(2)))
+    except IOError:
+        logger.exception(
+            "Need to specify the path to a .csv file containing "
+            "aggregate capacity limits per country in "
+            "config['electricity']['agg_p_nom_limit']."
+        )
+    logger.info(
+        "Adding per carrier generation capacity constraints for " "individual countries"
+    )
+
+    gens = n.generators.query("p_nom_extendable")
+    # cc means country and carrier
+    cc_codes, cc_index = pd.factorize(
+        pd.MultiIndex.from_arrays([gens.bus.map(n.buses.country), gens.carrier])
+    )
+    p_nom_per_cc = _sum_by(
+        n.model["Generator-p_nom"],
+        pd.Series(cc_codes, gens.index),
+        "Generator-ext",
+        "cc",
+    )
+
+    for bound, sign in [("min", ">="), ("max", "<=")]:
+        limit = agg_p_nom_minmax[bound].dropna()
+        cc_i = cc_index.get_indexer(limit.index)
+        limit = limit[cc_i >= 0]
+        if limit.empty:
+            continue
+        rhs = xr.DataArray(limit.values, coords={"cc": cc_i[cc_i >= 0]}, dims="cc")
+        n.model.add_constraints(
+            p_nom_per_cc.sel(cc=rhs.cc), sign, rhs, name=f"agg_p_nom_{bound}"
+        )
+
+
+def add_EQ_constraints_linopy(n, o, scaling=1e-1):
+    float_regex = "[0-9]*\.?[0-9]+"
+    level = float(re.findall(float_regex, o)[0])
+    if o[-1] == "c":
+        ggrouper = n.generators.bus.map(n.buses.country)
+        lgrouper = n.loads.bus.map(n.buses.country)
+        sgrouper = n.storage_units.bus.map(n.buses.country)
+    else:
+        ggrouper = n.generators.bus
+        lgrouper = n.loads.bus
+        sgrouper = n.storage_units.bus
+    load = (
+        n.snapshot_weightings.generators
+        @ n.loads_t.p_set.groupby(lgrouper, axis=1).sum()
+    )
+    inflow = (
+        n.snapshot_weightings.stores
+        @ n.storage_units_t.inflow.groupby(sgrouper, axis=1).sum()
+    )
+    inflow = inflow.reindex(load.index).fillna(0.0)
+    rhs = scaling * (level * load - inflow)
+
+    lhs = _sum_by(
+        n.model["Generator-p"] * (n.snapshot_weightings.generators * scaling),
+        ggrouper,
+        "Generator",
+        "bus",
+    ).sum("snapshot")
+    if "StorageUnit-spill" in n.model.variables:
+        lhs_spill = _sum_by(
+            n.model["StorageUnit-spill"] * (-n.snapshot_weightings.stores * scaling),
+            sgrouper,
+            "StorageUnit",
+            "bus",
+        ).sum("snapshot")
+        lhs = lhs + lhs_spill.reindex(bus=lhs.indexes["bus"])
+
+    rhs = rhs.reindex(lhs.indexes["bus"]).rename_axis("bus")
+    n.model.add_constraints(lhs, ">=", rhs, name="equity_min")
+
+
+def add_BAU_constraints_linopy(n, config):
+    ext_c = n.generators.query("p_nom_extendable").carrier.unique()
+    carrier = n.generators.carrier[n.generators.p_nom_extendable]
+    lhs = _sum_by(n.model["Generator-p_nom"], carrier, "Generator-ext", "carrier")
+    carriers = lhs.indexes["carrier"]
+
+    mincaps = pd.Series(
+        config["electricity"].get("BAU_mincapacities", {key: 0 for key in ext_c})
+    )
+    n.model.add_constraints(
+        lhs, ">=", mincaps[carriers].rename_axis("carrier"), name="bau_mincaps"
+    )
+
+    maxcaps = pd.Series(
+        config["electricity"].get("BAU_maxcapacities", {key: np.inf for key in ext_c})
+    )
+    n.model.add_constraints(
+        lhs, "<=", maxcaps[carriers].rename_axis("carrier"), name="bau_maxcaps"
+    )
+
+
+def add_SAFE_constraints_linopy(n, config):
+    peakdemand = (
+        1.0 + config["electricity"]["SAFE_reservemargin"]
+    ) * n.loads_t.p_set.sum(axis=1).max()
+    conv = n.generators.carrier.isin(config["plotting"]["conv_techs"])
+    ext = n.generators.p_nom_extendable
+    exist_conv_caps = n.generators.p_nom[conv & ~ext].sum()
+    ext_gens_i = n.generators.index[conv & ext]
+    lhs = n.model["Generator-p_nom"].loc[ext_gens_i].sum()
+    rhs = peakdemand - exist_conv_caps
+    n.model.add_constraints(lhs, ">=", rhs, name="safe_mintotalcap")
+
+
+def add_operational_reserve_margin_linopy(n, sns, config):
+    """
+    Build reserve margin constraints based on the formulation given in
+    https://genxproject.github.io/GenX/dev/core/#Reserves.
+    """
+    reserve_config = config["electricity"]["operational_reserve"]
+    EPSILON_LOAD = reserve_config["epsilon_load"]
+    EPSILON_VRES = reserve_config["epsilon_vres"]
+    CONTINGENCY = reserve_config["contingency"]
+
+    # Reserve Variables
+    n.model.add_variables(
+        0, np.inf, coords=[sns, n.generators.index], name="Generator-r"
+    )
+    reserve = n.model["Generator-r"]
+    lhs = reserve.sum("Generator")
+
+    # Share of extendable renewable capacities
+    ext_i = n.generators.query("p_nom_extendable").index
+    vres_i = n.generators_t.p_max_pu.columns
+    capacity_variable = n.model["Generator-p_nom"].rename(
+        {"Generator-ext": "Generator"}
+    )
+    if not ext_i.empty and not vres_i.empty:
+        vres_ext_i = vres_i.intersection(ext_i)
+        capacity_factor = n.generators_t.p_max_pu[vres_ext_i].rename_axis(
+            index="snapshot", columns="Generator"
+        )
+        lhs = lhs + (
+            capacity_variable.loc[vres_ext_i]
+            * xr.DataArray(-EPSILON_VRES * capacity_factor)
+        ).sum("Generator")
+
+    # Total demand at t
+    demand = get_as_dense(n, "Load", "p_set", sns).sum(1)
+
+    # VRES potential of non extendable generators
+    capacity_factor = n.generators_t.p_max_pu[vres_i.difference(ext_i)]
+    renewable_capacity = n.generators.p_nom[vres_i.difference(ext_i)]
+    potential = (capacity_factor * renewable_capacity).sum(1)
+
+    # Right-hand-side
+    rhs = EPSILON_LOAD * demand + EPSILON_VRES * potential + CONTINGENCY
+
+    n.model.add_constraints(
+        lhs, ">=", rhs.rename_axis("snapshot"), name="Reserve_margin"
+    )
+
+    # Updated capacity constraint including the reserve
+    fix_i = n.generators.query("not p_nom_extendable").index
+    p_max_pu = get_as_dense(n, "Generator", "p_max_pu", sns).rename_axis(
+        index="snapshot", columns="Generator"
+    )
+
+    lhs = n.model["Generator-p"] + reserve
+    if not ext_i.empty:
+        lhs = lhs - capacity_variable * xr.DataArray(p_max_pu[ext_i])
+
+    rhs = (p_max_pu[fix_i] * n.generators.p_nom[fix_i]).reindex(
+        columns=n.generators.index, fill_value=0
+    )
+
+    n.model.add_constraints(
+        lhs, "<=", xr.DataArray(rhs), name="Generator-updated_capacity_constraint"
+    )
+
+
+def add_battery_constraints_linopy(n):
+    nodes = n.buses.index[n.buses.carrier == "battery"]
+    if nodes.empty or "Link-p_nom" not in n.model.variables:
+        return
+    link_p_nom = n.model["Link-p_nom"]
+    lhs = (
+        link_p_nom.loc[nodes + " charger"]
+        - link_p_nom.loc[nodes + " discharger"]
+        * n.links.loc[nodes + " discharger", "efficiency"].values
+    )
+    n.model.add_constraints(lhs, "=", 0, name="Link-charger_ratio")
+
+
+def add_RES_constraints_linopy(n, res_share):
+    lgrouper = n.loads.bus.map(n.buses.country)
+    ggrouper = n.generators.bus.map(n.buses.country)
+    sgrouper = n.storage_units.bus.map(n.buses.country)
+    cgrouper = n.links.bus0.map(n.buses.country)
+
+    logger.warning(
+        "The add_RES_constraints functionality is still work in progress. "
+        "Unexpected results might be incurred, particularly if "
+        "temporal clustering is applied or if an unexpected change of technologies "
+        "is subject to the obtimisation."
+    )
+
+    load = (
+        n.snapshot_weightings.generators
+        @ n.loads_t.p_set.groupby(lgrouper, axis=1).sum()
+    )
+
+    rhs = res_share * load
+
+    res_techs = [
+        "solar",
+        "onwind",
+        "offwind-dc",
+        "offwind-ac",
+        "battery",
+        "hydro",
+        "ror",
+    ]
+
+    gens_i = n.generators.index[n.generators.carrier.isin(res_techs)]
+    stores_i = n.storage_units.index[n.storage_units.carrier.isin(res_techs)]
+    charger_i = n.links.index[
+        n.links.carrier.isin(["H2 electrolysis", "battery charger"])
+    ]
+    discharger_i = n.links.index[
+        n.links.carrier.isin(["H2 fuel cell", "battery discharger"])
+    ]
+
+    weightings = n.snapshot_weightings
+
+    # Generators
+    lhs = _sum_by(
+        n.model["Generator-p"].loc[:, gens_i] * weightings.generators,
+        ggrouper[gens_i],
+        "Generator",
+        "country",
+    ).sum("snapshot")
+    countries = lhs.indexes["country"]
+
+    # StorageUnits
+    terms = []
+    if not stores_i.empty:
+        terms += [
+            _sum_by(
+                n.model["StorageUnit-p_dispatch"].loc[:, stores_i] * weightings.stores,
+                sgrouper[stores_i],
+                "StorageUnit",
+                "country",
+            ),
+            _sum_by(
+                n.model["StorageUnit-p_store"].loc[:, stores_i] * -weightings.stores,
+                sgrouper[stores_i],
+                "StorageUnit",
+                "country",
+            ),
+        ]
+
+    # Stores (or their resp. Link components)
+    # Note that the variables "p0" and "p1" currently do not exist.
+    # Thus, p0 and p1 must be derived from "p" (which exists), taking into account the link efficiency.
+    if not charger_i.empty:
+        terms.append(
+            _sum_by(
+                n.model["Link-p"].loc[:, charger_i] * -weightings.stores,
+                cgrouper[charger_i],
+                "Link",
+                "country",
+            )
+        )
+    if not discharger_i.empty:
+        efficiency = n.links.loc[discharger_i, "efficiency"].rename_axis("Link")
+        terms.append(
+            _sum_by(
+                n.model["Link-p"].loc[:, discharger_i]
+                * (xr.DataArray(weightings.stores) * xr.DataArray(efficiency)),
+                cgrouper[discharger_i],
+                "Link",
+                "country",
+            )
+        )
+
+    # signs of resp. terms are coded in the expressions.
+    # todo: for links (charge and discharge), account for snapshot weightings
+    for term in terms:
+        lhs = lhs + term.sum("snapshot").reindex(country=countries)
+
+    countries = countries.intersection(rhs.index)
+    n.model.add_constraints(
+        lhs.sel(country=countries),
+        "=",
+        rhs[countries].rename_axis("country"),
+        name="RES_share",
+    )
+
+
+def add_h2_network_cap_linopy(n, cap):
+    h2_network = n.links.loc[n.links.carrier == "H2 pipeline"]
+    if h2_network.index.empty or "Link-p_nom" not in n.model.variables:
+        return
+    h2_network_cap = n.model["Link-p_nom"]
+    subset_index = h2_network.index.intersection(h2_network_cap.indexes["Link-ext"])
+    lhs = (
+        h2_network_cap.loc[subset_index] * h2_network.loc[subset_index, "length"].values
+    ).sum()
+    rhs = cap * 1000
+    n.model.add_constraints(lhs, "<=", rhs, name="h2_network_cap")
+
+
+def H2_export_yearly_constraint_linopy(n):
+    res = [
+        "csp",
+        "rooftop-solar",
+        "solar",
+        "onwind",
+        "onwind2",
+        "offwind",
+        "offwind2",
+        "ror",
+    ]
+    res_index = n.generators.loc[n.generators.carrier.isin(res)].index
+
+    lhs = (
+        n.model["Generator-p"].loc[:, res_index] * n.snapshot_weightings.generators
+    ).sum()
+
+    load_ind = n.loads[n.loads.carrier == "AC"].index.intersection(
+        n.loads_t.p_set.columns
+    )
+
+    load = (
+        n.loads_t.p_set[load_ind].sum(axis=1) * n.snapshot_weightings["generators"]
+    ).sum()
+
+    h2_export = n.loads.loc["H2 export load"].p_set * 8760
+
+    include_country_load = snakemake.config["policy_config"]["yearly"][
+        "re_country_load"
+    ]
+
+    if include_country_load:
+        elec_efficiency = (
+            n.links.filter(like="Electrolysis", axis=0).loc[:, "efficiency"].mean()
+        )
+        rhs = h2_export * (1 / elec_efficiency) + load
+    else:
+        rhs = h2_export * (1 / 0.7)
+
+    n.model.add_constraints(lhs, ">=", rhs, name="H2ExportConstraint-RESproduction")
+
+
+def monthly_constraints_linopy(n, n_ref):
+    res_techs = [
+        "csp",
+        "rooftop-solar",
+        "solar",
+        "onwind",
+        "onwind2",
+        "offwind",
+        "offwind2",
+        "ror",
+    ]
+    allowed_excess = snakemake.config["policy_config"]["hydrogen"]["allowed_excess"]
+
+    res_index = n.generators.loc[n.generators.carrier.isin(res_techs)].index
+    electrolysis_i = n.links.index[n.links.index.str.contains("H2 Electrolysis")]
+    weightings = n.snapshot_weightings["generators"]
+    month = xr.DataArray(
+        n.snapshots.month, coords={"snapshot": n.snapshots}, dims="snapshot"
+    ).rename("month")
+
+    res = (n.model["Generator-p"].loc[:, res_index] * weightings).sum("Generator")
+    elec_input = (
+        n.model["Link-p"].loc[:, electrolysis_i] * (-allowed_excess * weightings)
+    ).sum("Link")
+
+    # a single constraint per month
+    lhs = (res + elec_input).groupby(month).sum()
+
+    if snakemake.config["policy_config"]["hydrogen"]["additionality"]:
+        res_ref = n_ref.generators_t.p[res_index].mul(weightings, axis=0)
+        res_ref = res_ref.groupby(n_ref.generators_t.p.index.month).sum().sum(axis=1)
+
+        elec_input_ref = n_ref.links_t.p0.loc[
+            :, n_ref.links_t.p0.columns.str.contains("H2 Electrolysis")
+        ].mul(weightings, axis=0)
+        elec_input_ref = (
+            -elec_input_ref.groupby(elec_input_ref.index.month).sum().sum(axis=1)
+        )
+
+        rhs = (res_ref + elec_input_ref).rename_axis("month")
+    else:
+        rhs = 0.0
+
+    n.model.add_constraints(lhs, ">=", rhs, name="RESconstraints-REStarget")
+
+
+def add_chp_constraints_linopy(n):
+    electric_bool = (
+        n.links.index.str.contains("urban central")
+        & n.links.index.str.contains("CHP")
+        & n.links.index.str.contains("electric")
+    )
+    heat_bool = (
+        n.links.index.str.contains("urban central")
+        & n.links.index.str.contains("CHP")
+        & n.links.index.str.contains("heat")
+    )
+
+    electric = n.links.index[electric_bool]
+    heat = n.links.index[heat_bool]
+
+    electric_ext = n.links.index[electric_bool & n.links.p_nom_extendable]
+    heat_ext = n.links.index[heat_bool & n.links.p_nom_extendable]
+
+    electric_fix = n.links.index[electric_bool & ~n.links.p_nom_extendable]
+    heat_fix = n.links.index[heat_bool & ~n.links.p_nom_extendable]
+
+    link_p = n.model["Link-p"]
+
+    if not electric_ext.empty:
+        link_p_nom = n.model["Link-p_nom"]
+
+        # ratio of output heat to electricity set by p_nom_ratio
+        lhs = (
+            link_p_nom.loc[electric_ext]
+            * (
+                n.links.loc[electric_ext, "efficiency"]
+                * n.links.loc[electric_ext, "p_nom_ratio"]
+            ).values
+            - link_p_nom.loc[heat_ext] * n.links.loc[heat_ext, "efficiency"].values
+        )
+
+        n.model.add_constraints(lhs, "=", 0, name="chplink-fix_p_nom_ratio")
+
+        # top_iso_fuel_line for extendable
+        lhs = (
+            link_p.loc[:, electric_ext]
+            + link_p.loc[:, heat_ext]
+            - link_p_nom.rename({"Link-ext": "Link"}).loc[electric_ext]
+        )
+
+        n.model.add_constraints(lhs, "<=", 0, name="chplink-top_iso_fuel_line_ext")
+
+    if not electric_fix.empty:
+        # top_iso_fuel_line for fixed
+        lhs = link_p.loc[:, electric_fix] + link_p.loc[:, heat_fix]
+
+        rhs = n.links.loc[electric_fix, "p_nom"]
+
+        n.model.add_constraints(lhs, "<=", rhs, name="chplink-top_iso_fuel_line_fix")
+
+    if not electric.empty:
+        # backpressure
+        lhs = (
+            link_p.loc[:, heat]
+            * (n.links.loc[heat, "efficiency"] * n.links.loc[electric, "c_b"].values)
+            - link_p.loc[:, electric] * n.links.loc[electric, "efficiency"]
+        )
+
+        n.model.add_constraints(lhs, "<=", 0, name="chplink-backpressure")
+
+
+def add_co2_sequestration_limit_linopy(n, sns):
+    co2_stores = n.stores.loc[n.stores.carrier == "co2 stored"].index
+
+    if co2_stores.empty or "Store-e" not in n.model.variables:
+        return
+
+    lhs = n.model["Store-e"].loc[sns[-1], co2_stores].sum()
+    rhs = (
+        n.config["sector"].get("co2_sequestration_potential", 5) * 1e6
+    )  # TODO change 200 limit (Europe)
+
+    n.model.add_constraints(lhs, "<=", rhs, name="co2_sequestration_limit")
+
+
+def set_h2_colors_linopy(n):
+    link_p = n.model["Link-p"]
+    blue_i = n.links.index[n.links.index.str.contains("blue H2")]
+    pink_i = n.links.index[n.links.index.str.contains("pink H2")]
+
+    fuelcell_ind = n.loads[n.loads.carrier == "land transport fuel cell"].index
+
+    other_ind = n.loads[
+        (n.loads.carrier == "H2 for industry")
+        | (n.loads.carrier == "H2 for shipping")
+        | (n.loads.carrier == "H2")
+    ].index
+
+    load_fuelcell = (
+        n.loads_t.p_set[fuelcell_ind].sum(axis=1) * n.snapshot_weightings["generators"]
+    ).sum()
+
+    load_other_h2 = n.loads.loc[other_ind].p_set.sum() * 8760
+
+    load_h2 = load_fuelcell + load_other_h2
+
+    weightings = n.snapshot_weightings["generators"]
+    total_blue = (link_p.loc[:, blue_i] * weightings).sum()
+    total_pink = (link_p.loc[:, pink_i] * weightings).sum()
+
+    rhs_blue = load_h2 * snakemake.config["sector"]["hydrogen"]["blue_share"]
+    rhs_pink = load_h2 * snakemake.config["sector"]["hydrogen"]["pink_share"]
+
+    n.model.add_constraints(total_blue, "=", rhs_blue, name="blue_h2_share")
+
+    n.model.add_constraints(total_pink, "=", rhs_pink, name="pink_h2_share")
+
+
+def extra_functionality_linopy(n, snapshots):
+    """
+    Collects supplementary constraints which will be passed to
+    ``pypsa.Network.optimize``.
+
+    Counterpart of :func:`extra_functionality` expressing the constraints as
+    vectorized linopy expressions on ``n.model``.
+    """
+    opts = n.opts
+    config = n.config
+
+    if "BAU" in opts and n.generators.p_nom_extendable.any():
+        add_BAU_constraints_linopy(n, config)
+    if "SAFE" in opts and n.generators.p_nom_extendable.any():
+        add_SAFE_constraints_linopy(n, config)
+    if "CCL" in opts and n.generators.p_nom_extendable.any():
+        add_CCL_constraints_linopy(n, config)
+    reserve = config["electricity"].get("operational_reserve", {})
+    if reserve.get("activate"):
+        add_operational_reserve_margin_linopy(n, snapshots, config)
+    for o in opts:
+        if "RES" in o:
+            res_share = float(re.findall("[0-9]*\.?[0-9]+$", o)[0])
+            add_RES_constraints_linopy(n, res_share)
+    for o in opts:
+        if "EQ" in o:
+            add_EQ_constraints_linopy(n, o)
+    add_battery_constraints_linopy(n)
+
+    temporal_matching = snakemake.config["policy_config"]["hydrogen"][
+        "temporal_matching"
+    ]
+    if temporal_matching == "h2_yearly_matching":
+        if snakemake.config["policy_config"]["hydrogen"]["additionality"] == True:
+            logger.info(
+                "additionality is currently not supported for yearly constraints, proceeding without additionality"
+            )
+        logger.info("setting h2 export to yearly greenness constraint")
+        H2_export_yearly_constraint_linopy(n)
+
+    elif temporal_matching == "h2_monthly_matching":
+        if not snakemake.config["policy_config"]["hydrogen"]["is_reference"]:
+            logger.info("setting h2 export to monthly greenness constraint")
+            monthly_constraints_linopy(n, n_ref)
+        else:
+            logger.info("preparing reference case for additionality constraint")
+
+    elif temporal_matching == "no_res_matching":
+        logger.info("no h2 export constraint set")
+
+    else:
+        raise ValueError(
+            'H2 export constraint is invalid, check config["policy_config"]'
+        )
+
+    if snakemake.config["sector"]["hydrogen"]["network"]:
+        if snakemake.config["sector"]["hydrogen"]["network_limit"]:
+            add_h2_network_cap_linopy(
+                n, snakemake.config["sector"]["hydrogen"]["network_limit"]
+            )
+
+    if snakemake.config["sector"]["hydrogen"]["set_color_shares"]:
+        logger.info("setting H2 color mix")
+        set_h2_colors_linopy(n)
+
+    add_co2_sequestration_limit_linopy(n, snapshots)
+
+
+def update_line_params(n, s_nom_prev, ext_i, base_s_nom):
+    """
+    Update the impedances of extendable lines according to their optimised
+    capacities, as done between the iterations of ``ilopf``.
+    """
+    typed_i = n.lines.query('type != ""').index
+    factor = n.lines.s_nom_opt / s_nom_prev
+    for attr, carrier in (("x", "AC"), ("r", "DC")):
+        ln_i = n.lines.query("carrier == @carrier").index.intersection(ext_i)
+        n.lines.loc[ln_i, attr] /= factor[ln_i]
+    ln_i = ext_i.intersection(typed_i)
+    n.lines.loc[ln_i, "num_parallel"] = (n.lines.s_nom_opt / base_s_nom)[ln_i]
+
+
+def update_kirchhoff_voltage_constraints(n, sns):
+    """
+    Replace the Kirchhoff voltage law constraints of the model in memory by
+    constraints using the current line impedances.
+    """
+    if "Kirchhoff-Voltage-Law" in n.model.constraints:
+        n.model.remove_constraints("Kirchhoff-Voltage-Law")
+    n.calculate_dependent_values()
+    define_kirchhoff_voltage_constraints(n, sns)
+
+
+def iterate_transmission_expansion(
+    n,
+    snapshots=None,
+    msq_threshold=0.05,
+    min_iterations=1,
+    max_iterations=100,
+    track_iterations=False,
+    extra_functionality=None,
+    solver_name="glpk",
+    solver_options={},
+    model_kwargs={},
+    **kwargs,
+):
+    """
+    Iterative linear optimization updating the line impedances according to
+    the optimised line capacities, on a single optimisation model.
+
+    In contrast to ``ilopf``, the model is built once and kept in memory.
+    Between the iterations only the Kirchhoff voltage law constraints, whose
+    coefficients depend on the line impedances, are rebuilt. For the final
+    iteration the line capacities are fixed through the variable bounds.
+    Solvers supporting it are warm started from the basis of the previous
+    iteration.
+    """
+    sns = n.snapshots if snapshots is None else snapshots
+
+    n.lines["carrier"] = n.lines.bus0.map(n.buses.carrier)
+    ext_i = n.get_extendable_i("Line")
+    typed_i = n.lines.query('type != ""').index
+    base_s_nom = (
+        np.sqrt(3)
+        * n.lines["type"].map(n.line_types.i_nom)
+        * n.lines.bus0.map(n.buses.v_nom)
+    )
+    ln_i = ext_i.intersection(typed_i)
+    n.lines.loc[ln_i, "num_parallel"] = (n.lines.s_nom / base_s_nom)[ln_i]
+
+    if track_iterations:
+        for c, attr in (("Line", "s_nom"), ("Link", "p_nom")):
+            n.df(c)[f"{attr}_opt_0"] = n.df(c)[attr]
+
+    start = time.time()
+    n.optimize.create_model(snapshots=sns, **model_kwargs)
+    if extra_functionality is not None:
+        extra_functionality(n, sns)
+    logger.info(f"Built optimisation model in {time.time() - start:.1f} s")
+
+    warmstart = solver_name in ["gurobi", "cplex", "xpress"]
+    basis_dir = tempfile.mkdtemp(dir=model_kwargs.get("solver_dir"))
+
+    def solve(iteration):
+        start = time.time()
+        basis_fn = os.path.join(basis_dir, f"basis_{iteration}.bas")
+        warmstart_fn = os.path.join(basis_dir, f"basis_{iteration - 1}.bas")
+        if warmstart:
+            kwargs["basis_fn"] = basis_fn
+            if os.path.isfile(warmstart_fn):
+                kwargs["warmstart_fn"] = warmstart_fn
+            else:
+                kwargs.pop("warmstart_fn", None)
+        status, condition = n.optimize.solve_model(
+            solver_name=solver_name, solver_options=solver_options, **kwargs
+        )
+        assert (
+            status == "ok"
+        ), f"Optimization failed with status {status} and condition {condition}"
+        logger.info(f"Iteration {iteration} solved in {time.time() - start:.1f} s")
+
+    iteration = 1
+    s_nom_prev = n.lines.s_nom.copy()
+    diff = msq_threshold
+    while diff >= msq_threshold or iteration < min_iterations:
+        if iteration > max_iterations:
+            logger.info(
+                f"Iteration {iteration} beyond max_iterations "
+                f"{max_iterations}. Stopping ..."
+            )
+            break
+
+        solve(iteration)
+
+        if track_iterations:
+            for c, attr in (("Line", "s_nom"), ("Link", "p_nom")):
+                n.df(c)[f"{attr}_opt_{iteration}"] = n.df(c)[f"{attr}_opt"]
+
+        update_line_params(n, s_nom_prev, ext_i, base_s_nom)
+        diff = (
+            np.sqrt((s_nom_prev - n.lines.s_nom_opt).pow(2).mean())
+            / n.lines["s_nom_opt"].mean()
+        )
+        logger.info(f"Mean square difference after iteration {iteration} is {diff}")
+        s_nom_prev = n.lines.s_nom_opt.copy()
+
+        update_kirchhoff_voltage_constraints(n, sns)
+        iteration += 1
+
+    # final iteration with fixed line capacities
+    if not ext_i.empty:
+        s_nom = n.model.variables["Line-s_nom"]
+        s_nom_opt = xr.DataArray(n.lines.s_nom_opt[ext_i].rename_axis("Line-ext"))
+        s_nom.lower = s_nom_opt
+        s_nom.upper = s_nom_opt
+        solve(iteration)
+
+    shutil.rmtree(basis_dir, ignore_errors=True)
+
+
 def solve_network(n, config, solving={}, opts="", **kwargs):
     set_of_options = solving["solver"]["options"]
     cf_solving = solving["options"]
@@ -943,7 +1689,37 @@ def solve_network(n, config, solving={}, opts="", **kwargs):
     n.config = config
     n.opts = opts
 
-    if cf_solving.get("skip_iterations", False):
+    if cf_solving.get("linopy", False):
+        # the linopy-based optimisation takes the solver directory and the
+        # solver log file under different keyword arguments
+        solver_dir = kwargs.pop("solver_dir", None)
+        solver_logfile = kwargs.pop("solver_logfile", None)
+        kwargs.setdefault("model_kwargs", {}).setdefault("solver_dir", solver_dir)
+        kwargs.setdefault("log_fn", solver_logfile)
+
+        if cf_solving.get("skip_iterations", False):
+            status, condition = n.optimize(
+                solver_name=solver_name,
+                solver_options=solver_options,
+                extra_functionality=extra_functionality_linopy,
+                **kwargs,
+            )
+            if status != "ok":
+                logger.warning(
+                    f"Solving status '{status}' with termination condition '{condition}'"
+                )
+        else:
+            iterate_transmission_expansion(
+                n,
+                solver_name=solver_name,
+                solver_options=solver_options,
+                track_iterations=track_iterations,
+                min_iterations=min_iterations,
+                max_iterations=max_iterations,
+                extra_functionality=extra_functionality_linopy,
+                **kwargs,
+            )
+    elif cf_solving.get("skip_iterations", False):
         network_lopf(
             n,
             solver_name=solver_name,
@@ -990,6 +1766,9 @@ if __name__ == "__main__":
     if is_sector_coupled:
         overrides = override_component_attrs(snakemake.input.overrides)
         n = pypsa.Network(snakemake.input.network, override_component_attrs=overrides)
+    elif "delta" in snakemake.input.keys():
+        # Monte Carlo sample stored as scaling factors of the base network
+        n = load_monte_carlo_sample(snakemake.input.network, snakemake.input.delta)
     else:
         n = pypsa.Network(snakemake.input.network)
 
@@ -1028,6 +1807,6 @@ if __name__ == "__main__":
         solver_logfile=snakemake.log.solver,
     )
     n.meta = dict(snakemake.config, **dict(wildcards=dict(snakemake.wildcards)))
-    n.export_to_netcdf(snakemake.output[0])
+    export_network(n, snakemake.output[0], **snakemake.config["network_io"])
     logger.info(f"Objective function: {n.objective}")
     logger.info(f"Objective constant: {n.objective_constant}")